@@ -0,0 +1,43 @@
+"""Benchmarks using synthetic data (see :mod:`twinotter.util.synthetic`)
+
+Run with asv (https://asv.readthedocs.io) from the repository root
+
+> asv run
+> asv publish
+
+or run the benchmarks for the current environment only with
+
+> asv run --python=same
+"""
+import datetime
+from pathlib import Path
+
+from twinotter.util import synthetic
+
+
+#: Sample rates (Hz) and flight durations (hours) used for the scaling benchmarks
+frequencies = [1, 10, 50]
+durations = [1, 4]
+
+
+def generate_flights(root="synthetic"):
+    """Generate a synthetic flight for each frequency and duration
+
+    Args:
+        root (str): The directory to write the flights to
+
+    Returns:
+        dict: The flight directory for each (frequency, duration)
+    """
+    flight_data_paths = dict()
+    for frequency in frequencies:
+        for hours in durations:
+            path = Path(root) / "{}hz_{}h".format(frequency, hours)
+            synthetic.generate_flight(
+                path,
+                frequency=frequency,
+                duration=datetime.timedelta(hours=hours),
+            )
+            flight_data_paths[(frequency, hours)] = str(path / "flight330")
+
+    return flight_data_paths
@@ -0,0 +1,41 @@
+import twinotter
+import twinotter.derive
+
+from . import durations, frequencies, generate_flights
+
+
+class Calculate:
+    params = (frequencies, durations, twinotter.derive.backends)
+    param_names = ["frequency", "hours", "backend"]
+    timeout = 600
+
+    def setup_cache(self):
+        return generate_flights()
+
+    def setup(self, flight_data_paths, frequency, hours, backend):
+        self.ds = twinotter.load_flight(
+            flight_data_paths[(frequency, hours)], frequency=frequency
+        )
+
+    def time_potential_temperature(self, flight_data_paths, frequency, hours, backend):
+        twinotter.derive.calculate(
+            "air_potential_temperature", self.ds, backend=backend
+        )
+
+    def time_equivalent_potential_temperature(
+        self, flight_data_paths, frequency, hours, backend
+    ):
+        twinotter.derive.calculate(
+            "equivalent_potential_temperature", self.ds, backend=backend
+        )
+
+    def time_calculate_many(self, flight_data_paths, frequency, hours, backend):
+        twinotter.derive.calculate_many(
+            [
+                "equivalent_potential_temperature",
+                "virtual_potential_temperature",
+                "relative_humidity",
+            ],
+            self.ds,
+            backend=backend,
+        )
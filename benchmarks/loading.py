@@ -0,0 +1,78 @@
+from pathlib import Path
+import tempfile
+
+import twinotter
+import twinotter.summary
+
+from . import durations, frequencies, generate_flights
+
+
+class LoadFlight:
+    params = (frequencies, durations)
+    param_names = ["frequency", "hours"]
+    timeout = 600
+
+    def setup_cache(self):
+        return generate_flights()
+
+    def time_load_flight(self, flight_data_paths, frequency, hours):
+        twinotter.load_flight(
+            flight_data_paths[(frequency, hours)], frequency=frequency
+        )
+
+    def peakmem_load_flight(self, flight_data_paths, frequency, hours):
+        twinotter.load_flight(
+            flight_data_paths[(frequency, hours)], frequency=frequency
+        )
+
+    def time_load_flight_variables(self, flight_data_paths, frequency, hours):
+        twinotter.load_flight(
+            flight_data_paths[(frequency, hours)],
+            frequency=frequency,
+            variables=["LAT_OXTS", "LON_OXTS", "ALT_OXTS"],
+        )
+
+
+class ExtractSegments:
+    params = (frequencies, durations)
+    param_names = ["frequency", "hours"]
+    timeout = 600
+
+    def setup_cache(self):
+        return generate_flights()
+
+    def setup(self, flight_data_paths, frequency, hours):
+        flight_data_path = flight_data_paths[(frequency, hours)]
+        self.ds = twinotter.load_flight(flight_data_path, frequency=frequency)
+        self.segments = twinotter.load_segments(
+            Path(flight_data_path) / "flight_segments.yaml"
+        )
+
+    def time_extract_segments(self, flight_data_paths, frequency, hours):
+        twinotter.extract_segments(self.ds, self.segments, "level")
+
+    def time_extract_each_segment(self, flight_data_paths, frequency, hours):
+        for n in range(twinotter.count_segments(self.segments, "level")):
+            twinotter.extract_segments(self.ds, self.segments, "level", segment_idx=n)
+
+
+class Summary:
+    params = (frequencies, durations)
+    param_names = ["frequency", "hours"]
+    number = 1
+    timeout = 600
+
+    def setup_cache(self):
+        return generate_flights()
+
+    def setup(self, flight_data_paths, frequency, hours):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.root = str(Path(flight_data_paths[(frequency, hours)]).parent)
+
+    def teardown(self, flight_data_paths, frequency, hours):
+        self.tempdir.cleanup()
+
+    def time_generate(self, flight_data_paths, frequency, hours):
+        twinotter.summary.generate(
+            self.root, str(Path(self.tempdir.name) / "flight_summary.csv")
+        )
@@ -0,0 +1,132 @@
+import datetime
+import io
+from pathlib import Path
+
+import numpy as np
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+import twinotter
+from twinotter import plots, quicklook
+from twinotter.external import goes
+from twinotter.plots import flight_track_frames
+from twinotter.util import synthetic
+
+from . import durations, frequencies, generate_flights
+
+
+class ColoredLinePlot:
+    params = (frequencies, durations)
+    param_names = ["frequency", "hours"]
+    timeout = 600
+
+    def setup_cache(self):
+        return generate_flights()
+
+    def setup(self, flight_data_paths, frequency, hours):
+        self.ds = twinotter.load_flight(
+            flight_data_paths[(frequency, hours)], frequency=frequency
+        )
+        self.fig, self.ax = plt.subplots()
+
+    def teardown(self, flight_data_paths, frequency, hours):
+        plt.close(self.fig)
+
+    def time_colored_line_plot(self, flight_data_paths, frequency, hours):
+        plots.colored_line_plot(
+            self.ax, self.ds.LON_OXTS, self.ds.LAT_OXTS, self.ds.ALT_OXTS
+        )
+
+    def time_colored_line_plot_draw(self, flight_data_paths, frequency, hours):
+        plots.colored_line_plot(
+            self.ax, self.ds.LON_OXTS, self.ds.LAT_OXTS, self.ds.ALT_OXTS
+        )
+        self.fig.canvas.draw()
+
+
+class GoesRegrid:
+    params = [0.05, 0.02, 0.01]
+    param_names = ["resolution"]
+    timeout = 600
+
+    time = datetime.datetime(2020, 1, 24, 14, 0)
+
+    def setup_cache(self):
+        synthetic.generate_goes("goes", time=self.time)
+        return "goes"
+
+    def setup(self, goes_path, resolution):
+        self.goes_data = goes.load_nc(goes_path, self.time).load()
+        self.lon = np.arange(-60, -56.4, resolution)
+        self.lat = np.arange(12, 14.4, resolution)
+
+    def time_regrid(self, goes_path, resolution):
+        # The interpolation weights are calculated on the first call and reused
+        flight_track_frames.regrid(self.goes_data, self.lon, self.lat)
+
+    def time_regrid_weights(self, goes_path, resolution):
+        goes.regrid.Regridder(
+            self.goes_data.longitude.values,
+            self.goes_data.latitude.values,
+            self.lon,
+            self.lat,
+        )
+
+
+class QuicklookSegment:
+    """Render the quicklook figures for each segment by updating a figure template"""
+
+    timeout = 600
+
+    def setup_cache(self):
+        return generate_flights()
+
+    def setup(self, flight_data_paths):
+        flight_data_path = flight_data_paths[(1, 1)]
+        ds = twinotter.load_flight(flight_data_path)
+        index = twinotter.SegmentIndex(
+            ds, twinotter.load_segments(Path(flight_data_path) / "flight_segments.yaml")
+        )
+        self.levels = [index.segment("level", n) for n in range(index.count("level"))]
+        self.profiles = [
+            index.segment("profile", n) for n in range(index.count("profile"))
+        ]
+
+        self.level_template = quicklook.LevelTemplate()
+        self.profile_template = quicklook.ProfileTemplate()
+
+    def teardown(self, flight_data_paths):
+        plt.close("all")
+
+    def time_level(self, flight_data_paths):
+        for ds in self.levels:
+            _render(self.level_template.update(ds))
+
+    def time_profile(self, flight_data_paths):
+        for ds in self.profiles:
+            _render(self.profile_template.update(ds))
+
+    def time_level_new_figure(self, flight_data_paths):
+        for ds in self.levels:
+            _render_and_close(quicklook.plot_level(ds))
+
+    def time_profile_new_figure(self, flight_data_paths):
+        for ds in self.profiles:
+            _render_and_close(quicklook.plot_profile(ds))
+
+
+def _render(figures):
+    # Draw the figures as they would be saved, without writing the files
+    for fig, name in figures:
+        fig.savefig(io.BytesIO(), format="png")
+
+
+def _render_and_close(figures):
+    # Figures created for each segment are closed after saving, as in the quicklook
+    # script before the figure templates
+    figures = list(figures)
+    _render(figures)
+    for fig, name in figures:
+        plt.close(fig)
@@ -49,6 +49,7 @@ setuptools.setup(
             "twinotter",
             "twinotter.plots",
             "twinotter.data",
+            "twinotter.derive",
             "twinotter.util",
             "twinotter.external",
             "twinotter.external.eurec4a",
@@ -0,0 +1,72 @@
+import pytest
+
+import twinotter
+import twinotter.cache
+
+
+def test_load_flight_cached(testdata, tmp_path):
+    cache_dir = tmp_path / "cache"
+    hits = twinotter.cache.stats["hits"]
+    misses = twinotter.cache.stats["misses"]
+
+    # The first load creates the cached file
+    ds1 = twinotter.load_flight(testdata["flight_data_path"], cache_dir=cache_dir)
+    assert twinotter.cache.stats["misses"] == misses + 1
+    assert len(list(cache_dir.glob("*.nc"))) == 1
+
+    # The second load uses it
+    ds2 = twinotter.load_flight(
+        testdata["flight_data_path"], cache_dir=cache_dir, variables=["ALT_OXTS"]
+    )
+    assert twinotter.cache.stats["hits"] == hits + 1
+
+    # The cached file is read lazily
+    assert not ds2.ALT_OXTS.variable._in_memory
+    assert (ds1.ALT_OXTS == ds2.ALT_OXTS).all()
+    assert (ds1.Time == ds2.Time).all()
+    assert ds2.attrs["flight_number"] == ds1.attrs["flight_number"]
+
+
+def test_load_flight_cached_chunks(testdata, tmp_path):
+    pytest.importorskip("dask")
+
+    # Chunks by data_point, as for the MASIN files, apply to the cached file
+    for n in range(2):
+        ds = twinotter.load_flight(
+            testdata["flight_data_path"],
+            cache_dir=tmp_path,
+            chunks=dict(data_point=1000),
+        )
+        assert ds.ALT_OXTS.chunks[0][0] == 1000
+
+
+def test_open_cached_load(testdata, tmp_path):
+    filename, meta = twinotter._find_flight_file(
+        testdata["flight_data_path"], 1, "most_recent", None
+    )
+    ds = twinotter.cache.open_cached(filename, meta, tmp_path, load=True)
+    assert ds.ALT_OXTS.variable._in_memory
+
+    # The cached file isn't kept open
+    twinotter.cache.evict(tmp_path, 0)
+    assert list(tmp_path.glob("*.nc")) == []
+    assert float(ds.ALT_OXTS.mean()) > 0
+
+
+def test_evict(testdata, tmp_path):
+    # Cache two different files then limit the cache size to one file
+    twinotter.load_flight(testdata["flight_data_file"], cache_dir=tmp_path)
+    twinotter.load_flight(testdata["flight_data_path"], revision=1, cache_dir=tmp_path)
+    files = sorted(tmp_path.glob("*.nc"), key=lambda p: p.stat().st_mtime)
+    assert len(files) == 2
+
+    twinotter.cache.evict(tmp_path, files[-1].stat().st_size)
+
+    assert list(tmp_path.glob("*.nc")) == [files[-1]]
+
+
+@pytest.mark.parametrize(
+    "size,expected", [(100, 100), ("100", 100), ("1.5kB", 1500), ("20 GB", 2e10)]
+)
+def test_parse_size(size, expected):
+    assert twinotter.cache.parse_size(size) == expected
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+import twinotter
+import twinotter.catalog
+
+
+def test_catalog(testdata, tmp_path):
+    db_path = tmp_path / "catalog.sqlite"
+    catalog = twinotter.catalog.Catalog(testdata["path"], db_path)
+
+    # r004 and the duplicate r001
+    assert len(catalog) == 2
+
+    entries = catalog.find(flight_number=330)
+    assert [entry["revision"] for entry in entries] == [4, 1]
+    assert entries[0]["meta"]["flight_num"] == "330"
+    assert "LON_OXTS" in entries[0]["variables"]
+
+    # Reopening the catalog doesn't read any files again
+    catalog = twinotter.catalog.Catalog(testdata["path"], db_path, refresh=False)
+    assert catalog.refresh() == dict(added=0, updated=0, removed=0)
+
+    # Changed and removed files are picked up
+    os.utime(testdata["flight_data_file"], ns=(0, 0))
+    os.remove(entries[1]["path"])
+    assert catalog.refresh() == dict(added=0, updated=1, removed=1)
+    assert len(catalog) == 1
+
+
+def test_load_flight_with_catalog(testdata):
+    catalog = twinotter.catalog.Catalog(testdata["path"])
+
+    ds = twinotter.load_flight(
+        testdata["flight_data_path"], variables=["ALT_OXTS"], catalog=catalog
+    )
+    assert ds.attrs["source_file"].name == "core_masin_20200124_r004_flight330_1hz.nc"
+
+    with pytest.raises(FileNotFoundError):
+        twinotter.load_flight(testdata["flight_data_path"], frequency=50, catalog=catalog)
+
+
+def test_generate_file_path_with_catalog(testdata):
+    catalog = twinotter.catalog.Catalog(testdata["path"])
+
+    path = twinotter.generate_file_path(
+        flight_number=330,
+        date="2020-01-24",
+        revision=4,
+        flight_data_path=testdata["path"],
+        catalog=catalog,
+    )
+    assert str(path) == os.path.abspath(testdata["flight_data_file"])
+
+    with pytest.raises(FileNotFoundError):
+        twinotter.generate_file_path(
+            flight_number=330,
+            date="2020-01-24",
+            revision=5,
+            flight_data_path=testdata["path"],
+            catalog=catalog,
+        )
+
+
+def test_catalog_shared(testdata, tmp_path):
+    # Catalogs of different directories in the same database only see their own
+    # files, even if a directory name matches another with wildcards
+    db_path = tmp_path / "catalog.sqlite"
+    masin_path = os.path.join(testdata["flight_data_path"], "MASIN")
+    for root in ["flight_1", "flightX1", "FLIGHT_1"]:
+        os.mkdir(tmp_path / root)
+        for filename in os.listdir(masin_path):
+            os.symlink(os.path.join(masin_path, filename), tmp_path / root / filename)
+
+    catalog = twinotter.catalog.Catalog(tmp_path / "flight_1", db_path)
+    assert len(catalog) == 2
+
+    other = twinotter.catalog.Catalog(tmp_path / "flightX1", db_path, refresh=False)
+    assert len(other) == 0
+    assert other.find() == []
+    assert other.refresh() == dict(added=2, updated=0, removed=0)
+
+    other = twinotter.catalog.Catalog(tmp_path / "FLIGHT_1", db_path, refresh=False)
+    assert len(other) == 0
+    assert len(catalog) == 2
@@ -1,9 +1,15 @@
+import datetime
+
 import pytest
 
 import numpy as np
+import metpy.calc
+from metpy.units import units
+import xarray as xr
 
 import twinotter
 import twinotter.derive
+import twinotter.derive.fast
 
 
 def test_calculate(testdata):
@@ -51,3 +57,260 @@ def test_calculate_equivalent(testdata, variable, function, arguments):
 def _filter_nans(array):
     # NaNs mess up array-wise equality checks
     return array.where(~np.isnan(array), drop=True)
+
+
+def test_plan(testdata):
+    ds = twinotter.load_flight(testdata["flight_data_path"])
+
+    steps = twinotter.derive.plan("virtual_potential_temperature", ds)
+    names = [step["name"] for step in steps]
+
+    # Each variable is calculated once, after the variables it depends on
+    assert len(names) == len(set(names))
+    assert names[-1] == "virtual_potential_temperature"
+    assert names.index("air_temperature") < names.index("air_potential_temperature")
+    assert steps[names.index("air_pressure")]["source"] == "translation"
+    assert steps[names.index("TAT_ND_R")]["source"] == "dataset"
+
+    # The same plan from only the variable names
+    assert (
+        twinotter.derive.plan("virtual_potential_temperature", variables=set(ds))
+        == steps
+    )
+
+
+def test_calculate_memo(testdata, monkeypatch):
+    ds = twinotter.load_flight(testdata["flight_data_path"])
+
+    # Count the number of times air_temperature is calculated
+    calls = []
+
+    def combine_temperatures(*args):
+        calls.append(args)
+        return twinotter.derive.combine_temperatures(*args)
+
+    monkeypatch.setitem(
+        twinotter.derive.available["air_temperature"][0],
+        "function",
+        combine_temperatures,
+    )
+
+    memo = dict()
+    twinotter.derive.calculate("equivalent_potential_temperature", ds, memo=memo)
+    twinotter.derive.calculate("virtual_potential_temperature", ds, memo=memo)
+
+    assert len(calls) == 1
+    assert "air_temperature" in memo
+
+
+def test_plan_cheapest(testdata):
+    ds = twinotter.load_flight(testdata["flight_data_path"])
+
+    # The LICOR recipe only needs one variable from the dataset
+    steps = twinotter.derive.plan("specific_humidity", ds)
+    assert steps[-1]["arguments"] == ["mole_fraction_of_water_vapor_in_air"]
+    assert twinotter.derive.cost(steps) == (1, 1)
+
+
+@pytest.mark.parametrize("avoid", ["H2O_LICOR", "mole_fraction_of_water_vapor_in_air"])
+def test_plan_avoid(testdata, avoid):
+    ds = twinotter.load_flight(testdata["flight_data_path"])
+
+    steps = twinotter.derive.plan("specific_humidity", ds, avoid=[avoid])
+    names = [step["name"] for step in steps]
+
+    assert "mole_fraction_of_water_vapor_in_air" not in names
+    assert steps[-1]["arguments"] == ["air_pressure", "dew_point_temperature"]
+
+    q = twinotter.derive.calculate("specific_humidity", ds, avoid=[avoid])
+    expected = metpy.calc.specific_humidity_from_dewpoint(ds.PS_AIR, ds.TDEW_BUCK)
+    assert (np.asarray(q.values) == np.asarray(expected.values)).all()
+
+
+def test_plan_avoid_impossible(testdata):
+    ds = twinotter.load_flight(testdata["flight_data_path"])
+
+    with pytest.raises(ValueError):
+        twinotter.derive.plan("specific_humidity", ds, avoid=["H2O_LICOR", "PS_AIR"])
+
+
+@pytest.mark.parametrize("keep_intermediates", [False, True])
+def test_calculate_many(testdata, monkeypatch, keep_intermediates):
+    ds = twinotter.load_flight(testdata["flight_data_path"])
+
+    # Count the number of times air_temperature is calculated
+    calls = []
+
+    def combine_temperatures(*args):
+        calls.append(args)
+        return twinotter.derive.combine_temperatures(*args)
+
+    monkeypatch.setitem(
+        twinotter.derive.available["air_temperature"][0],
+        "function",
+        combine_temperatures,
+    )
+
+    names = [
+        "equivalent_potential_temperature",
+        "virtual_potential_temperature",
+        "along_track_wind",
+        "specific_humidity",
+    ]
+    result = twinotter.derive.calculate_many(
+        names, ds, keep_intermediates=keep_intermediates
+    )
+
+    assert len(calls) == 1
+    assert isinstance(result, xr.Dataset)
+    assert ("air_temperature" in result) == keep_intermediates
+    for name in names:
+        assert name in result
+        assert result[name].attrs["standard_name"] == name
+        assert "units" in result[name].attrs
+
+    np.testing.assert_allclose(
+        result.along_track_wind, twinotter.derive.along_track_wind(ds)
+    )
+
+
+def test_calculate_append_intermediates(testdata):
+    ds = twinotter.load_flight(testdata["flight_data_path"])
+
+    theta = twinotter.derive.calculate(
+        "air_potential_temperature", ds, append_intermediates=True
+    )
+
+    assert "air_temperature" in ds
+    assert "air_potential_temperature" in ds
+    xr.testing.assert_identical(ds.air_potential_temperature, theta)
+    assert twinotter.derive.plan("air_potential_temperature", ds)[0]["source"] == (
+        "dataset"
+    )
+
+
+fast_units = dict(
+    air_potential_temperature="K",
+    equivalent_potential_temperature="K",
+    humidity_mixing_ratio="1",
+    relative_humidity="1",
+    virtual_potential_temperature="K",
+)
+
+
+@pytest.mark.parametrize(
+    "variable",
+    [
+        "air_potential_temperature",
+        "equivalent_potential_temperature",
+        "humidity_mixing_ratio",
+        "relative_humidity",
+        "virtual_potential_temperature",
+    ],
+)
+def test_calculate_fast(testdata, variable):
+    ds = twinotter.load_flight(testdata["flight_data_path"])
+
+    expected = twinotter.derive.calculate(variable, ds)
+    result = twinotter.derive.calculate(variable, ds, backend="fast")
+
+    # The fast backend keeps the float32 data from the MASIN files
+    assert result.dtype == ds.TAT_ND_R.dtype
+    assert result.attrs["units"] == fast_units[variable]
+    np.testing.assert_allclose(
+        result.values,
+        expected.data.m_as(fast_units[variable]),
+        rtol=1e-5,
+    )
+
+
+def test_calculate_fast_float64():
+    pressure = np.array([1000.0, 950.0, 850.0, 700.0]) * 100
+    temperature = np.array([300.0, 295.0, 288.0, 275.0])
+    dewpoint = np.array([295.0, 290.0, 280.0, 260.0])
+
+    theta_e = metpy.calc.equivalent_potential_temperature(
+        pressure * units.Pa, temperature * units.K, dewpoint * units.K
+    )
+
+    np.testing.assert_allclose(
+        twinotter.derive.fast.equivalent_potential_temperature(
+            pressure, temperature, dewpoint
+        ),
+        theta_e.m_as("K"),
+        rtol=1e-12,
+    )
+
+
+def test_fast_constants():
+    # The constants used without metpy.constants.nounit match the ones from it
+    constants = twinotter.derive.fast._nounit_constants()
+
+    for name, value in vars(constants).items():
+        np.testing.assert_allclose(
+            value, getattr(twinotter.derive.fast.constants, name), rtol=1e-12
+        )
+
+
+def test_calculate_unknown_backend(testdata):
+    ds = twinotter.load_flight(testdata["flight_data_path"])
+
+    with pytest.raises(ValueError):
+        twinotter.derive.calculate("air_potential_temperature", ds, backend="nonsense")
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_compute_to_file(testdata, tmp_path, processes):
+    names = ["equivalent_potential_temperature", "air_temperature"]
+    out_path = twinotter.derive.compute_to_file(
+        testdata["flight_data_path"],
+        names,
+        tmp_path / "derived.nc",
+        chunk=datetime.timedelta(minutes=7),
+        processes=processes,
+    )
+
+    ds = twinotter.load_flight(testdata["flight_data_path"])
+    with xr.open_dataset(out_path) as derived:
+        assert (derived.Time.values == ds.Time.values).all()
+        for name in names:
+            np.testing.assert_allclose(
+                derived[name].values,
+                np.asarray(twinotter.derive.calculate(name, ds).values),
+                rtol=1e-6,
+            )
+
+
+def test_compute_to_file_dataset(testdata, tmp_path):
+    ds = twinotter.load_flight(testdata["flight_data_path"])
+
+    out_path = twinotter.derive.compute_to_file(
+        ds,
+        ["relative_humidity"],
+        tmp_path / "derived.nc",
+        processes=1,
+        backend="fast",
+    )
+
+    expected = twinotter.derive.calculate("relative_humidity", ds, backend="fast")
+    with xr.open_dataset(out_path) as derived:
+        assert (derived.Time.values == expected.Time.values).all()
+        np.testing.assert_allclose(
+            derived.relative_humidity.values, expected.values, rtol=1e-6
+        )
+
+
+def test_compute_to_file_nonsense(testdata, tmp_path):
+    ds = twinotter.load_flight(testdata["flight_data_path"])
+
+    with pytest.raises(ValueError):
+        twinotter.derive.compute_to_file(ds, ["nonsense"], tmp_path / "derived.nc")
+
+    # The output file isn't created or overwritten
+    assert not (tmp_path / "derived.nc").exists()
+    (tmp_path / "derived.nc").write_text("existing")
+    with pytest.raises(ValueError):
+        twinotter.derive.compute_to_file(
+            testdata["flight_data_path"], ["nonsense"], tmp_path / "derived.nc"
+        )
+    assert (tmp_path / "derived.nc").read_text() == "existing"
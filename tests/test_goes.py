@@ -2,7 +2,9 @@ import pytest
 from unittest.mock import patch
 
 import datetime
+import numpy as np
 import pytz
+import xarray as xr
 
 import twinotter
 import twinotter.external.goes
@@ -39,3 +41,161 @@ def test_download_matching(mock_download_image, testdata):
         image_format="tiff",
         resolution=0.01,
     )
+
+
+def test_regridder(testdata, tmp_path, monkeypatch):
+    from scipy.interpolate import griddata
+
+    ds = twinotter.external.goes.load_nc(
+        path=testdata["goes_path"],
+        time=testdata["goes_time"],
+    )
+    # Include points outside the GOES data
+    lon = np.arange(-62, -56.4, 0.05)
+    lat = np.arange(9, 14.4, 0.05)
+    bands = ["refl_0_65um_nom", "refl_0_47um_nom"]
+
+    regridder = twinotter.external.goes.regrid.Regridder(
+        ds.longitude.values, ds.latitude.values, lon, lat, cache_dir=tmp_path
+    )
+    ds_grid = regridder(ds, bands)
+
+    lon_grid, lat_grid = np.meshgrid(lon, lat)
+    for band in bands:
+        expected = griddata(
+            (ds.longitude.values.flatten(), ds.latitude.values.flatten()),
+            ds[band].values.flatten(),
+            (lon_grid, lat_grid),
+        )
+        np.testing.assert_allclose(ds_grid[band].values, expected, rtol=1e-10)
+    assert np.isnan(ds_grid[bands[0]].values).any()
+
+    # The weights are read from the cache for the same coordinates
+    def weights(*args):
+        raise AssertionError("Recalculated cached weights")
+
+    monkeypatch.setattr(twinotter.external.goes.regrid, "_weights", weights)
+    cached = twinotter.external.goes.regrid.Regridder(
+        ds.longitude.values, ds.latitude.values, lon, lat, cache_dir=tmp_path
+    )
+    assert cached.key == regridder.key
+    xr.testing.assert_identical(cached(ds, bands), ds_grid)
+
+    # but not for a different grid
+    with pytest.raises(AssertionError):
+        twinotter.external.goes.regrid.Regridder(
+            ds.longitude.values, ds.latitude.values, lon, lat[1:], cache_dir=tmp_path
+        )
+
+
+def test_archive(tmp_path, monkeypatch):
+    from twinotter.util import synthetic
+
+    goes = twinotter.external.goes
+    times = [
+        datetime.datetime(2020, 1, 24, 14, 0) + n * goes.time_resolution
+        for n in range(3)
+    ]
+    for n, time in enumerate(times):
+        synthetic.generate_goes(tmp_path / "nc" / str(n), time=time, shape=(2, 2))
+        (tmp_path / goes.filename_at_time(time)).touch()
+    (tmp_path / goes.filename_at_time(times[0], layer="Reference_Labels")).touch()
+    (tmp_path / "unrelated.nc").touch()
+
+    index_path = tmp_path / "index.json"
+    archive = goes.archive.GoesArchive(tmp_path / "nc", index_path)
+    assert len(archive) == 3
+    assert archive.times() == times
+
+    # Exact lookups ignore the seconds
+    assert archive.find(times[1] + datetime.timedelta(seconds=30)).parent.name == "1"
+    assert archive.find(times[1].replace(tzinfo=pytz.utc)).parent.name == "1"
+    with pytest.raises(FileNotFoundError):
+        archive.find(times[1] + datetime.timedelta(minutes=1))
+
+    time, path = archive.nearest(times[1] + datetime.timedelta(minutes=4))
+    assert time == times[1] and path.parent.name == "1"
+    time, path = archive.nearest(times[1] + datetime.timedelta(minutes=5))
+    assert time == times[1]
+    time, path = archive.nearest(times[1] + datetime.timedelta(minutes=6))
+    assert time == times[2]
+    with pytest.raises(FileNotFoundError):
+        archive.nearest(
+            times[2] + datetime.timedelta(minutes=6),
+            tolerance=datetime.timedelta(minutes=5),
+        )
+
+    before, after = archive.bracket(times[0] + datetime.timedelta(minutes=3))
+    assert before[0] == times[0] and after[0] == times[1]
+    before, after = archive.bracket(times[1])
+    assert before[0] == times[1] and after[0] == times[2]
+    with pytest.raises(FileNotFoundError):
+        archive.bracket(times[2])
+
+    # The stored index is read instead of searching the directory again
+    def scan(root):
+        raise AssertionError("Searched an indexed directory")
+
+    monkeypatch.setattr(goes.archive, "scan", scan)
+    stored = goes.archive.GoesArchive(tmp_path / "nc", index_path)
+    assert stored.files() == archive.files()
+    assert stored.bracket(times[1]) == archive.bracket(times[1])
+
+    # GeoTIFF images are indexed by layer
+    monkeypatch.undo()
+    archive = goes.archive.GoesArchive(tmp_path)
+    assert archive.layers == [None, goes.default_layer, "Reference_Labels"]
+    assert archive.times(goes.default_layer) == times
+    assert goes.find_images_in_path(tmp_path) == sorted(
+        tmp_path.glob(goes.default_layer + "*")
+    )
+    assert len(goes.find_images_in_path(tmp_path, layer="*")) == 4
+
+
+def test_load_nc_new_file(tmp_path):
+    from twinotter.util import synthetic
+
+    time = datetime.datetime(2020, 1, 24, 14, 0)
+    path = synthetic.generate_goes(tmp_path, time=time, shape=(2, 2))
+    # Named like the AERIS files
+    assert path.name == (
+        "clavrx_OR_ABI-L1b-RadF-M6C01_G16_s20200241400165_BARBADOS-2KM-FD.level2.nc"
+    )
+    assert (
+        twinotter.external.goes.load_nc(tmp_path, time).sizes[
+            "scan_lines_along_track_direction"
+        ]
+        == 2
+    )
+
+    # Files added after the directory was indexed are found
+    time = time + twinotter.external.goes.time_resolution
+    synthetic.generate_goes(tmp_path, time=time, shape=(2, 2))
+    twinotter.external.goes.load_nc(tmp_path, time)
+
+    with pytest.raises(FileNotFoundError):
+        twinotter.external.goes.load_nc(
+            tmp_path, time + twinotter.external.goes.time_resolution
+        )
+
+
+def test_find_images_new_file(tmp_path, monkeypatch):
+    goes = twinotter.external.goes
+    monkeypatch.setenv("TWINOTTER_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(goes.archive, "_archives", dict())
+
+    image_path = tmp_path / "images"
+    image_path.mkdir()
+    time = datetime.datetime(2020, 1, 24, 14, 0)
+    (image_path / goes.filename_at_time(time)).touch()
+    assert len(goes.find_images_in_path(image_path)) == 1
+
+    # Images added later are found by this session and when the stored index is
+    # read in a new session
+    (image_path / goes.filename_at_time(time + goes.time_resolution)).touch()
+    assert len(goes.find_images_in_path(image_path)) == 2
+
+    monkeypatch.setattr(goes.archive, "_archives", dict())
+    (image_path / goes.filename_at_time(time + 2 * goes.time_resolution)).touch()
+    assert len(goes.find_images_in_path(image_path)) == 3
+    assert len(list((tmp_path / "cache").glob("goes_archive_*.json"))) == 1
@@ -1,7 +1,9 @@
+import datetime
 from unittest.mock import patch
 import pytest
 from pathlib import Path
 
+import numpy as np
 import matplotlib.pyplot as plt
 import cartopy.crs as ccrs
 
@@ -11,6 +13,7 @@ import twinotter.plots.vertical_profile
 import twinotter.plots.heights_and_legs
 import twinotter.quicklook
 import twinotter.external.goes
+from twinotter.util import synthetic
 
 
 @patch("matplotlib.pyplot.savefig")
@@ -85,3 +88,163 @@ def test_quicklook_plot(mock_savefig, testdata):
 # def test_interactive_flight_path(mock_show):
 # twinotter.plots.interactive_flight_track.start_gui(flight_data_path="obs/flight330")
 # mock_show.assert_called_once()
+
+
+def test_quicklook_parallel(testdata, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    twinotter.quicklook.generate_flights(
+        [
+            (testdata["flight_data_path"], testdata["flight_segments_file"]),
+        ],
+        jobs=2,
+    )
+
+    with open(testdata["flight_segments_file"]) as fh:
+        file_content = fh.read()
+        n_levels = len(file_content.split("level")) - 1
+        n_profiles = len(file_content.split("profile")) - 1
+
+    assert (tmp_path / "flight330__quicklook.png").exists()
+    assert (tmp_path / "flight330_profile_combined_skewt.png").exists()
+    for n in range(n_levels):
+        assert (tmp_path / "flight330_level{}_quicklook.png".format(n)).exists()
+    for n in range(n_profiles):
+        assert (tmp_path / "flight330_profile{}_skewt.png".format(n)).exists()
+
+
+def test_quicklook_template(testdata):
+    # The same figures are saved when reusing the figure templates
+    n_figures = len(plt.get_fignums())
+    calls = dict()
+    for template in [False, True]:
+        with patch("matplotlib.figure.Figure.savefig") as mock_savefig:
+            twinotter.quicklook.generate(
+                flight_data_path=testdata["flight_data_path"],
+                flight_segments_file=testdata["flight_segments_file"],
+                template=template,
+            )
+        calls[template] = mock_savefig.call_args_list
+
+    assert calls[True] == calls[False]
+    # The template figures are kept open for reuse
+    assert len(plt.get_fignums()) == n_figures + 6
+
+
+def test_quicklook_no_licor(testdata):
+    # No LICOR figure is created (and left open) for flights without LICOR data
+    ds = twinotter.load_flight(testdata["flight_data_path"])
+    ds = ds.drop_vars(["CO2_LICOR", "H2O_LICOR"])
+
+    n_figures = len(plt.get_fignums())
+    figures = twinotter.quicklook.plot_level(ds)
+    assert [name for fig, name in figures] == ["quicklook", "paluch"]
+
+    with patch("matplotlib.figure.Figure.savefig"):
+        twinotter.quicklook.savefigs(figures, 330, "level", 0)
+    assert len(plt.get_fignums()) == n_figures
+
+
+@pytest.fixture
+def synthetic_frames(tmp_path, monkeypatch):
+    # A short synthetic flight with GOES images. The land isn't drawn because the
+    # Natural Earth data may not be available
+    monkeypatch.setattr(twinotter.plots, "add_land_and_sea", lambda ax: None)
+
+    times = dict(
+        start=datetime.timedelta(hours=14), duration=datetime.timedelta(minutes=15)
+    )
+    synthetic.generate_flight(tmp_path, bad_fraction=0, **times)
+    synthetic.generate_goes_flight(tmp_path / "goes", shape=(60, 112), **times)
+
+    return dict(
+        flight_data_path=str(tmp_path / "flight330"),
+        goes_path=str(tmp_path / "goes"),
+        resolution=0.05,
+    )
+
+
+@pytest.mark.parametrize("prefetch", [0, 2])
+def test_flight_track_frames_video(synthetic_frames, tmp_path, monkeypatch, prefetch):
+    from PIL import Image
+
+    scenes = twinotter.plots.flight_track_frames.frame_times(
+        twinotter.load_flight(synthetic_frames["flight_data_path"])
+    )
+    n_frames = sum(len(frames) for scene_time, frames in scenes)
+    video = tmp_path / "frames.gif"
+
+    # Interrupt the video after the first GOES image
+    load_nc = twinotter.external.goes.load_nc
+
+    def load_first_nc(path, time):
+        if time > scenes[0][0]:
+            raise KeyboardInterrupt
+        return load_nc(path, time)
+
+    monkeypatch.setattr(twinotter.external.goes, "load_nc", load_first_nc)
+    with pytest.raises(KeyboardInterrupt):
+        twinotter.plots.flight_track_frames.generate(
+            video=video, prefetch=prefetch, **synthetic_frames
+        )
+    assert len(list(tmp_path.glob("frames.gif.parts/part_*.gif"))) == 1
+
+    # The flight data and figure aren't kept after generate returns
+    assert twinotter.plots.flight_track_frames._dataset is None
+    assert twinotter.plots.flight_track_frames._frame_renderer is None
+    n_figures = len(plt.get_fignums())
+
+    # The finished part isn't rendered again
+    def load_remaining_nc(path, time):
+        assert time > scenes[0][0]
+        return load_nc(path, time)
+
+    monkeypatch.setattr(twinotter.external.goes, "load_nc", load_remaining_nc)
+    twinotter.plots.flight_track_frames.generate(
+        video=video, prefetch=prefetch, **synthetic_frames
+    )
+
+    assert Image.open(video).n_frames == n_frames
+    assert not (tmp_path / "frames.gif.parts").exists()
+    assert twinotter.plots.flight_track_frames._frame_renderer is None
+    assert len(plt.get_fignums()) == n_figures
+
+
+def test_flight_track_frames_jobs(synthetic_frames, tmp_path):
+    output_path = tmp_path / "frames"
+    output_path.mkdir()
+    twinotter.plots.flight_track_frames.generate(
+        output_path=str(output_path), jobs=2, **synthetic_frames
+    )
+
+    scenes = twinotter.plots.flight_track_frames.frame_times(
+        twinotter.load_flight(synthetic_frames["flight_data_path"])
+    )
+    assert len(list(output_path.glob("*.png"))) == sum(
+        len(frames) for scene_time, frames in scenes
+    )
+
+
+def test_frame_renderer(synthetic_frames):
+    dataset = twinotter.load_flight(synthetic_frames["flight_data_path"])
+    scene_time, frames = twinotter.plots.flight_track_frames.frame_times(dataset)[1]
+    goes_data = twinotter.plots.flight_track_frames.regrid(
+        twinotter.external.goes.load_nc(synthetic_frames["goes_path"], scene_time),
+        lon=np.arange(-60, -56.4, 0.05),
+        lat=np.arange(12, 14.4, 0.05),
+    )
+
+    renderer = twinotter.plots.flight_track_frames.FrameRenderer(dataset)
+    renderer.set_goes_image(goes_data)
+    first = renderer.render(frames[0][1])
+    second = renderer.render(frames[1][1])
+
+    assert first.shape == second.shape
+    assert first.shape[-1] == 3
+    assert (first != second).any()
+
+    # Redrawing a frame gives the same pixels
+    np.testing.assert_array_equal(renderer.render(frames[0][1]), first)
+
+    with pytest.raises(KeyError):
+        renderer.render(frames[0][1] + datetime.timedelta(days=1))
+    plt.close(renderer.fig)
@@ -0,0 +1,55 @@
+import csv
+import json
+
+import pytest
+
+import twinotter
+from twinotter.util import profiling
+
+
+@pytest.fixture
+def profile():
+    profiling.reset()
+    profiling.enable()
+    yield
+    profiling.disable()
+    profiling.reset()
+
+
+def test_profiling(testdata, profile, tmp_path):
+    twinotter.load_flight(testdata["flight_data_path"])
+
+    stages = {stage["stage"]: stage for stage in profiling.report()}
+    for name in ["load_flight", "load_flight.open", "load_flight.qc"]:
+        assert stages[name]["calls"] == 1
+        assert stages[name]["peak_memory_mb"] > 0
+
+    # Nested stages take less time than the whole load
+    assert stages["load_flight.qc"]["total_time"] < stages["load_flight"]["total_time"]
+
+    profiling.write_report(tmp_path / "report.json")
+    with open(tmp_path / "report.json") as report_file:
+        assert json.load(report_file)["stages"] == profiling.report()
+
+    profiling.write_report(tmp_path / "report.csv")
+    with open(tmp_path / "report.csv") as report_file:
+        rows = list(csv.DictReader(report_file))
+    assert [row["stage"] for row in rows] == list(stages)
+
+
+def test_profiling_disabled(testdata):
+    profiling.reset()
+    twinotter.load_flight(testdata["flight_data_path"])
+
+    assert profiling.report() == []
+    assert profiling.span("load_flight") is profiling.span("derive")
+
+
+def test_profiling_workers(testdata, profile):
+    # Spans recorded in the worker processes are returned to this process
+    twinotter.load_campaign(testdata["path"], processes=2)
+
+    stages = {stage["stage"]: stage for stage in profiling.report()}
+    assert stages["load_campaign"]["calls"] == 1
+    assert stages["load_flight.open"]["calls"] == 1
+    assert stages["load_flight.qc"]["calls"] == 1
@@ -0,0 +1,51 @@
+import netCDF4
+import numpy as np
+import pytest
+
+import twinotter
+from twinotter.qc import QCPolicy
+
+
+def test_default_policy(testdata):
+    ds = twinotter.load_flight(testdata["flight_data_path"])
+
+    # Only good position data is kept and the flags keep their integer type
+    assert (ds.LON_OXTS_FLAG == 0).all()
+    assert ds.LON_OXTS.notnull().all()
+    assert np.issubdtype(ds.LON_OXTS_FLAG.dtype, np.integer)
+
+
+def test_mask_policy(testdata):
+    # Keep all data points but mask the bad position data
+    qc = QCPolicy(drop=[], mask=["LON_OXTS", "LAT_OXTS"])
+    ds = twinotter.load_flight(
+        testdata["flight_data_path"], variables=["LAT_OXTS", "ALT_OXTS"], qc=qc
+    )
+    ds_default = twinotter.load_flight(
+        testdata["flight_data_path"], variables=["LAT_OXTS", "ALT_OXTS"]
+    )
+
+    assert len(ds.Time) > len(ds_default.Time)
+    assert "LAT_OXTS_FLAG" in ds
+    assert ds.LAT_OXTS.where(ds.LAT_OXTS_FLAG != 0).isnull().all()
+    assert ds.LAT_OXTS.sel(Time=ds_default.Time).notnull().all()
+
+
+def test_accepted_values():
+    qc = QCPolicy(accepted=dict(LON_OXTS=(0, 1)))
+    assert qc.accepted_values("LON_OXTS") == [0, 1]
+    assert qc.accepted_values("LAT_OXTS") == [0]
+    assert qc.flag("LON_OXTS") == "LON_OXTS_FLAG"
+
+
+@pytest.mark.parametrize("variables", [None, ["ALT_OXTS", "TAT_ND_R"]])
+def test_mask_all_without_flag(testdata, variables):
+    # Not every MASIN variable has a flag. Those are left as they are
+    with netCDF4.Dataset(testdata["flight_data_file"], "a") as dataset:
+        dataset.renameVariable("ALT_OXTS_FLAG", "ALT_OXTS_QUALITY")
+
+    qc = QCPolicy(mask="all")
+    ds = twinotter.load_flight(testdata["flight_data_file"], variables=variables, qc=qc)
+
+    assert ds.ALT_OXTS.notnull().all()
+    assert ds.TAT_ND_R.where(ds.TAT_ND_R_FLAG != 0).isnull().all()
@@ -1,7 +1,12 @@
+import datetime
+import os
 import pytest
 import pathlib
 import tempfile
 
+import pandas as pd
+import xarray as xr
+
 import twinotter.summary
 
 
@@ -23,3 +28,180 @@ def test_summary(testdata):
     )
 
     return
+
+
+def test_summary_incremental(testdata, tmp_path, monkeypatch):
+    flight_summary_path = tmp_path / "summary.csv"
+
+    twinotter.summary.generate(testdata["flight_data_path"], flight_summary_path)
+    flight_summary = pd.read_csv(flight_summary_path)
+
+    # One row for each revision (r001 and r004)
+    assert list(flight_summary["Revision"]) == [1, 4]
+    assert (flight_summary["Flight Number"] == 330).all()
+    assert (flight_summary["Date"] == "2020-01-24").all()
+
+    # Unchanged files aren't read again
+    def read_header(path):
+        raise AssertionError("Read header of unchanged file {}".format(path))
+
+    monkeypatch.setattr(twinotter.summary, "read_header", read_header)
+    twinotter.summary.generate(testdata["flight_data_path"], flight_summary_path)
+    pd.testing.assert_frame_equal(pd.read_csv(flight_summary_path), flight_summary)
+
+    # Modified files are
+    monkeypatch.undo()
+    stat = os.stat(testdata["flight_data_file"])
+    os.utime(testdata["flight_data_file"], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    twinotter.summary.generate(testdata["flight_data_path"], flight_summary_path)
+
+    flight_summary = pd.read_csv(flight_summary_path)
+    assert len(flight_summary) == 2
+    assert flight_summary["Modified"].iloc[1] == stat.st_mtime_ns + 1
+
+
+def test_summary_existing_csv(testdata, tmp_path):
+    # Summary files from earlier versions only have the flight information
+    flight_summary_path = tmp_path / "summary.csv"
+    pd.DataFrame(
+        [[330, "2020-01-24", "0:00:00", "0:00:00", 4, 1]],
+        columns=["Flight Number", "Date", "Start", "End", "Revision", "Frequency"],
+    ).to_csv(flight_summary_path, index=False)
+
+    twinotter.summary.generate(testdata["flight_data_path"], flight_summary_path)
+
+    flight_summary = pd.read_csv(flight_summary_path)
+    assert list(flight_summary["Revision"]) == [1, 4]
+    assert flight_summary["Start"].iloc[1] == "0:00:00"
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_summary_extra(testdata, tmp_path, monkeypatch, processes):
+    flight_summary_path = tmp_path / "summary.csv"
+    twinotter.summary.generate(testdata["flight_data_path"], flight_summary_path)
+
+    # Existing entries get the extra columns. Use small blocks to check the ranges
+    # are combined correctly
+    monkeypatch.setattr(twinotter.summary, "_block_size", 1000)
+    twinotter.summary.generate(
+        testdata["flight_data_path"],
+        flight_summary_path,
+        extra=True,
+        processes=processes,
+    )
+
+    flight_summary = pd.read_csv(flight_summary_path)
+    assert list(flight_summary.columns) == (
+        twinotter.summary.columns + twinotter.summary.extra_columns
+    )
+
+    entry = flight_summary.iloc[1]
+    ds = xr.open_dataset(testdata["flight_data_file"])
+    assert entry["Samples"] == ds.sizes["data_point"]
+    assert pd.Timedelta(entry["Duration"]) == pd.Timedelta(entry["End"]) - pd.Timedelta(
+        entry["Start"]
+    )
+
+    good = ds.ALT_OXTS.where(ds.ALT_OXTS_FLAG == 0)
+    assert entry["Min Altitude"] == pytest.approx(float(good.min()))
+    assert entry["Max Altitude"] == pytest.approx(float(good.max()))
+    assert entry["Min Longitude"] < entry["Max Longitude"]
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".sqlite"])
+def test_summary_keep_extra(testdata, tmp_path, suffix):
+    flight_summary_path = tmp_path / ("summary" + suffix)
+    twinotter.summary.generate(
+        testdata["flight_data_path"], flight_summary_path, extra=True
+    )
+
+    # Changed files are read with the extra columns when running without extra
+    stat = os.stat(testdata["flight_data_file"])
+    os.utime(testdata["flight_data_file"], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    twinotter.summary.generate(testdata["flight_data_path"], flight_summary_path)
+
+    if suffix == ".csv":
+        flight_summary = pd.read_csv(flight_summary_path)
+        assert list(flight_summary.columns) == (
+            twinotter.summary.columns + twinotter.summary.extra_columns
+        )
+        samples = flight_summary["Samples"]
+        modified = flight_summary["Modified"]
+    else:
+        flights = twinotter.summary.query(flight_summary_path)
+        samples = flights["samples"]
+        modified = flights["mtime_ns"]
+
+    assert modified.iloc[1] == stat.st_mtime_ns + 1
+    assert samples.notna().all()
+
+
+@pytest.mark.parametrize("suffix", [".sqlite", ".db"])
+def test_summary_store(testdata, tmp_path, monkeypatch, suffix):
+    flight_summary_path = tmp_path / ("summary" + suffix)
+    twinotter.summary.generate(
+        testdata["flight_data_path"], flight_summary_path, extra=True
+    )
+
+    flights = twinotter.summary.query(flight_summary_path)
+    assert list(flights["revision"]) == [1, 4]
+    assert flights["start_time"].dtype.kind == "M"
+    assert flights["duration"].iloc[0] > datetime.timedelta(hours=1)
+    assert flights["samples"].dtype.kind == "i"
+
+    csv_path = tmp_path / "summary.csv"
+    twinotter.summary.generate(testdata["flight_data_path"], csv_path, extra=True)
+    assert (flights["samples"] == pd.read_csv(csv_path)["Samples"]).all()
+
+    # Unchanged files aren't read again
+    def read_header(path):
+        raise AssertionError("Read header of unchanged file {}".format(path))
+
+    monkeypatch.setattr(twinotter.summary, "read_header", read_header)
+    twinotter.summary.generate(
+        testdata["flight_data_path"], flight_summary_path, extra=True
+    )
+    pd.testing.assert_frame_equal(twinotter.summary.query(flight_summary_path), flights)
+
+
+@pytest.mark.parametrize(
+    "kwargs, revisions",
+    [
+        (dict(), [1, 4]),
+        (dict(revision="most_recent"), [4]),
+        (dict(revision=1), [1]),
+        (dict(flight_number=[330, 331]), [1, 4]),
+        (dict(flight_number=331), []),
+        (dict(date_range=("2020-01-24", None)), [1, 4]),
+        (dict(date_range=(None, datetime.date(2020, 1, 23))), []),
+        (dict(date_range=(None, datetime.datetime(2020, 1, 24, 12))), [1, 4]),
+        (dict(date_range=(pd.Timestamp("2020-01-24 12:00"), None)), [1, 4]),
+        (dict(date_range=("20200125", None)), []),
+        (dict(frequency=1, min_duration=datetime.timedelta(hours=1)), [1, 4]),
+        (dict(min_duration=datetime.timedelta(days=1)), []),
+    ],
+)
+def test_query(testdata, tmp_path, kwargs, revisions):
+    flight_summary_path = tmp_path / "summary.sqlite"
+    twinotter.summary.generate(testdata["flight_data_path"], flight_summary_path)
+
+    flights = twinotter.summary.query(
+        flight_summary_path, columns=["flight_number", "revision"], **kwargs
+    )
+    assert list(flights.columns) == ["flight_number", "revision"]
+    assert list(flights["revision"]) == revisions
+
+
+def test_query_unknown_column(testdata, tmp_path):
+    flight_summary_path = tmp_path / "summary.sqlite"
+    twinotter.summary.generate(testdata["flight_data_path"], flight_summary_path)
+
+    with pytest.raises(ValueError):
+        twinotter.summary.query(
+            flight_summary_path, columns=["revision", "1; DROP TABLE flights"]
+        )
+
+
+def test_query_missing(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        twinotter.summary.query(tmp_path / "summary.sqlite")
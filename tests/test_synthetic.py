@@ -0,0 +1,39 @@
+import datetime
+
+import numpy as np
+import xarray as xr
+
+import twinotter
+from twinotter.external import goes
+from twinotter.util import synthetic
+
+
+def test_generate_flight(tmp_path):
+    filename = synthetic.generate_flight(
+        tmp_path, frequency=10, duration=datetime.timedelta(hours=1)
+    )
+    assert filename.name == "core_masin_20200124_r004_flight330_10hz.nc"
+
+    # The integer units are in the raw file but fixed when loading
+    with xr.open_dataset(filename, decode_cf=False) as raw:
+        assert raw.LON_OXTS_FLAG.attrs["units"] == 1
+        assert raw.sizes["data_point"] == 36000
+
+    ds = twinotter.load_flight(tmp_path / "flight330", frequency=10)
+    assert 0 < ds.sizes["Time"] < 36000
+    assert ds.LON_OXTS.notnull().all()
+
+    segments = twinotter.load_segments(tmp_path / "flight330" / "flight_segments.yaml")
+    assert twinotter.count_segments(segments, "level") == 3
+    assert twinotter.count_segments(segments, "profile") == 4
+
+    leg = twinotter.extract_segments(ds, segments, "level", segment_idx=0)
+    np.testing.assert_allclose(leg.ALT_OXTS, synthetic.leg_altitudes[0])
+
+
+def test_generate_goes(tmp_path):
+    time = datetime.datetime(2020, 1, 24, 14, 0)
+    synthetic.generate_goes(tmp_path, time=time, shape=(30, 50))
+
+    goes_data = goes.load_nc(tmp_path, time)
+    assert goes_data.refl_0_65um_nom.shape == (30, 50)
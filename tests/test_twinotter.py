@@ -1,7 +1,12 @@
+import concurrent.futures
+import datetime
+
 import pytest
 
+import netCDF4
 import numpy as np
 import pandas as pd
+import xarray as xr
 
 import twinotter
 
@@ -33,6 +38,136 @@ def test_load_flight(testdata, load_from, revision):
     return
 
 
+def test_load_flight_variables(testdata):
+    ds = twinotter.load_flight(
+        flight_data_path=testdata["flight_data_path"],
+        variables=["ROLL_OXTS", "ALT_OXTS"],
+    )
+
+    # Only the requested variables and the QC variables are loaded
+    assert set(ds) == {"ROLL_OXTS", "ALT_OXTS", "LON_OXTS", "LON_OXTS_FLAG"}
+
+    # The same points are filtered as when loading the full dataset
+    ds_full = twinotter.load_flight(flight_data_path=testdata["flight_data_path"])
+    assert (ds.ALT_OXTS == ds_full.ALT_OXTS).all()
+
+
+def test_load_flight_lazy(testdata):
+    pytest.importorskip("dask")
+
+    ds = twinotter.load_flight(
+        flight_data_path=testdata["flight_data_path"],
+        variables=["ROLL_OXTS", "ALT_OXTS"],
+        chunks=dict(data_point=1000),
+    )
+    assert ds.ROLL_OXTS.chunks is not None
+
+    ds_full = twinotter.load_flight(flight_data_path=testdata["flight_data_path"])
+    assert (ds.ROLL_OXTS.values == ds_full.ROLL_OXTS.values).all()
+
+
+def test_load_flight_threaded(testdata):
+    # Load the same flight from multiple threads at once and check the result is the
+    # same as loading it in serial
+    filenames = [testdata["flight_data_file"]] * 8
+    variables = ["ALT_OXTS", "TAT_ND_R", "H2O_LICOR"]
+
+    def _load(filename):
+        return twinotter.load_flight(filename, variables=variables)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        datasets = list(executor.map(_load, filenames))
+
+    ds_serial = _load(testdata["flight_data_file"])
+    for ds in datasets:
+        xr.testing.assert_identical(ds, ds_serial)
+
+
+def test_iter_flight(testdata):
+    variables = ["ALT_OXTS", "TAT_ND_R"]
+    chunks = list(
+        twinotter.iter_flight(
+            testdata["flight_data_path"],
+            window=datetime.timedelta(minutes=30),
+            variables=variables,
+        )
+    )
+
+    # Joining the chunks gives the same data as loading the full flight
+    ds = twinotter.load_flight(testdata["flight_data_path"], variables=variables)
+    ds_chunks = xr.concat(chunks, dim="Time")
+    assert (ds_chunks.Time == ds.Time).all()
+    assert (ds_chunks.ALT_OXTS == ds.ALT_OXTS).all()
+
+    for chunk in chunks:
+        assert chunk.Time[-1] - chunk.Time[0] < np.timedelta64(30, "m")
+
+
+def test_iter_flight_overlap(testdata):
+    overlap = datetime.timedelta(minutes=1)
+    chunks = list(
+        twinotter.iter_flight(
+            testdata["flight_data_path"],
+            window=datetime.timedelta(minutes=30),
+            variables=["ALT_OXTS"],
+            overlap=overlap,
+        )
+    )
+
+    for chunk1, chunk2 in zip(chunks[:-1], chunks[1:]):
+        assert chunk2.Time[0] <= chunk1.Time[-1] - np.timedelta64(overlap)
+
+
+def test_iter_flight_all_flagged(testdata):
+    # Flag all the position data as bad so quality control leaves no data
+    with netCDF4.Dataset(testdata["flight_data_file"], "a") as dataset:
+        dataset["LON_OXTS_FLAG"][:] = 3
+
+    chunks = list(
+        twinotter.iter_flight(testdata["flight_data_file"], variables=["ALT_OXTS"])
+    )
+    assert chunks == []
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_load_campaign(testdata, processes):
+    datasets = twinotter.load_campaign(
+        testdata["path"], variables=["ALT_OXTS"], processes=processes
+    )
+    assert list(datasets) == [330]
+
+    # The most recent revision is used
+    ds = twinotter.load_flight(testdata["flight_data_file"], variables=["ALT_OXTS"])
+    xr.testing.assert_equal(datasets[330], ds)
+
+
+def test_load_campaign_combined(testdata):
+    ds = twinotter.load_campaign(
+        testdata["path"], variables=["ALT_OXTS"], combine=True, processes=1
+    )
+    assert ds.ALT_OXTS.dims == ("flight", "data_point")
+    assert list(ds.flight.values) == [330]
+
+
+def test_load_campaign_combined_attrs(testdata):
+    ds = twinotter.load_flight(testdata["flight_data_file"], variables=["ALT_OXTS"])
+    other = ds.isel(Time=slice(0, 10))
+    other.attrs = dict(ds.attrs, flight_number="331", extra="only in one flight")
+
+    combined = twinotter._stack_flights({330: ds, 331: other})
+
+    # Attributes that differ between flights are dropped
+    assert "flight_number" not in combined.attrs
+    assert "extra" not in combined.attrs
+    assert {key: ds.attrs[key] for key in combined.attrs} == combined.attrs
+    assert len(combined.attrs) == len(ds.attrs) - 1
+
+
+def test_load_campaign_empty_fails(testdata_empty):
+    with pytest.raises(FileNotFoundError):
+        twinotter.load_campaign(testdata_empty["flight_data_path"])
+
+
 def test_load_flight_empty_fails(testdata_empty):
     with pytest.raises(FileNotFoundError):
         twinotter.load_flight(flight_data_path=testdata_empty["flight_data_path"])
@@ -55,3 +190,42 @@ def test_extract_segments(testdata):
 
     ds_segs = twinotter.extract_segments(ds, flight_segments, "level")
     assert len(ds_segs.Time) == 5684
+
+
+@pytest.mark.parametrize("segment_type", ["level", "profile"])
+def test_segment_index(testdata, segment_type):
+    ds = twinotter.load_flight(flight_data_path=testdata["flight_data_path"])
+    flight_segments = twinotter.load_segments(testdata["flight_segments_file"])
+    index = twinotter.SegmentIndex(ds, flight_segments)
+
+    assert index.count(segment_type) == twinotter.count_segments(
+        flight_segments, segment_type
+    )
+
+    # Each segment matches selecting by time
+    segments = [
+        segment
+        for segment in flight_segments["segments"]
+        if segment_type in segment["kinds"]
+    ]
+    for n, segment in enumerate(segments):
+        ds_segment = ds.sel(Time=slice(segment["start"], segment["end"]))
+        xr.testing.assert_identical(index.segment(segment_type, n), ds_segment)
+
+    # The combined segments match concatenating each segment
+    ds_combined = xr.concat(
+        [ds_segment for _, ds_segment in index.iter_segments(segment_type)], dim="Time"
+    )
+    xr.testing.assert_identical(index.select(segment_type), ds_combined)
+
+    ds_ragged = index.ragged(segment_type)
+    assert ds_ragged.row_size.sum() == len(ds_combined.Time)
+    assert sum(len(batch) for batch in index.batches(segment_type, 3)) == len(segments)
+
+
+def test_segment_index_empty(testdata):
+    ds = twinotter.load_flight(flight_data_path=testdata["flight_data_path"])
+    index = twinotter.SegmentIndex(ds, dict(segments=[]))
+
+    assert index.count("level") == 0
+    assert len(index.select("level").Time) == 0
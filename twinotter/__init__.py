@@ -1,10 +1,17 @@
-from importlib import reload
+import concurrent.futures
+import datetime
+import os
 from pathlib import Path
 import re
 
 import yaml
+import numpy as np
+import pandas as pd
 import xarray as xr
-import xarray.conventions
+
+from .qc import QCPolicy, default_policy
+from .segments import SegmentIndex
+from .util import profiling
 
 
 # netCDF naming: core_masin_YYYYMMDD_rNNN_flightNNN_Nhz.nc
@@ -14,62 +21,88 @@ MASIN_CORE_RE = "core_masin_(?P<date>\d{8})_r(?P<revision>\d{3})_flight(?P<fligh
 # A nice way of formatting the flight time
 time_of_day_format = "{hours:02d}:{minutes:02d}:{seconds:02d}"
 
+#: Version of the loading and quality control in :func:`open_masin_dataset`. Increase
+#: this when the loaded data changes so that cached datasets are rebuilt
+LOADER_VERSION = 2
+
+
+@profiling.profiled("load_flight")
+def load_flight(
+    flight_data_path,
+    frequency=1,
+    revision="most_recent",
+    debug=False,
+    variables=None,
+    chunks=None,
+    cache_dir=None,
+    catalog=None,
+    qc=None,
+):
+    """Load the MASIN data for a single flight
 
-def _monkey_patch_xr_load():
-    # by the CF-convections units should always be a string
-    # http://cfconventions.org/Data/cf-conventions/cf-conventions-1.7/cf-conventions.html#units
-    # fix here as it breaks cf-convention loading in xarray otherwise
-
-    def _fix_var(var):
-        if var.attrs["units"] == 1:
-            var.attrs["units"] = "1"
-
-    _decode_variable_old = xr.conventions.decode_cf_variable
-
-    def _decode_cf_variable(name, var, *args, **kwargs):
-        _fix_var(var)
-        return _decode_variable_old(name=name, var=var, *args, **kwargs)
-
-    xr.conventions.decode_cf_variable = _decode_cf_variable
-
-    _decode_variables_old = xr.conventions.decode_cf_variables
-
-    def _decode_cf_variables(variables, *args, **kwargs):
-        for var in variables:
-            _fix_var(variables[var])
-        return _decode_variables_old(variables, *args, **kwargs)
-
-    xr.conventions.decode_cf_variables = _decode_cf_variables
+    Args:
+        flight_data_path (str): Either the path to a MASIN netCDF file or a flight
+            directory containing the MASIN files in a "MASIN" subdirectory
+        frequency (int): The frequency of the data to load (in Hz)
+        revision (int | str): The revision of the data to load. Default is
+            "most_recent"
+        debug (bool): Print the name of the loaded file
+        variables (list): The names of the variables to load. The variables needed
+            for quality control are always loaded as well. Default (None) loads all
+            variables
+        chunks (int | dict): If given, load the data lazily with dask using these
+            chunk sizes (see :func:`xarray.open_dataset`). Requires dask
+        cache_dir (str): Directory to cache the quality-controlled dataset in (see
+            :mod:`twinotter.cache`). Default is the `TWINOTTER_CACHE_DIR` environment
+            variable or no caching if that is not set
+        catalog (twinotter.catalog.Catalog): Find the file in this catalog rather
+            than searching the flight directory
+        qc (twinotter.qc.QCPolicy): How to filter bad data. Default is to drop the
+            data points without good position data
 
+    Returns:
+        xarray.Dataset:
+    """
+    filename, meta = _find_flight_file(flight_data_path, frequency, revision, catalog)
 
-def _unpatch_xr_load():
-    reload(xarray.conventions)
+    return _open_flight(filename, meta, debug, variables, chunks, cache_dir, qc)
 
 
-def load_flight(flight_data_path, frequency=1, revision="most_recent", debug=False):
-    # If a path to a netCDF file is specified just load it
+def _find_flight_file(flight_data_path, frequency, revision, catalog):
+    # If a path to a netCDF file is specified just use it
     if Path(flight_data_path).is_file():
         meta = re.match(MASIN_CORE_RE, Path(flight_data_path).name).groupdict()
-        return open_masin_dataset(flight_data_path, meta, debug=debug)
+        return flight_data_path, meta
 
     # Otherwise a directory is supplied so look for files that match within
     # the given directory
 
     # If you want to use the most recent revision, get the filenames of all the
     # revisions and choose the newest one
-    if revision == "most_recent":
-        revision = "*"
+    if catalog is not None:
+        entries = catalog.find(
+            frequency=frequency,
+            revision=None if revision == "most_recent" else revision,
+            directory=Path(flight_data_path) / "MASIN",
+        )
+        files = [entry["path"] for entry in entries]
+        meta = {entry["path"]: entry["meta"] for entry in entries}
+        if revision == "most_recent":
+            revision = "*"
     else:
-        revision = "{:03d}".format(revision)
+        if revision == "most_recent":
+            revision = "*"
+        else:
+            revision = "{:03d}".format(revision)
 
-    fn_pattern = MASIN_CORE_FORMAT.format(
-        date="*", revision=revision, flight_num="*", freq=frequency
-    )
-    files = list((Path(flight_data_path) / "MASIN").glob(fn_pattern))
+        fn_pattern = MASIN_CORE_FORMAT.format(
+            date="*", revision=revision, flight_num="*", freq=frequency
+        )
+        files = list((Path(flight_data_path) / "MASIN").glob(fn_pattern))
 
-    meta = {}
-    for file in files:
-        meta[file] = re.match(MASIN_CORE_RE, file.name).groupdict()
+        meta = {}
+        for file in files:
+            meta[file] = re.match(MASIN_CORE_RE, file.name).groupdict()
 
     if len(files) == 0:
         raise FileNotFoundError(
@@ -87,24 +120,62 @@ def load_flight(flight_data_path, frequency=1, revision="most_recent", debug=Fal
     else:
         filename = files[0]
 
-    ds = open_masin_dataset(filename, meta[filename], debug=debug)
+    return filename, meta[filename]
 
-    return ds
+
+def _open_flight(filename, meta, debug, variables, chunks, cache_dir, qc):
+    if cache_dir is None:
+        cache_dir = os.environ.get("TWINOTTER_CACHE_DIR")
+
+    if cache_dir is None:
+        return open_masin_dataset(
+            filename, meta, debug=debug, variables=variables, chunks=chunks, qc=qc
+        )
+    else:
+        from .cache import open_cached
+
+        return open_cached(
+            filename,
+            meta,
+            cache_dir,
+            variables=variables,
+            chunks=chunks,
+            debug=debug,
+            qc=qc,
+        )
 
 
-def open_masin_dataset(filename, meta, debug=False):
-    _monkey_patch_xr_load()
-    ds = xr.open_dataset(filename, decode_cf=True)
-    _unpatch_xr_load()
+def open_masin_dataset(
+    filename, meta, debug=False, variables=None, chunks=None, qc=None
+):
+    # Fix the attributes before decoding rather than patching xarray's decoding so
+    # that multiple files can be loaded at the same time from different threads
+    with profiling.span("load_flight.open"):
+        ds = xr.open_dataset(filename, decode_cf=False, chunks=chunks)
+        ds = xr.decode_cf(_fix_attributes(ds))
 
     if debug:
         print("Loaded {}".format(filename))
 
-    # drop points where lat/lon aren't given (which means the flag is 0
-    # "quality_good"
-    ds = ds.where(ds.LON_OXTS_FLAG == 0, drop=True)
-    # drop nans too...
-    ds = ds.where(~ds.LON_OXTS.isnull(), drop=True)
+    # Only keep the requested variables. The data is only read from file when it is
+    # filtered below so this avoids reading variables we don't need
+    if qc is None:
+        qc = default_policy
+
+    if variables is not None:
+        ds = ds[_required_variables(variables, qc, ds)]
+
+    # Unless loading lazily, read the data before removing the bad points. Indexing
+    # the netCDF file with the good points directly is much slower
+    if chunks is None:
+        with profiling.span("load_flight.read"):
+            ds = ds.load()
+
+    # Remove the bad data. By default this drops points where lat/lon aren't given
+    # (which means the flag is 0 "quality_good") or are NaN. Only the variables
+    # used to find the bad points are read if the dataset is loaded lazily
+    with profiling.span("load_flight.qc"):
+        ds = qc.apply(ds)
 
     # plot as function of time
     ds = ds.swap_dims(dict(data_point="Time"))
@@ -115,6 +186,286 @@ def open_masin_dataset(filename, meta, debug=False):
     return ds
 
 
+def _fix_attributes(ds):
+    # by the CF-convections units should always be a string
+    # http://cfconventions.org/Data/cf-conventions/cf-conventions-1.7/cf-conventions.html#units
+    # fix here as it breaks cf-convention loading in xarray otherwise
+    for var in ds.variables.values():
+        if var.attrs.get("units") == 1:
+            var.attrs["units"] = "1"
+
+    return ds
+
+
+def _required_variables(variables, qc, ds):
+    # The requested variables plus the time coordinate and the variables used for
+    # quality control that are in the dataset, without duplicates
+    return list(
+        dict.fromkeys(["Time"] + qc.required_variables(variables, ds) + list(variables))
+    )
+
+
+def iter_flight(
+    flight_data_path,
+    window=datetime.timedelta(minutes=10),
+    variables=None,
+    overlap=datetime.timedelta(0),
+    frequency=1,
+    revision="most_recent",
+    qc=None,
+):
+    """Iterate over the quality-controlled data of a flight in windows of time
+
+    Only the time and quality-control variables are read for the whole flight. The
+    other variables are read from the netCDF file one window at a time so the memory
+    used depends on the window length rather than the length of the flight. Each
+    window is a dataset indexed by Time like those returned by :func:`load_flight`
+    so it can be passed to :func:`twinotter.derive.calculate`.
+
+    Args:
+        flight_data_path (str): Either the path to a MASIN netCDF file or a flight
+            directory (see :func:`load_flight`)
+        window (datetime.timedelta): The length of time in each window
+        variables (list): The variables to load (see :func:`load_flight`)
+        overlap (datetime.timedelta): Extend each window by this length of time at
+            both ends, so consecutive windows share data
+        frequency (int): The frequency of the data to load (in Hz)
+        revision (int | str): The revision of the data to load. Default is
+            "most_recent"
+        qc (twinotter.qc.QCPolicy): How to filter bad data (see :func:`load_flight`)
+
+    Yields:
+        xarray.Dataset:
+    """
+    filename, meta = _find_flight_file(flight_data_path, frequency, revision, None)
+
+    ds = xr.open_dataset(filename, decode_cf=False)
+    ds = xr.decode_cf(_fix_attributes(ds))
+
+    if qc is None:
+        qc = default_policy
+
+    if variables is not None:
+        ds = ds[_required_variables(variables, qc, ds)]
+
+    # Indices and times of the good data points
+    idx_good = np.flatnonzero(qc.row_mask(ds))
+    times = ds.Time.values[idx_good]
+
+    window = np.timedelta64(window)
+    overlap = np.timedelta64(overlap)
+
+    try:
+        # No windows if all the data is bad
+        if len(times) == 0:
+            return
+
+        for window_start in np.arange(times[0], times[-1] + 1, window):
+            start, stop = np.searchsorted(
+                times, [window_start - overlap, window_start + window + overlap]
+            )
+            if start == stop:
+                continue
+
+            # Read the contiguous block covering the window then remove the bad points
+            idx = idx_good[start:stop]
+            with profiling.span("load_flight.read"):
+                ds_window = ds.isel(data_point=slice(idx[0], idx[-1] + 1)).load()
+            with profiling.span("load_flight.qc"):
+                ds_window = qc.apply(ds_window)
+            ds_window = ds_window.swap_dims(dict(data_point="Time"))
+
+            ds_window.attrs["source_file"] = filename
+            ds_window.attrs["flight_number"] = meta["flight_num"]
+
+            yield ds_window
+    finally:
+        ds.close()
+
+
+@profiling.profiled("load_campaign")
+def load_campaign(
+    root,
+    flights=None,
+    variables=None,
+    frequency=1,
+    revision="most_recent",
+    combine=False,
+    processes=None,
+    catalog=None,
+    qc=None,
+):
+    """Load the MASIN data for all flights found in a directory
+
+    The flights are loaded in parallel in separate processes so loading all flights
+    takes about as long as loading the largest flight.
+
+    Args:
+        root (str): The directory to search for MASIN files. Subdirectories are
+            searched as well
+        flights (list): The flight numbers to load. Default is all flights found
+        variables (list): The variables to load (see :func:`load_flight`)
+        frequency (int): The frequency of the data to load (in Hz)
+        revision (int | str): The revision of the data to load. Default is
+            "most_recent"
+        combine (bool): Return a single dataset stacked along a new "flight"
+            dimension rather than a dictionary of datasets. The flights are indexed
+            by sample number along the "data_point" dimension and padded with NaNs
+            to the length of the longest flight
+        processes (int): The number of processes to load the flights with. Default
+            is the number of CPUs. If 1 the flights are loaded in this process
+        catalog (twinotter.catalog.Catalog): Find the files in this catalog rather
+            than searching the directory
+        qc (twinotter.qc.QCPolicy): How to filter bad data (see :func:`load_flight`)
+
+    Returns:
+        dict | xarray.Dataset: A dictionary mapping flight number to dataset or a
+            single dataset if `combine` is True
+
+    Raises:
+        FileNotFoundError: If no MASIN files are found
+    """
+    files = find_flights(
+        root, flights=flights, frequency=frequency, revision=revision, catalog=catalog
+    )
+
+    if len(files) == 0:
+        raise FileNotFoundError("Couldn't find MASIN data in `{}`".format(root))
+
+    arguments = [(filename, meta, variables, qc) for filename, meta in files.values()]
+    if processes == 1:
+        datasets = [_load_into_memory(*args) for args in arguments]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            datasets = [
+                profiling.collect(result)
+                for result in executor.map(
+                    profiling.in_worker(_load_into_memory), *zip(*arguments)
+                )
+            ]
+
+    datasets = dict(zip(files, datasets))
+
+    if combine:
+        return _stack_flights(datasets)
+    else:
+        return datasets
+
+
+def find_flights(root, flights=None, frequency=1, revision="most_recent", catalog=None):
+    """Find the MASIN file for each flight in a directory
+
+    Args:
+        root (str): The directory to search for MASIN files. Subdirectories are
+            searched as well
+        flights (list): Only return these flight numbers. Default is all flights
+        frequency (int): The frequency of the data (in Hz)
+        revision (int | str): The revision of the data. Default is "most_recent"
+        catalog (twinotter.catalog.Catalog): Find the files in this catalog rather
+            than searching the directory
+
+    Returns:
+        dict: Mapping of flight number to a tuple of the filename and the information
+            parsed from the filename, sorted by flight number
+    """
+    if catalog is not None:
+        root = Path(root).absolute()
+        found = [
+            (entry["path"], entry["meta"])
+            for entry in catalog.find(
+                frequency=frequency,
+                revision=None if revision == "most_recent" else revision,
+            )
+            if root in entry["path"].parents
+        ]
+    else:
+        if revision == "most_recent":
+            fn_revision = "*"
+        else:
+            fn_revision = "{:03d}".format(revision)
+
+        fn_pattern = MASIN_CORE_FORMAT.format(
+            date="*", revision=fn_revision, flight_num="*", freq=frequency
+        )
+        found = [
+            (filename, re.match(MASIN_CORE_RE, filename.name).groupdict())
+            for filename in Path(root).rglob(fn_pattern)
+        ]
+
+    files = dict()
+    for filename, meta in found:
+        flight_number = int(meta["flight_num"])
+
+        if flights is not None and flight_number not in flights:
+            continue
+
+        # Keep the most recent revision of each flight
+        if flight_number in files:
+            if revision != "most_recent":
+                raise FileExistsError(
+                    "More than one MASIN file was found: `{}`, `{}`".format(
+                        files[flight_number][0], filename
+                    )
+                )
+            if files[flight_number][1]["revision"] > meta["revision"]:
+                continue
+
+        files[flight_number] = (filename, meta)
+
+    return dict(sorted(files.items()))
+
+
+def _load_into_memory(filename, meta, variables, qc):
+    # Used by load_campaign. Load the data before it is returned from the worker
+    # process so the dataset isn't tied to an open file
+    ds = _open_flight(
+        filename,
+        meta,
+        debug=False,
+        variables=variables,
+        chunks=None,
+        cache_dir=None,
+        qc=qc,
+    )
+    return ds.load()
+
+
+def _stack_flights(datasets):
+    # Each flight covers a different time period so index the flights by the
+    # sample number and keep Time as a coordinate
+    n_max = max(ds.sizes["Time"] for ds in datasets.values())
+
+    stacked = []
+    for ds in datasets.values():
+        ds = ds.swap_dims(dict(Time="data_point"))
+        ds = ds.pad(data_point=(0, n_max - ds.sizes["data_point"]))
+        stacked.append(ds)
+
+    ds = xr.concat(
+        stacked,
+        dim=pd.Index(list(datasets), name="flight"),
+        combine_attrs="override",
+    )
+
+    # Only keep the attributes that are the same for all flights
+    attrs = [other.attrs for other in stacked]
+    ds.attrs = {
+        key: value
+        for key, value in attrs[0].items()
+        if all(key in other and _equal(other[key], value) for other in attrs[1:])
+    }
+
+    return ds
+
+
+def _equal(a, b):
+    # Compare attribute values, which can be arrays
+    try:
+        return bool(np.array_equal(a, b))
+    except TypeError:
+        return False
+
+
 def load_segments(filename):
     """Read a segments yaml file created with twinotter.plots.interactive_flight_track
 
@@ -148,6 +499,7 @@ def count_segments(segments, segment_type):
     return len(_matching_segments(segments, segment_type))
 
 
+@profiling.profiled("extract_segments")
 def extract_segments(ds, segments, segment_type, segment_idx=None):
     """Extract a subset of the given dataset with the segments requested
 
@@ -163,25 +515,20 @@ def extract_segments(ds, segments, segment_type, segment_idx=None):
         xarray.DataSet:
 
     """
-    # All segments of the requested type
-    matching_segments = _matching_segments(segments, segment_type)
+    # Use a SegmentIndex directly to extract multiple segments from the same dataset
+    index = SegmentIndex(ds, segments)
 
     # If a single index is requested return that index of legs with the requested type
     if segment_idx is not None:
-        segment = matching_segments[segment_idx]
-        return ds.sel(Time=slice(segment["start"], segment["end"]))
+        return index.segment(segment_type, segment_idx)
 
     # Otherwise merge all legs with the requested type
     else:
-        ds_matching = []
-        for segment in matching_segments:
-            ds_matching.append(ds.sel(Time=slice(segment["start"], segment["end"])))
-
-        return xr.concat(ds_matching, dim="Time")
+        return index.select(segment_type)
 
 
 def generate_file_path(
-    flight_number, date, frequency=1, revision=1, flight_data_path=None
+    flight_number, date, frequency=1, revision=1, flight_data_path=None, catalog=None
 ):
     # Make the filename
     filename = MASIN_CORE_FORMAT.format(
@@ -191,8 +538,22 @@ def generate_file_path(
         revision="{:03d}".format(revision),
     )
 
-    # Find all matching files in the obs directory
-    file_path = list(Path(flight_data_path).rglob(filename))
+    # Find all matching files in the obs directory. Use the catalog if given to
+    # avoid searching the directory for every file
+    if catalog is not None:
+        root = Path(flight_data_path).absolute()
+        file_path = [
+            entry["path"]
+            for entry in catalog.find(
+                flight_number=flight_number,
+                date=date,
+                frequency=frequency,
+                revision=revision,
+            )
+            if root in entry["path"].parents
+        ]
+    else:
+        file_path = list(Path(flight_data_path).rglob(filename))
 
     # Should only be one of these files
     if len(file_path) == 1:
@@ -0,0 +1,261 @@
+"""
+On-disk cache of quality-controlled MASIN datasets
+
+Loading a flight with :func:`twinotter.load_flight` decodes the netCDF file,
+filters the bad data and swaps the dimensions to Time every time. If a cache
+directory is given (either with the `cache_dir` argument or the
+`TWINOTTER_CACHE_DIR` environment variable) the filtered dataset is stored as a
+compressed netCDF file and later loads open that file lazily instead (with dask if
+`chunks` is given).
+
+Cached files are keyed on the source path, size, modification time and
+:data:`twinotter.LOADER_VERSION` so they are rebuilt when either the data or the
+loader changes. The total size of the cache can be limited with the
+`TWINOTTER_CACHE_MAX_SIZE` environment variable (e.g. "20GB") in which case the
+least recently used files are removed first.
+
+To fill the cache for a whole campaign
+
+> python -m twinotter.cache /path/to/obs --cache-dir /path/to/cache
+"""
+import hashlib
+import os
+from pathlib import Path
+import re
+
+import xarray as xr
+
+from . import (
+    open_masin_dataset,
+    _required_variables,
+    default_policy,
+    LOADER_VERSION,
+    MASIN_CORE_FORMAT,
+    MASIN_CORE_RE,
+)
+from .util import profiling
+
+
+#: Number of cache hits and misses in this session
+stats = dict(hits=0, misses=0)
+
+size_units = dict(B=1, KB=1e3, MB=1e6, GB=1e9, TB=1e12)
+
+
+def main():
+    import argparse
+
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("flight_data_path", nargs="+")
+    argparser.add_argument("--cache-dir", default=os.environ.get("TWINOTTER_CACHE_DIR"))
+    argparser.add_argument("--frequency", default="*")
+    argparser.add_argument(
+        "--max-size", default=os.environ.get("TWINOTTER_CACHE_MAX_SIZE")
+    )
+
+    profiling.add_argument(argparser)
+    args = argparser.parse_args()
+    profiling.start(args.profile)
+
+    if args.cache_dir is None:
+        argparser.error("Specify --cache-dir or set TWINOTTER_CACHE_DIR")
+
+    warm(
+        args.flight_data_path,
+        cache_dir=args.cache_dir,
+        frequency=args.frequency,
+        max_size=args.max_size,
+    )
+
+    return
+
+
+def warm(flight_data_paths, cache_dir, frequency="*", max_size=None):
+    """Add all MASIN files found in the given paths to the cache
+
+    Args:
+        flight_data_paths (list): Directories to search for MASIN files
+        cache_dir (str): The cache directory
+        frequency (int | str): Only cache files with this frequency. Default is all
+            frequencies
+        max_size (int | str): The maximum total size of the cache
+    """
+    fn_pattern = MASIN_CORE_FORMAT.format(
+        date="*", revision="*", flight_num="*", freq=frequency
+    )
+
+    for flight_data_path in flight_data_paths:
+        for filename in sorted(Path(flight_data_path).rglob(fn_pattern)):
+            meta = re.match(MASIN_CORE_RE, filename.name).groupdict()
+            ds = open_cached(filename, meta, cache_dir, max_size=max_size, debug=True)
+            ds.close()
+
+    print("Cache hits: {hits}, misses: {misses}".format(**stats))
+
+    return
+
+
+def open_cached(
+    filename,
+    meta,
+    cache_dir,
+    variables=None,
+    chunks=None,
+    max_size=None,
+    debug=False,
+    qc=None,
+    load=False,
+):
+    """Open the cached copy of the MASIN file, creating it if it doesn't exist
+
+    The cached file is opened lazily so only the data used is read
+
+    Args:
+        filename (str): The MASIN netCDF file
+        meta (dict): The information parsed from the filename
+        cache_dir (str): The cache directory
+        variables (list): See :func:`twinotter.load_flight`
+        chunks (int | dict): See :func:`twinotter.load_flight`
+        max_size (int | str): The maximum total size of the cache. Default is no
+            limit unless `TWINOTTER_CACHE_MAX_SIZE` is set
+        debug (bool): Report cache hits and misses
+        qc (twinotter.qc.QCPolicy): See :func:`twinotter.load_flight`. Datasets
+            filtered with different policies are cached separately
+        load (bool): Read the data into memory and close the cached file, e.g. if
+            the cache may be evicted while the dataset is still used
+
+    Returns:
+        xarray.Dataset:
+    """
+    if qc is None:
+        qc = default_policy
+
+    path = cache_path(filename, cache_dir, qc)
+
+    if path.exists():
+        stats["hits"] += 1
+        if debug:
+            print("Cache hit for {}".format(filename))
+
+        # Update the modification time so eviction removes the least recently used
+        # files first
+        os.utime(path)
+    else:
+        stats["misses"] += 1
+        if debug:
+            print("Cache miss for {}".format(filename))
+
+        ds = open_masin_dataset(filename, meta, debug=debug, qc=qc)
+        _write(ds, path)
+        ds.close()
+
+        if max_size is None:
+            max_size = os.environ.get("TWINOTTER_CACHE_MAX_SIZE")
+        if max_size is not None:
+            evict(cache_dir, max_size, keep=[path])
+
+    # The cached file is indexed by Time rather than data_point
+    if isinstance(chunks, dict) and "data_point" in chunks:
+        chunks = dict(chunks)
+        chunks["Time"] = chunks.pop("data_point")
+
+    ds = xr.open_dataset(path, chunks=chunks)
+    if variables is not None:
+        ds = ds[_required_variables(variables, qc, ds)]
+
+    if load:
+        ds.load()
+        ds.close()
+
+    ds.attrs["source_file"] = filename
+    ds.attrs["flight_number"] = meta["flight_num"]
+
+    return ds
+
+
+def cache_key(filename, qc=default_policy):
+    """Unique key for the current state of the source file and loader
+
+    Args:
+        filename (str):
+        qc (twinotter.qc.QCPolicy):
+
+    Returns:
+        str:
+    """
+    filename = Path(filename).resolve()
+    stat = filename.stat()
+    key = "{}:{}:{}:{}:{!r}".format(
+        filename, stat.st_size, stat.st_mtime_ns, LOADER_VERSION, qc
+    )
+
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def cache_path(filename, cache_dir, qc=default_policy):
+    return Path(cache_dir) / "{}_{}.nc".format(
+        Path(filename).stem, cache_key(filename, qc)
+    )
+
+
+def evict(cache_dir, max_size, keep=()):
+    """Remove the least recently used files until the cache is below max_size
+
+    Args:
+        cache_dir (str): The cache directory
+        max_size (int | str): The maximum total size in bytes, or a string with
+            units, e.g. "20GB"
+        keep (list): Files that should not be removed
+    """
+    max_size = parse_size(max_size)
+
+    files = sorted(Path(cache_dir).glob("*.nc"), key=lambda p: p.stat().st_mtime)
+    total_size = sum(p.stat().st_size for p in files)
+
+    for path in files:
+        if total_size <= max_size:
+            break
+        if path in keep:
+            continue
+
+        total_size -= path.stat().st_size
+        path.unlink()
+
+    return
+
+
+def parse_size(size):
+    """Convert a size such as "500MB" to a number of bytes"""
+    if isinstance(size, str):
+        match = re.match(r"\s*([\d.]+)\s*([KMGT]?B)?\s*$", size.upper())
+        if match is None:
+            raise ValueError("Can not parse size {}".format(size))
+        value, unit = match.groups()
+        return int(float(value) * size_units[unit or "B"])
+    else:
+        return int(size)
+
+
+def _write(ds, path):
+    ds = ds.copy()
+    ds.attrs["source_file"] = str(ds.attrs["source_file"])
+
+    # Drop the encoding of the source file (chunk sizes etc.) and compress instead
+    encoding = dict()
+    for name in ds.variables:
+        ds[name].encoding = dict()
+        if name not in ds.dims:
+            encoding[name] = dict(zlib=True, complevel=4)
+
+    # Write to a temporary file first so an interrupted write is never mistaken for
+    # a cached file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path_tmp = path.with_name(path.stem + ".{}.tmp".format(os.getpid()))
+    ds.to_netcdf(path_tmp, encoding=encoding)
+    os.replace(path_tmp, path)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+Persistent catalog of MASIN files
+
+Build a catalog of all core_masin netCDF files in a directory tree with a single
+walk of the directory and store it in an SQLite database. Refreshing the catalog
+only reads the headers of files that are new or have changed since the last
+refresh. The catalog can be passed to :func:`twinotter.load_flight`,
+:func:`twinotter.load_campaign`, :func:`twinotter.generate_file_path` and
+:func:`twinotter.summary.generate` instead of searching the directories each time.
+
+> python -m twinotter.catalog /path/to/data /path/to/catalog.sqlite
+"""
+import json
+import os
+from pathlib import Path
+import re
+import sqlite3
+
+import netCDF4
+
+from . import MASIN_CORE_RE
+from .util import profiling
+
+
+_schema = """
+CREATE TABLE IF NOT EXISTS masin_files (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    date TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    flight_number INTEGER NOT NULL,
+    frequency INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    time_coverage_start TEXT,
+    time_coverage_end TEXT,
+    variables TEXT
+);
+CREATE INDEX IF NOT EXISTS masin_files_flight ON masin_files (flight_number);
+"""
+
+_columns = [
+    "path",
+    "directory",
+    "date",
+    "revision",
+    "flight_number",
+    "frequency",
+    "size",
+    "mtime_ns",
+    "time_coverage_start",
+    "time_coverage_end",
+    "variables",
+]
+
+# Condition for paths starting with a prefix (see Catalog._prefix). Unlike LIKE,
+# "_" and "%" in the prefix aren't wildcards and the comparison is case sensitive
+_in_root = "substr(path, 1, ?) = ?"
+
+
+def main():
+    import argparse
+
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("flight_data_path")
+    argparser.add_argument("catalog_path")
+
+    profiling.add_argument(argparser)
+    args = argparser.parse_args()
+    profiling.start(args.profile)
+
+    catalog = Catalog(args.flight_data_path, args.catalog_path, refresh=False)
+    changes = catalog.refresh()
+    print(
+        "{} files in catalog ({added} added, {updated} updated, {removed} removed)".format(
+            len(catalog), **changes
+        )
+    )
+
+    return
+
+
+class Catalog:
+    """Catalog of the MASIN files in a directory tree
+
+    Args:
+        root (str): The directory containing the MASIN files. Subdirectories are
+            included
+        db_path (str): The SQLite database to store the catalog in. Default is to
+            keep the catalog in memory
+        refresh (bool): Update the catalog from the files on disk when it is opened
+    """
+
+    def __init__(self, root, db_path=":memory:", refresh=True):
+        self.root = Path(root).absolute()
+        self.connection = sqlite3.connect(str(db_path))
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(_schema)
+
+        if refresh:
+            self.refresh()
+
+    def __len__(self):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM masin_files WHERE " + _in_root, self._prefix()
+        ).fetchone()[0]
+
+    def refresh(self):
+        """Update the catalog with a single walk of the directory tree
+
+        Only the headers of new files, or files whose size or modification time has
+        changed, are read. Files that no longer exist are removed.
+
+        Returns:
+            dict: The number of files added, updated and removed
+        """
+        known = {
+            row["path"]: (row["size"], row["mtime_ns"])
+            for row in self.connection.execute(
+                "SELECT path, size, mtime_ns FROM masin_files WHERE " + _in_root,
+                self._prefix(),
+            )
+        }
+
+        changes = dict(added=0, updated=0, removed=0)
+        found = set()
+        with self.connection:
+            for path, stat in scan(self.root):
+                path_str = str(path)
+                found.add(path_str)
+
+                if path_str not in known:
+                    changes["added"] += 1
+                elif known[path_str] != (stat.st_size, stat.st_mtime_ns):
+                    changes["updated"] += 1
+                else:
+                    continue
+
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO masin_files VALUES ({})".format(
+                        ", ".join("?" * len(_columns))
+                    ),
+                    _entry(path, stat),
+                )
+
+            for path_str in set(known) - found:
+                changes["removed"] += 1
+                self.connection.execute(
+                    "DELETE FROM masin_files WHERE path = ?", (path_str,)
+                )
+
+        return changes
+
+    def find(
+        self,
+        flight_number=None,
+        date=None,
+        revision=None,
+        frequency=None,
+        directory=None,
+    ):
+        """Find catalogued files matching all of the given arguments
+
+        Args:
+            flight_number (int):
+            date (str): Date as YYYYMMDD or YYYY-MM-DD
+            revision (int):
+            frequency (int): Frequency in Hz
+            directory (str): The directory containing the file
+
+        Returns:
+            list: A dictionary for each file, sorted by flight number and revision
+                (most recent first). The "meta" entry contains the information from
+                the filename in the same format as :data:`twinotter.MASIN_CORE_RE`
+        """
+        conditions = [_in_root]
+        values = list(self._prefix())
+
+        if directory is not None:
+            directory = Path(directory).absolute()
+        if date is not None:
+            date = str(date).replace("-", "")
+
+        for column, value in [
+            ("flight_number", flight_number),
+            ("date", date),
+            ("revision", revision),
+            ("frequency", frequency),
+            ("directory", directory),
+        ]:
+            if value is not None:
+                conditions.append("{} = ?".format(column))
+                values.append(value if column != "directory" else str(value))
+
+        rows = self.connection.execute(
+            "SELECT * FROM masin_files WHERE {} "
+            "ORDER BY flight_number, revision DESC, frequency".format(
+                " AND ".join(conditions)
+            ),
+            values,
+        )
+
+        return [_row_to_dict(row) for row in rows]
+
+    def _prefix(self):
+        # The values for the _in_root condition to match paths within the root
+        # directory. The database can be shared between catalogs of different
+        # directories
+        prefix = os.path.join(str(self.root), "")
+        return len(prefix), prefix
+
+
+def scan(root):
+    """Find all MASIN files below root with a single walk of the directory tree
+
+    Args:
+        root (str):
+
+    Yields:
+        tuple: The path (pathlib.Path) and :class:`os.stat_result` of each file
+    """
+    directories = [str(root)]
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                elif re.match(MASIN_CORE_RE, entry.name) and entry.is_file():
+                    yield Path(entry.path), entry.stat()
+
+
+def read_header(path):
+    """Read the global attributes, variable names and dimension sizes from a MASIN
+    file without reading the data
+
+    Args:
+        path (str):
+
+    Returns:
+        dict:
+    """
+    with netCDF4.Dataset(str(path)) as dataset:
+        return dict(
+            time_coverage_start=getattr(dataset, "time_coverage_start", None),
+            time_coverage_end=getattr(dataset, "time_coverage_end", None),
+            variables=list(dataset.variables),
+            sizes={name: len(dim) for name, dim in dataset.dimensions.items()},
+        )
+
+
+def _entry(path, stat):
+    file_info = re.match(MASIN_CORE_RE, path.name).groupdict()
+    header = read_header(path)
+
+    return (
+        str(path),
+        str(path.parent),
+        file_info["date"],
+        int(file_info["revision"]),
+        int(file_info["flight_num"]),
+        int(file_info["freq"]),
+        stat.st_size,
+        stat.st_mtime_ns,
+        header["time_coverage_start"],
+        header["time_coverage_end"],
+        json.dumps(header["variables"]),
+    )
+
+
+def _row_to_dict(row):
+    entry = dict(zip(row.keys(), row))
+    entry["path"] = Path(entry["path"])
+    entry["directory"] = Path(entry["directory"])
+    entry["variables"] = json.loads(entry["variables"])
+
+    # The information from the filename in the same format as matching the filename
+    # to MASIN_CORE_RE
+    entry["meta"] = dict(
+        date=entry["date"],
+        revision="{:03d}".format(entry["revision"]),
+        flight_num="{:03d}".format(entry["flight_number"]),
+        freq=str(entry["frequency"]),
+    )
+
+    return entry
+
+
+if __name__ == "__main__":
+    main()
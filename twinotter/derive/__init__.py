@@ -0,0 +1,618 @@
+import collections
+import concurrent.futures
+import datetime
+import os
+from pathlib import Path
+
+import netCDF4
+import numpy as np
+import scipy.constants
+
+import xarray as xr
+from metpy import constants
+import metpy.calc
+
+from .. import iter_flight, _find_flight_file
+from ..catalog import read_header
+from ..util import profiling
+from . import fast
+
+
+def calculate(
+    name, ds, memo=None, append_intermediates=False, backend="metpy", avoid=()
+):
+    """Calculate a variable from the given dataset
+
+    The variables needed are calculated in the order given by :func:`plan` so each
+    variable is only calculated once, even if it is needed by multiple variables.
+
+    Args:
+        name (str): The CF standard name
+        ds (xarray.DataSet): The twin-otter MASIN dataset
+        memo (dict): Variables already calculated from this dataset. These are not
+            recalculated and any newly calculated variables are added, so passing the
+            same dictionary to multiple calls avoids repeating calculations
+        append_intermediates (bool): Add the calculated variables, including any
+            intermediate variables, to the dataset
+        backend (str): "metpy" to calculate the variables with MetPy or "fast" to
+            use the NumPy functions from :mod:`twinotter.derive.fast` where they are
+            available. The "fast" results are plain arrays (no pint units) with a
+            units attribute
+        avoid (list): Variables not to use, e.g. measurements from a broken
+            instrument. Either the MASIN variable names or CF standard names
+
+    Returns:
+        xarray.DataArray:
+
+    Raises:
+        ValueError: If the requested variable (or a variable required to calculate it)
+            is not available in the dataset
+    """
+    if backend not in backends:
+        raise ValueError(
+            "Unknown backend {}. Use one of {}".format(backend, ", ".join(backends))
+        )
+
+    if memo is None:
+        memo = dict()
+
+    for step in plan(name, ds, avoid=avoid):
+        if step["name"] not in memo:
+            with profiling.span("derive." + step["name"]):
+                memo[step["name"]] = _evaluate(step, ds, memo, backend)
+
+            if append_intermediates and step["source"] == "function":
+                ds[step["name"]] = memo[step["name"]]
+
+    return memo[name]
+
+
+def calculate_many(
+    names, ds, keep_intermediates=False, backend="metpy", avoid=(), memo=None
+):
+    """Calculate several variables from the given dataset
+
+    The steps for all variables are combined into a single plan so variables needed
+    by more than one of the requested variables are only calculated once.
+
+    Args:
+        names (list): The CF standard names of the variables to calculate
+        ds (xarray.DataSet): The twin-otter MASIN dataset
+        keep_intermediates (bool): Also return the intermediate variables calculated
+            to get the requested variables
+        backend (str): See :func:`calculate`
+        avoid (list): See :func:`calculate`
+        memo (dict): See :func:`calculate`
+
+    Returns:
+        xarray.Dataset: The requested variables with "standard_name" and "units"
+            attributes. Pint quantities from MetPy are converted to plain arrays with
+            a units attribute
+
+    Raises:
+        ValueError: If any of the requested variables (or a variable required to
+            calculate them) are not available in the dataset
+    """
+    if memo is None:
+        memo = dict()
+
+    # Combine the plans so that each variable is only included once
+    steps = []
+    for name in names:
+        planned = set(step["name"] for step in steps)
+        steps += [
+            step for step in plan(name, ds, avoid=avoid) if step["name"] not in planned
+        ]
+
+    for step in steps:
+        if step["name"] not in memo:
+            calculate(step["name"], ds, memo=memo, backend=backend, avoid=avoid)
+
+    output_names = list(names)
+    if keep_intermediates:
+        output_names += [
+            step["name"]
+            for step in steps
+            if step["source"] == "function" and step["name"] not in names
+        ]
+
+    result = xr.Dataset(
+        {name: _dequantify(memo[name]) for name in output_names}, attrs=ds.attrs
+    )
+
+    return result
+
+
+def plan(name, ds=None, avoid=(), variables=None):
+    """The steps needed to calculate a variable from the given dataset
+
+    Variables in the dataset are used directly. Otherwise, if there are several
+    recipes in :data:`available` for a variable, the one that reads the fewest
+    variables from the dataset is used, then the one with the lowest total "cost" of
+    the calculations.
+
+    Args:
+        name (str): The CF standard name
+        ds (xarray.DataSet): The twin-otter MASIN dataset
+        avoid (list): Variables not to use. Either the MASIN variable names or CF
+            standard names
+        variables (collection): The names of the variables available, to plan the
+            calculation without a dataset (e.g. from the header of a file). Used
+            instead of `ds`
+
+    Returns:
+        list: A dictionary for each variable needed, in the order they are calculated
+            with the requested variable last. Each dictionary has the "name" of the
+            variable, where it comes from ("source" is "dataset", "translation" or
+            "function"), and the "arguments" used to calculate it. Calculated
+            variables also have the "recipe" used from :data:`available`
+
+    Raises:
+        ValueError: If the requested variable (or a variable required to calculate it)
+            is not available in the dataset
+    """
+    if variables is None:
+        variables = ds
+    steps = _plan(name, variables, set(avoid), ())
+
+    if steps is None:
+        raise ValueError("Can not calculate {} from dataset".format(name))
+
+    return steps
+
+
+def cost(steps):
+    """The cost of calculating a variable with the given steps
+
+    Args:
+        steps (list): The steps from :func:`plan`
+
+    Returns:
+        tuple: The number of variables read from the dataset and the total cost of
+            the calculations
+    """
+    raw_variables = set()
+    compute = 0
+    for step in steps:
+        if step["source"] == "function":
+            compute += step["recipe"].get("cost", 1)
+        elif step["source"] == "translation":
+            raw_variables.update(step["arguments"])
+        else:
+            raw_variables.add(step["name"])
+
+    return len(raw_variables), compute
+
+
+@profiling.profiled("derive.compute_to_file")
+def compute_to_file(
+    ds_or_path,
+    names,
+    out_path,
+    chunk=datetime.timedelta(minutes=10),
+    processes=None,
+    backend="metpy",
+    avoid=(),
+    frequency=1,
+    revision="most_recent",
+    qc=None,
+):
+    """Calculate variables chunk by chunk and write them to a netCDF file
+
+    The data are split into chunks of time and the variables are calculated for each
+    chunk in parallel. The results are appended to the output file along an
+    unlimited Time dimension as each chunk finishes, so the memory used depends on
+    the chunk length and number of processes rather than the length of the flight.
+
+    Args:
+        ds_or_path (xarray.Dataset | str): Either a twin-otter MASIN dataset or the
+            path to a MASIN netCDF file or flight directory (see
+            :func:`twinotter.load_flight`). Only the variables needed are read from
+            the file, one chunk at a time
+        names (list): The CF standard names of the variables to calculate
+        out_path (str): The netCDF file to write. An existing file is overwritten
+        chunk (datetime.timedelta): The length of time in each chunk
+        processes (int): The number of processes to calculate the chunks with.
+            Default is the number of CPUs. Use 1 to calculate the chunks in serial
+        backend (str): See :func:`calculate`
+        avoid (list): See :func:`calculate`
+        frequency (int): The frequency of the data to load if a path is given
+        revision (int | str): The revision of the data to load if a path is given
+        qc (twinotter.qc.QCPolicy): How to filter bad data if a path is given
+
+    Returns:
+        pathlib.Path: The output file
+
+    Raises:
+        ValueError: If any of the variables can't be calculated from the dataset
+    """
+    out_path = Path(out_path)
+    chunks = _iter_chunks(ds_or_path, names, chunk, avoid, frequency, revision, qc)
+
+    with netCDF4.Dataset(str(out_path), "w") as output:
+        if processes == 1:
+            for ds in chunks:
+                _append(output, _compute_chunk(ds, names, backend, avoid))
+        else:
+            # Only submit a few more chunks than there are processes so finished
+            # chunks are written before more data is read
+            max_pending = 2 * (processes or os.cpu_count())
+            with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as pool:
+                pending = collections.deque()
+                for ds in chunks:
+                    pending.append(
+                        pool.submit(
+                            profiling.in_worker(_compute_chunk),
+                            ds,
+                            names,
+                            backend,
+                            avoid,
+                        )
+                    )
+                    if len(pending) >= max_pending:
+                        _append(output, profiling.collect(pending.popleft().result()))
+
+                while pending:
+                    _append(output, profiling.collect(pending.popleft().result()))
+
+    return out_path
+
+
+def _plan(name, ds, avoid, parents):
+    # The cheapest steps to calculate name (depth first) so that each variable comes
+    # after the variables needed to calculate it. None if it can't be calculated.
+    # ds is anything supporting "in" for the available variable names
+    if name in avoid or name in parents:
+        return None
+
+    # If the variable is in the dataset, just use it
+    if name in ds:
+        return [dict(name=name, source="dataset", arguments=[])]
+
+    # If the variable name is in the translation table use the variable but renamed
+    if (
+        name in translation_table
+        and translation_table[name] in ds
+        and translation_table[name] not in avoid
+    ):
+        return [
+            dict(name=name, source="translation", arguments=[translation_table[name]])
+        ]
+
+    # Otherwise calculate the requested variable using variables in the dataset,
+    # choosing the cheapest of the recipes that are possible
+    best = None
+    for recipe in available.get(name, []):
+        steps = []
+        for argument_name in recipe["arguments"]:
+            argument_steps = _plan(argument_name, ds, avoid, parents + (name,))
+            if argument_steps is None:
+                break
+
+            # Variables needed by multiple arguments are only calculated once
+            planned = set(step["name"] for step in steps)
+            steps += [step for step in argument_steps if step["name"] not in planned]
+        else:
+            steps.append(
+                dict(
+                    name=name,
+                    source="function",
+                    arguments=list(recipe["arguments"]),
+                    recipe=recipe,
+                )
+            )
+            if best is None or cost(steps) < cost(best):
+                best = steps
+
+    return best
+
+
+def _evaluate(step, ds, memo, backend="metpy"):
+    name = step["name"]
+    if step["source"] == "dataset":
+        return ds[name]
+
+    elif step["source"] == "translation":
+        return _rename_xarray(ds[step["arguments"][0]].copy(), name)
+
+    elif backend == "fast" and "fast" in step["recipe"]:
+        function = step["recipe"]["fast"]
+        arguments = [memo[argument_name] for argument_name in step["arguments"]]
+        result = function["function"](
+            *[
+                fast.to_numpy(argument, units)
+                for argument, units in zip(arguments, function["units"])
+            ]
+        )
+
+        return _rename_xarray(
+            xr.DataArray(
+                data=result,
+                coords=arguments[0].coords,
+                dims=arguments[0].dims,
+                attrs=dict(units=function["result"]),
+            ),
+            name,
+        )
+
+    else:
+        arguments = [memo[argument_name] for argument_name in step["arguments"]]
+        result = step["recipe"]["function"](*arguments)
+        return _rename_xarray(result, name)
+
+
+def _iter_chunks(ds_or_path, names, chunk, avoid, frequency, revision, qc):
+    # Split the input into datasets covering each chunk of time. All the variables
+    # are planned first so an error is raised before any data is read or written
+    if isinstance(ds_or_path, xr.Dataset):
+        for name in names:
+            plan(name, ds_or_path, avoid=avoid)
+
+        return _split(ds_or_path, chunk)
+
+    else:
+        filename, meta = _find_flight_file(ds_or_path, frequency, revision, None)
+
+        # Plan the calculations using the variable names from the file header so
+        # only the variables needed are read
+        header_variables = set(read_header(filename)["variables"])
+        variables = set()
+        for name in names:
+            variables.update(
+                step["name"] if step["source"] == "dataset" else step["arguments"][0]
+                for step in plan(name, avoid=avoid, variables=header_variables)
+                if step["source"] in ["dataset", "translation"]
+            )
+
+        return iter_flight(
+            filename,
+            window=chunk,
+            variables=sorted(variables),
+            frequency=frequency,
+            revision=revision,
+            qc=qc,
+        )
+
+
+def _split(ds, chunk):
+    # The parts of a dataset covering each chunk of time
+    times = ds.Time.values
+    if len(times) == 0:
+        return
+
+    chunk = np.timedelta64(chunk)
+    chunk_starts = np.arange(times[0], times[-1] + 1, chunk)
+    for start, stop in zip(
+        np.searchsorted(times, chunk_starts),
+        np.searchsorted(times, chunk_starts + chunk),
+    ):
+        if start < stop:
+            yield ds.isel(Time=slice(start, stop))
+
+
+def _compute_chunk(ds, names, backend, avoid):
+    # Calculate the variables for a single chunk and return plain arrays with their
+    # units so they can be written to the output file
+    memo = dict()
+    results = dict(Time=ds.Time.values)
+    for name in names:
+        result = calculate(name, ds, memo=memo, backend=backend, avoid=avoid)
+        result = _dequantify(result)
+        results[name] = (result.values, result.attrs.get("units"))
+
+    return results
+
+
+def _append(output, results):
+    # Append the results for a chunk to the netCDF file, creating the variables for
+    # the first chunk
+    results = dict(results)
+    times = results.pop("Time").astype("datetime64[us]").astype(np.int64)
+
+    if "Time" not in output.dimensions:
+        output.createDimension("Time", None)
+        time = output.createVariable("Time", "i8", ("Time",))
+        time.units = "microseconds since 1970-01-01 00:00:00"
+        time.standard_name = "time"
+
+        for name, (values, units) in results.items():
+            variable = output.createVariable(
+                name,
+                values.dtype,
+                ("Time",),
+                zlib=True,
+                complevel=4,
+            )
+            variable.standard_name = name
+            if units is not None:
+                variable.units = units
+
+    start = len(output.dimensions["Time"])
+    output["Time"][start:] = times
+    for name, (values, units) in results.items():
+        output[name][start:] = values
+
+
+def specific_humidity(dataset):
+    return specific_humidity_from_mole_fraction(dataset.H2O_LICOR)
+
+
+def specific_humidity_from_mole_fraction(x_h20):
+    q = (
+        constants.water_molecular_weight
+        * x_h20
+        / (
+            constants.water_molecular_weight * x_h20
+            + constants.dry_air_molecular_weight * (1 - x_h20)
+        )
+    )
+
+    return q
+
+
+def along_track_wind(ds):
+    return along_track_wind_from_components(ds.U_OXTS, ds.V_OXTS, ds.HDG_OXTS)
+
+
+def along_track_wind_from_components(eastward_wind, northward_wind, heading):
+    angle = np.arctan2(eastward_wind, northward_wind)
+    magnitude = np.sqrt(eastward_wind ** 2 + northward_wind ** 2)
+
+    flight_angle = np.deg2rad(heading)
+
+    wind = magnitude * np.cos(angle - flight_angle)
+    if "units" in eastward_wind.attrs:
+        wind.attrs["units"] = eastward_wind.attrs["units"]
+
+    return wind
+
+
+def combine_temperatures(nondeiced_temperature, deiced_temperature):
+    # Use the non-deiced temperature by default
+    temperature = nondeiced_temperature.copy()
+
+    # Replace with the deiced temperature where the non-deiced temperature is below
+    # freezing
+    frozen = np.where(temperature < scipy.constants.zero_Celsius)
+    temperature[frozen] = deiced_temperature[frozen]
+
+    return temperature
+
+
+def _rename_xarray(array, name):
+    array = array.rename(name)
+    array.attrs["standard_name"] = name
+
+    if "long_name" in array.attrs:
+        del array.attrs["long_name"]
+
+    return array
+
+
+def _dequantify(array):
+    # Convert MetPy results to plain arrays with a units attribute matching the units
+    # used in the MASIN files
+    if hasattr(array.data, "units"):
+        units = array.data.units
+        array = array.copy(data=array.data.magnitude)
+        if units.dimensionless:
+            array.attrs["units"] = "1"
+        else:
+            array.attrs["units"] = "{:~}".format(units)
+
+    return array
+
+
+backends = ["metpy", "fast"]
+
+# A dictionary mapping variables that can be calculated to a list of recipes to
+# calculate them. Each recipe has the function to calculate the variable and the
+# arguments required as input to that function. Optionally, a recipe can have a
+# relative "cost" of the calculation (default 1) used to choose between recipes and
+# the equivalent "fast" function from twinotter.derive.fast
+available = dict(
+    air_temperature=[
+        dict(
+            function=combine_temperatures,
+            arguments=["TAT_ND_R", "TAT_DI_R"],
+        ),
+    ],
+    along_track_wind=[
+        dict(
+            function=along_track_wind_from_components,
+            arguments=["eastward_wind", "northward_wind", "platform_yaw_angle"],
+        ),
+    ],
+    air_potential_temperature=[
+        dict(
+            function=metpy.calc.potential_temperature,
+            arguments=["air_pressure", "air_temperature"],
+            fast=fast.available["air_potential_temperature"],
+        ),
+    ],
+    equivalent_potential_temperature=[
+        dict(
+            function=metpy.calc.equivalent_potential_temperature,
+            arguments=["air_pressure", "air_temperature", "dew_point_temperature"],
+            cost=3,
+            fast=fast.available["equivalent_potential_temperature"],
+        ),
+    ],
+    humidity_mixing_ratio=[
+        dict(
+            function=metpy.calc.mixing_ratio_from_relative_humidity,
+            arguments=["air_pressure", "air_temperature", "relative_humidity"],
+            cost=2,
+            fast=fast.available["humidity_mixing_ratio"],
+        ),
+    ],
+    relative_humidity=[
+        dict(
+            function=metpy.calc.relative_humidity_from_dewpoint,
+            arguments=["air_temperature", "dew_point_temperature"],
+            cost=2,
+            fast=fast.available["relative_humidity"],
+        ),
+    ],
+    specific_humidity=[
+        dict(
+            function=specific_humidity_from_mole_fraction,
+            arguments=["mole_fraction_of_water_vapor_in_air"],
+        ),
+        dict(
+            function=metpy.calc.specific_humidity_from_dewpoint,
+            arguments=["air_pressure", "dew_point_temperature"],
+            cost=2,
+        ),
+    ],
+    virtual_potential_temperature=[
+        dict(
+            function=metpy.calc.virtual_temperature,
+            arguments=["air_potential_temperature", "humidity_mixing_ratio"],
+            fast=fast.available["virtual_potential_temperature"],
+        ),
+    ],
+)
+
+# Mapping from twin-otter variable names to CF standard names. This was generated from
+# an existing MASIN file. It doesn't work to just look at the standard names in the
+# DataSet because some standard names are duplicated and have been removed from this
+# mapping. e.g. air_temperature refers to temperature from both the deiced and
+# non-deiced measurements so needs to be calculated separately
+translation_table = dict(
+    dew_point_temperature="TDEW_BUCK",
+    brightness_temperature="BTHEIM_U",
+    air_pressure="PS_AIR",
+    # Q_AIR has no standard name
+    downwelling_shortwave_flux_in_air="SW_DN_C",
+    upwelling_shortwave_flux_in_air="SW_UP_C",
+    downwelling_longwave_flux_in_air="LW_DN_C",
+    upwelling_longwave_flux_in_air="LW_UP_C",
+    # relative_humidity="HUM_ROSE",
+    mole_fraction_of_water_vapor_in_air="H2O_LICOR",
+    mole_fraction_of_carbon_dioxide_in_air="CO2_LICOR",
+    flow_rate="L_FLOW_S",
+    # CPC_CONC has no standard name
+    latitude="LAT_OXTS",
+    longitude="LON_OXTS",
+    altitude="ALT_OXTS",
+    platform_speed_wrt_ground_northward="VELN_OXTS",
+    platform_speed_wrt_ground_eastward="VELE_OXTS",
+    platform_speed_wrt_ground_upward="VELZ_OXTS",
+    platform_roll_angle="ROLL_OXTS",
+    platform_pitch_angle="PTCH_OXTS",
+    platform_yaw_angle="HDG_OXTS",
+    northward_wind="V_OXTS",
+    eastward_wind="U_OXTS",
+    upward_air_velocity="W_OXTS",
+)
+
+# Duplicate CF standard names
+# TODO: write functions to combine these observations
+
+# platform_speed_wrt_air="TAS_DI_AIR",
+# platform_speed_wrt_air="TAS_ND_AIR",
+# platform_speed_wrt_air="TAS",
+
+# height="HGT_RADR1",
+# height="HGT_RADR2",
@@ -0,0 +1,276 @@
+"""Fast thermodynamic calculations using plain NumPy arrays
+
+The same formulas as the MetPy functions used by :mod:`twinotter.derive` but without
+units, so there is no wrapping and unwrapping of pint quantities. The calculations
+are done in place where possible to avoid allocating intermediate arrays and keep the
+data type of the input, so float32 data is calculated in float32.
+
+All inputs and outputs are in SI units: pressure in Pa, temperature in K and mixing
+ratio and relative humidity as fractions.
+
+Select this backend with :func:`twinotter.derive.calculate` using `backend="fast"`.
+"""
+import types
+
+import metpy.constants
+import numpy as np
+from metpy.units import units as unit_registry
+
+
+#: Reference pressure for potential temperature (Pa)
+P0 = 100000.0
+
+
+def _nounit_constants():
+    # The constants used here in SI base units without the units, for versions of
+    # MetPy before metpy.constants.nounit (1.3). The triple point of water was only
+    # added in 1.4
+    defaults = dict(T0=unit_registry.Quantity(273.16, "K"))
+
+    values = dict()
+    names = ["Cp_l", "Cp_v", "epsilon", "kappa", "Lv", "Rv", "sat_pressure_0c", "T0"]
+    for name in names:
+        value = getattr(metpy.constants, name, None)
+        if value is None:
+            value = defaults[name]
+        values[name] = value.to_base_units().magnitude
+
+    return types.SimpleNamespace(**values)
+
+
+try:
+    from metpy.constants import nounit as constants
+except ImportError:
+    constants = _nounit_constants()
+
+
+def potential_temperature(pressure, temperature, out=None):
+    """Potential temperature (K) from pressure (Pa) and temperature (K)"""
+    out = _output(out, pressure, temperature)
+
+    np.divide(P0, pressure, out=out)
+    np.power(out, constants.kappa, out=out)
+    np.multiply(out, temperature, out=out)
+
+    return out
+
+
+def saturation_vapor_pressure(temperature, out=None):
+    """Saturation vapour pressure over liquid water (Pa) from temperature (K)
+
+    Uses the same formula as MetPy (Ambaum, 2020)
+    """
+    out = _output(out, temperature)
+
+    # Latent heat of vaporisation at the given temperature
+    np.subtract(temperature, constants.T0, out=out)
+    np.multiply(out, -(constants.Cp_l - constants.Cp_v), out=out)
+    np.add(out, constants.Lv, out=out)
+
+    # exp((Lv / T0 - L / T) / Rv) * (T0 / T) ** ((Cp_l - Cp_v) / Rv)
+    np.divide(out, temperature, out=out)
+    np.subtract(constants.Lv / constants.T0, out, out=out)
+    np.divide(out, constants.Rv, out=out)
+
+    log_temperature = np.log(temperature)
+    np.subtract(np.log(constants.T0), log_temperature, out=log_temperature)
+    np.multiply(
+        log_temperature,
+        (constants.Cp_l - constants.Cp_v) / constants.Rv,
+        out=log_temperature,
+    )
+    np.add(out, log_temperature, out=out)
+
+    np.exp(out, out=out)
+    np.multiply(out, constants.sat_pressure_0c, out=out)
+
+    return out
+
+
+def saturation_mixing_ratio(pressure, temperature, out=None):
+    """Saturation mixing ratio from pressure (Pa) and temperature (K)
+
+    NaN where the saturation vapour pressure exceeds the pressure
+    """
+    out = saturation_vapor_pressure(
+        temperature, out=_output(out, pressure, temperature)
+    )
+
+    undefined = out >= pressure
+    _mixing_ratio(out, pressure, out=out)
+    out[undefined] = np.nan
+
+    return out
+
+
+def mixing_ratio_from_relative_humidity(
+    pressure, temperature, relative_humidity, out=None
+):
+    """Mixing ratio from pressure (Pa), temperature (K) and relative humidity"""
+    out = saturation_mixing_ratio(
+        pressure,
+        temperature,
+        out=_output(out, pressure, temperature, relative_humidity),
+    )
+
+    # epsilon * w_s * RH / (epsilon + w_s * (1 - RH))
+    denominator = np.subtract(1, relative_humidity, dtype=out.dtype)
+    np.multiply(denominator, out, out=denominator)
+    np.add(denominator, constants.epsilon, out=denominator)
+
+    np.multiply(out, relative_humidity, out=out)
+    np.multiply(out, constants.epsilon, out=out)
+    np.divide(out, denominator, out=out)
+
+    return out
+
+
+def relative_humidity_from_dewpoint(temperature, dewpoint, out=None):
+    """Relative humidity from temperature (K) and dewpoint (K)"""
+    out = saturation_vapor_pressure(dewpoint, out=_output(out, temperature, dewpoint))
+    np.divide(out, saturation_vapor_pressure(temperature), out=out)
+
+    return out
+
+
+def equivalent_potential_temperature(pressure, temperature, dewpoint, out=None):
+    """Equivalent potential temperature (K) from pressure (Pa), temperature (K) and
+    dewpoint (K)
+
+    Uses the formula from Bolton (1980), as in MetPy
+    """
+    out = _output(out, pressure, temperature, dewpoint)
+
+    e = saturation_vapor_pressure(dewpoint, out=np.empty_like(out))
+    r = _mixing_ratio(e, pressure)
+
+    # Temperature at the lifting condensation level
+    # t_l = 56 + 1 / (1 / (td - 56) + log(t / td) / 800)
+    t_l = np.subtract(dewpoint, 56, dtype=out.dtype)
+    np.reciprocal(t_l, out=t_l)
+    np.divide(temperature, dewpoint, out=out)
+    np.log(out, out=out)
+    np.divide(out, 800, out=out)
+    np.add(t_l, out, out=t_l)
+    np.reciprocal(t_l, out=t_l)
+    np.add(t_l, 56, out=t_l)
+
+    # Potential temperature at the lifting condensation level
+    # th_l = theta(p - e, t) * (t / t_l) ** (0.28 * r)
+    np.subtract(pressure, e, out=e)
+    th_l = potential_temperature(e, temperature, out=e)
+    np.divide(temperature, t_l, out=out)
+    np.power(out, np.multiply(r, 0.28, dtype=out.dtype), out=out)
+    np.multiply(th_l, out, out=th_l)
+
+    # th_e = th_l * exp(r * (1 + 0.448 * r) * (3036 / t_l - 1.78))
+    np.divide(3036, t_l, out=t_l)
+    np.subtract(t_l, 1.78, out=t_l)
+    np.multiply(r, 0.448, out=out)
+    np.add(out, 1, out=out)
+    np.multiply(out, r, out=out)
+    np.multiply(out, t_l, out=out)
+    np.exp(out, out=out)
+    np.multiply(out, th_l, out=out)
+
+    return out
+
+
+def virtual_temperature(temperature, mixing_ratio, out=None):
+    """Virtual temperature (K) from temperature (K) and mixing ratio
+
+    Also gives the virtual potential temperature from the potential temperature
+    """
+    out = _output(out, temperature, mixing_ratio)
+
+    # T * (w + epsilon) / (epsilon * (1 + w))
+    denominator = np.add(mixing_ratio, 1, dtype=out.dtype)
+    np.multiply(denominator, constants.epsilon, out=denominator)
+
+    np.add(mixing_ratio, constants.epsilon, out=out)
+    np.multiply(out, temperature, out=out)
+    np.divide(out, denominator, out=out)
+
+    return out
+
+
+def to_numpy(array, units):
+    """The values of a DataArray in the given units
+
+    Args:
+        array (xarray.DataArray): The data. Either a pint quantity or with a "units"
+            attribute. Data without units is assumed to already be in the given units
+        units (str):
+
+    Returns:
+        numpy.ndarray: The data as a float array. Not copied if the data is already
+            in the requested units
+    """
+    if hasattr(array.data, "units"):
+        values = array.data.m_as(units)
+    else:
+        values = array.values
+        source_units = array.attrs.get("units", units)
+        if unit_registry(str(source_units)) != unit_registry(units):
+            values = unit_registry.Quantity(values, source_units).m_as(units)
+
+    if not np.issubdtype(values.dtype, np.floating):
+        values = values.astype(float)
+
+    return values
+
+
+def _mixing_ratio(partial_pressure, total_pressure, out=None):
+    # epsilon * e / (p - e)
+    out = _output(out, partial_pressure, total_pressure)
+    denominator = np.subtract(total_pressure, partial_pressure, dtype=out.dtype)
+
+    np.multiply(partial_pressure, constants.epsilon, out=out)
+    np.divide(out, denominator, out=out)
+
+    return out
+
+
+def _output(out, *arrays):
+    # An uninitialised array to write the result to, with a floating point type
+    # matching the inputs
+    if out is not None:
+        return out
+
+    dtype = np.result_type(*arrays)
+    if not np.issubdtype(dtype, np.floating):
+        dtype = np.float64
+
+    return np.empty(np.broadcast(*arrays).shape, dtype=dtype)
+
+
+# The fast functions for the recipes in twinotter.derive.available. The arguments are
+# the same as the MetPy functions, with the units each argument is converted to
+# and the units of the result
+available = dict(
+    air_potential_temperature=dict(
+        function=potential_temperature,
+        units=["Pa", "K"],
+        result="K",
+    ),
+    equivalent_potential_temperature=dict(
+        function=equivalent_potential_temperature,
+        units=["Pa", "K", "K"],
+        result="K",
+    ),
+    humidity_mixing_ratio=dict(
+        function=mixing_ratio_from_relative_humidity,
+        units=["Pa", "K", "1"],
+        result="1",
+    ),
+    relative_humidity=dict(
+        function=relative_humidity_from_dewpoint,
+        units=["K", "K"],
+        result="1",
+    ),
+    virtual_potential_temperature=dict(
+        function=virtual_temperature,
+        units=["K", "1"],
+        result="K",
+    ),
+)
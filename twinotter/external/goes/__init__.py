@@ -1,12 +1,12 @@
-import re
-import pathlib
 import datetime
+import fnmatch
 
 import parse
 import numpy as np
 import xarray as xr
 
-from . import plot
+from . import archive, plot, regrid
+from ...util import profiling
 
 
 #: Filename pattern of netCDF files on the AERIS server
@@ -50,15 +50,18 @@ def time_from_filename(filename):
 
 def find_images_in_path(path, layer=default_layer):
     # Use a specific layer or use layer "*" to get all layers
-    # Replace all times with "*" to search for all images
-    filename_to_search = re.sub(r"\{\w+:\d\dd}", "*", filename_format).format(
-        layer=layer
+    goes_archive = archive.archive(path)
+    # Look for files added since the directory was indexed (e.g. downloaded)
+    if goes_archive.changed():
+        goes_archive.refresh()
+
+    return sorted(
+        filename
+        for image_layer in goes_archive.layers
+        if image_layer is not None and fnmatch.fnmatchcase(image_layer, layer)
+        for filename in goes_archive.files(image_layer)
     )
 
-    # Use pathlib to search the give path for all matching filenames
-    path = pathlib.Path(path)
-    return sorted(list(path.rglob(filename_to_search)))
-
 
 def _load_image(filename):
     from osgeo import gdal
@@ -90,14 +93,16 @@ def _load_image(filename):
     return lons, lats, data
 
 
+@profiling.profiled("goes.load_nc")
 def load_nc(path, time):
     """Load the netCDF dataset corresponding to the given time
 
     This function finds files matching the AERIS :data:`nc_filename` formatted for the
-    given time
+    given time, using the :class:`twinotter.external.goes.archive.GoesArchive` index
+    of the directory
 
     Args:
-        path (str): The directory containing GOES netCDF files
+        path (str or GoesArchive): The directory containing GOES netCDF files
         time (datetime.datetime): The time of the file to load
 
     Returns:
@@ -109,25 +114,18 @@ def load_nc(path, time):
 
         FileExistsError: If multiple matching netCDF files are found with the same name
     """
-    filename = nc_filename.format(
-        year=time.year,
-        day=time.timetuple().tm_yday,
-        hour=time.hour,
-        minute=time.minute,
-        something="*",
-    )
-
-    # Find matching filenames in the GOES folder
-    file_path = list(pathlib.Path(path).rglob(filename))
-
-    if len(file_path) == 0:
-        raise FileNotFoundError("No GOES data found in {} for {}".format(path, time))
-    elif len(file_path) > 1:
-        raise FileExistsError(
-            "More than one file found in {} for {}".format(path, time)
-        )
-
-    dataset = xr.load_dataset(str(file_path[0]))
+    # Find the file in the index of the GOES folder. Look again if it isn't there
+    # (or has gone) in case the folder has changed since it was indexed
+    goes_archive = archive.archive(path)
+    try:
+        file_path = goes_archive.find(time)
+        if not file_path.exists():
+            raise FileNotFoundError(file_path)
+    except FileNotFoundError:
+        goes_archive.refresh()
+        file_path = goes_archive.find(time)
+
+    dataset = xr.load_dataset(str(file_path))
 
     # Remove values where the coordinates are NaNs
     dataset = dataset.where(~dataset.longitude.isnull(), drop=True)
@@ -0,0 +1,410 @@
+"""
+Index of the GOES files in a directory tree by scan start time
+
+Finding the GOES image for a given time by globbing the filename searches the whole
+directory tree, which adds up when loading an image every few minutes of a flight. A
+:class:`GoesArchive` finds all the AERIS netCDF files
+(:data:`twinotter.external.goes.nc_filename`) and GeoTIFF images
+(:data:`twinotter.external.goes.filename_format`) with a single walk of the
+directory tree and keeps them sorted by time, so exact, nearest and bracketing
+lookups are a binary search.
+
+The index can be stored in a JSON file so it doesn't need rebuilding in each
+session. It is rebuilt if the modification time of any of the directories has
+changed, i.e. files have been added or removed. :func:`archive` keeps the index
+for each directory in memory and, if a cache directory is given (either with the
+`cache_dir` argument or the `TWINOTTER_CACHE_DIR` environment variable), stores it
+on disk. This is what
+:func:`twinotter.external.goes.load_nc` and
+:func:`twinotter.external.goes.find_images_in_path` use.
+
+> python -m twinotter.external.goes.archive /path/to/goes /path/to/index.json
+"""
+import bisect
+import datetime
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import parse
+
+from .. import goes
+from ...util import profiling
+
+
+#: Change this when the format of the stored index changes so that it is rebuilt
+ARCHIVE_VERSION = 2
+
+# The archives opened in this session by directory
+_archives = dict()
+
+
+def main():
+    import argparse
+
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("goes_path")
+    argparser.add_argument("index_path")
+
+    profiling.add_argument(argparser)
+    args = argparser.parse_args()
+    profiling.start(args.profile)
+
+    goes_archive = GoesArchive(args.goes_path, args.index_path, refresh=True)
+    for layer in goes_archive.layers:
+        times = goes_archive.times(layer)
+        print(
+            "{}: {} files from {} to {}".format(
+                "netCDF" if layer is None else layer, len(times), times[0], times[-1]
+            )
+        )
+
+    return
+
+
+def archive(path, cache_dir=None):
+    """The :class:`GoesArchive` for a directory, reusing the index if it has already
+    been built in this session
+
+    Args:
+        path (str or GoesArchive): The directory containing the GOES files. Returned
+            unchanged if it is already a :class:`GoesArchive`
+        cache_dir (str): Directory to store the index in. Default is the
+            `TWINOTTER_CACHE_DIR` environment variable. The index isn't stored if
+            neither is given
+
+    Returns:
+        GoesArchive:
+    """
+    if isinstance(path, GoesArchive):
+        return path
+
+    key = str(Path(path).absolute())
+    if key not in _archives:
+        if cache_dir is None:
+            cache_dir = os.environ.get("TWINOTTER_CACHE_DIR")
+
+        if cache_dir is None:
+            index_path = None
+        else:
+            index_path = Path(cache_dir) / "goes_archive_{}.json".format(
+                hashlib.sha1(key.encode()).hexdigest()
+            )
+
+        _archives[key] = GoesArchive(path, index_path)
+
+    return _archives[key]
+
+
+class GoesArchive:
+    """The GOES files in a directory tree sorted by scan start time
+
+    The netCDF files are under the layer None and the GeoTIFF images under the layer
+    in their filename. All times are naive datetimes in UTC.
+
+    Args:
+        root (str): The directory containing the GOES files. Subdirectories are
+            included
+        index_path (str): A JSON file to store the index in. It is read instead of
+            searching the directory tree if it exists. Default is to keep the index
+            in memory
+        refresh (bool): Search the directory tree even if the index has been stored
+    """
+
+    def __init__(self, root, index_path=None, refresh=False):
+        self.root = Path(root)
+        self.index_path = index_path
+        self._files = dict()
+        # The modification time of each directory when it was searched
+        self._directories = dict()
+
+        if refresh or not self._read():
+            self.refresh()
+
+    def __len__(self):
+        return sum(len(times) for times, paths in self._files.values())
+
+    @property
+    def layers(self):
+        """list: The layers with files in the archive, with None (netCDF) first"""
+        return sorted(self._files, key=lambda layer: (layer is not None, layer))
+
+    def refresh(self):
+        """Rebuild the index with a single walk of the directory tree and store it if
+        the archive has an `index_path`
+        """
+        files = dict()
+        self._directories = dict()
+        with profiling.span("goes.archive.scan"):
+            for layer, time, path in scan(self.root, self._directories):
+                files.setdefault(layer, []).append((time, path))
+
+        self._files = dict()
+        for layer, entries in files.items():
+            entries.sort()
+            self._files[layer] = (
+                [time for time, path in entries],
+                [path for time, path in entries],
+            )
+
+        if self.index_path is not None:
+            self._write()
+
+    def changed(self):
+        """Whether files have been added or removed since the index was built
+
+        Checks the modification time of the directories without listing them
+
+        Returns:
+            bool:
+        """
+        for directory, mtime_ns in self._directories.items():
+            try:
+                if os.stat(str(self.root / directory)).st_mtime_ns != mtime_ns:
+                    return True
+            except FileNotFoundError:
+                return True
+
+        return False
+
+    def times(self, layer=None):
+        """The scan start times of all files of a layer, in order
+
+        Args:
+            layer (str): The GeoTIFF layer. Default is the netCDF files
+
+        Returns:
+            list:
+        """
+        return list(self._files.get(layer, ([], []))[0])
+
+    def files(self, layer=None):
+        """The paths of all files of a layer, in order of time
+
+        Args:
+            layer (str): The GeoTIFF layer. Default is the netCDF files
+
+        Returns:
+            list:
+        """
+        return [self.root / path for path in self._files.get(layer, ([], []))[1]]
+
+    def find(self, time, layer=None):
+        """The file for the scan starting at the given time
+
+        Filenames only give the time to the minute, so the seconds of the given time
+        are ignored
+
+        Args:
+            time (datetime.datetime):
+            layer (str): The GeoTIFF layer. Default is the netCDF files
+
+        Returns:
+            pathlib.Path:
+
+        Raises:
+            FileNotFoundError: If there is no file for that time
+
+            FileExistsError: If there is more than one file for that time
+        """
+        time = _naive(time).replace(second=0, microsecond=0)
+        times, paths = self._files.get(layer, ([], []))
+
+        start = bisect.bisect_left(times, time)
+        end = bisect.bisect_right(times, time, lo=start)
+
+        if end == start:
+            raise FileNotFoundError(
+                "No GOES data found in {} for {}".format(self.root, time)
+            )
+        elif end - start > 1:
+            raise FileExistsError(
+                "More than one file found in {} for {}".format(self.root, time)
+            )
+
+        return self.root / paths[start]
+
+    def nearest(self, time, layer=None, tolerance=None):
+        """The file for the scan starting closest to the given time
+
+        Args:
+            time (datetime.datetime):
+            layer (str): The GeoTIFF layer. Default is the netCDF files
+            tolerance (datetime.timedelta): The maximum difference from the given
+                time. Default is no limit
+
+        Returns:
+            tuple: The time of the scan and the path to the file. The earlier scan if
+                two are equally close
+
+        Raises:
+            FileNotFoundError: If there are no files within the tolerance
+        """
+        time = _naive(time)
+        times, paths = self._files.get(layer, ([], []))
+
+        n = bisect.bisect_left(times, time)
+        candidates = [m for m in (n - 1, n) if 0 <= m < len(times)]
+        if candidates:
+            n = min(candidates, key=lambda m: abs(times[m] - time))
+
+        if not candidates or (
+            tolerance is not None and abs(times[n] - time) > tolerance
+        ):
+            raise FileNotFoundError(
+                "No GOES data found in {} near {}".format(self.root, time)
+            )
+
+        return times[n], self.root / paths[n]
+
+    def bracket(self, time, layer=None):
+        """The files for the scans either side of the given time, e.g. to
+        interpolate between images
+
+        Args:
+            time (datetime.datetime):
+            layer (str): The GeoTIFF layer. Default is the netCDF files
+
+        Returns:
+            tuple: The (time, path) of the last scan starting at or before the given
+                time and of the first scan starting after it
+
+        Raises:
+            FileNotFoundError: If there isn't a scan on both sides of the given time
+        """
+        time = _naive(time)
+        times, paths = self._files.get(layer, ([], []))
+
+        n = bisect.bisect_right(times, time)
+        if n == 0 or n == len(times):
+            raise FileNotFoundError(
+                "No GOES data found in {} either side of {}".format(self.root, time)
+            )
+
+        return (
+            (times[n - 1], self.root / paths[n - 1]),
+            (times[n], self.root / paths[n]),
+        )
+
+    def _read(self):
+        # Load the stored index. Returns False if there isn't an up to date stored
+        # index for this directory
+        if self.index_path is None or not Path(self.index_path).exists():
+            return False
+
+        with open(self.index_path) as index_file:
+            index = json.load(index_file)
+
+        if index.get("version") != ARCHIVE_VERSION or index.get("root") != str(
+            self.root.absolute()
+        ):
+            return False
+
+        self._files = dict()
+        for layer, time, path in index["files"]:
+            times, paths = self._files.setdefault(layer, ([], []))
+            times.append(datetime.datetime.strptime(time, "%Y-%m-%dT%H:%M:%S"))
+            paths.append(Path(path))
+        self._directories = index["directories"]
+
+        return not self.changed()
+
+    def _write(self):
+        index = dict(
+            version=ARCHIVE_VERSION,
+            root=str(self.root.absolute()),
+            files=[
+                [layer, time.isoformat(), path.as_posix()]
+                for layer, (times, paths) in self._files.items()
+                for time, path in zip(times, paths)
+            ],
+            directories=self._directories,
+        )
+
+        # Write to a temporary file first so other processes never read a partial
+        # file
+        index_path = Path(self.index_path)
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = index_path.with_name(index_path.name + ".{}.tmp".format(os.getpid()))
+        with open(tmp_path, "w") as index_file:
+            json.dump(index, index_file)
+        os.replace(tmp_path, index_path)
+
+
+def scan(root, directories=None):
+    """Find all GOES files below root with a single walk of the directory tree
+
+    Args:
+        root (str):
+        directories (dict): If given, the modification time (in ns) of each
+            directory searched is added to this, by the path relative to root
+
+    Yields:
+        tuple: The layer (None for netCDF files), scan start time and the path
+            relative to root of each file
+    """
+    nc_pattern = parse.compile(goes.nc_filename)
+    tiff_pattern = parse.compile(goes.filename_format)
+
+    root = Path(root)
+    pending = [str(root)]
+    while pending:
+        directory = pending.pop()
+        if directories is not None:
+            # Before listing the directory so later changes are noticed
+            relative_path = Path(directory).relative_to(root).as_posix()
+            directories[relative_path] = os.stat(directory).st_mtime_ns
+
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                    continue
+
+                if entry.name.endswith(".nc"):
+                    match = nc_pattern.parse(entry.name)
+                elif entry.name.endswith(".tiff"):
+                    match = tiff_pattern.parse(entry.name)
+                else:
+                    continue
+
+                if match is not None and entry.is_file():
+                    yield (
+                        match.named.get("layer"),
+                        _time(match.named),
+                        Path(entry.path).relative_to(root),
+                    )
+
+
+def _time(info):
+    # The time from the parsed filename. netCDF filenames have the day of the year
+    # instead of the month and day
+    if "month" in info:
+        return datetime.datetime(
+            info["year"], info["month"], info["day"], info["hour"], info["minute"]
+        )
+    else:
+        return datetime.datetime(info["year"], 1, 1) + datetime.timedelta(
+            days=info["day"] - 1, hours=info["hour"], minutes=info["minute"]
+        )
+
+
+def _naive(time):
+    # Filenames are in UTC without a time zone
+    if getattr(time, "tzinfo", None) is not None:
+        time = time.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+    return datetime.datetime(
+        time.year,
+        time.month,
+        time.day,
+        time.hour,
+        time.minute,
+        time.second,
+        time.microsecond,
+    )
+
+
+if __name__ == "__main__":
+    main()
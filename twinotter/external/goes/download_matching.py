@@ -3,7 +3,7 @@
 Data is downloaded to the current working directory
 
 Usage:
-    download_matching.py  <flight_data_path>
+    download_matching.py  <flight_data_path> [--profile=<report>]
     download_matching.py  (-h | --help)
 
 Arguments:
@@ -11,6 +11,8 @@ Arguments:
 
 Options:
     -h --help        Show help
+    --profile=<report>
+        Profile the run and write the report to this file (.json or .csv)
 
 """
 import pytz
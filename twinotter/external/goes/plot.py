@@ -9,6 +9,26 @@ def geocolor(ax, ds, projection):
     Use origin="lower" for imshow because we are using an interpolated grid of data not
     the native layout for data used in the link.
     """
+    x = ds.longitude
+    y = ds.latitude
+
+    return ax.imshow(
+        geocolor_rgb(ds),
+        origin="lower",
+        extent=[x.min(), x.max(), y.min(), y.max()],
+        transform=projection,
+    )
+
+
+def geocolor_rgb(ds):
+    """The RGB array of the image plotted by :func:`geocolor`
+
+    Args:
+        ds (xarray.Dataset): GOES data interpolated to a regular grid
+
+    Returns:
+        numpy.ndarray: Array with the shape (latitude, longitude, 3)
+    """
     maxval = 120
     gamma = 2.2
 
@@ -18,14 +38,4 @@ def geocolor(ax, ds, projection):
 
     true_green = 0.45 * red + 0.1 * green + 0.45 * blue
 
-    color_array = np.dstack([red, true_green, blue])
-
-    x = ds.longitude
-    y = ds.latitude
-
-    return ax.imshow(
-        color_array,
-        origin="lower",
-        extent=[x.min(), x.max(), y.min(), y.max()],
-        transform=projection,
-    )
+    return np.dstack([red, true_green, blue])
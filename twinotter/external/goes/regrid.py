@@ -0,0 +1,187 @@
+"""
+Interpolation of GOES data to a regular longitude/latitude grid
+
+:func:`scipy.interpolate.griddata` triangulates the GOES pixels every time it is
+called, but the pixels are in the same place in every image. A :class:`Regridder`
+triangulates the pixels once and stores the linear interpolation as a sparse matrix
+of weights, so regridding all the bands of an image is a single matrix product.
+
+The weights are kept in memory by :func:`regridder` and, if a cache directory is
+given (either with the `cache_dir` argument or the `TWINOTTER_CACHE_DIR` environment
+variable), stored on disk keyed by a hash of the GOES coordinates and the grid.
+"""
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+import scipy.sparse
+from scipy.spatial import Delaunay
+import xarray as xr
+
+from ...util import profiling
+
+
+#: Change this when the calculation of the weights changes so that cached weights
+#: are rebuilt
+WEIGHTS_VERSION = 1
+
+# The regridders created in this session by key
+_regridders = dict()
+
+
+def regridder(lon_source, lat_source, lon, lat, cache_dir=None):
+    """The :class:`Regridder` for the given coordinates, reusing the weights if they
+    have already been calculated in this session
+
+    Args:
+        lon_source (numpy.ndarray): The longitudes of the GOES pixels
+        lat_source (numpy.ndarray): The latitudes of the GOES pixels
+        lon (numpy.ndarray): The longitudes of the grid
+        lat (numpy.ndarray): The latitudes of the grid
+        cache_dir (str): Directory to store the weights in
+
+    Returns:
+        Regridder:
+    """
+    key = weights_key(lon_source, lat_source, lon, lat)
+    if key not in _regridders:
+        _regridders[key] = Regridder(
+            lon_source, lat_source, lon, lat, cache_dir=cache_dir, key=key
+        )
+
+    return _regridders[key]
+
+
+def weights_key(lon_source, lat_source, lon, lat):
+    """A hash of the coordinates identifying the interpolation weights"""
+    key = hashlib.sha1(str(WEIGHTS_VERSION).encode())
+    for array in [lon_source, lat_source, lon, lat]:
+        array = np.ascontiguousarray(array, dtype=float)
+        key.update(str(array.shape).encode())
+        key.update(array.tobytes())
+
+    return key.hexdigest()
+
+
+class Regridder:
+    """Linear interpolation from the GOES pixels to a regular longitude/latitude grid
+
+    Gives the same result as :func:`scipy.interpolate.griddata` with the default
+    linear method, i.e. NaN outside the convex hull of the GOES pixels. Pixels with
+    NaN coordinates are ignored.
+
+    Args:
+        lon_source (numpy.ndarray): The longitudes of the GOES pixels
+        lat_source (numpy.ndarray): The latitudes of the GOES pixels
+        lon (numpy.ndarray): The longitudes of the grid
+        lat (numpy.ndarray): The latitudes of the grid
+        cache_dir (str): Directory to store the weights in. Default is the
+            `TWINOTTER_CACHE_DIR` environment variable. The weights aren't stored if
+            neither is given
+        key (str): The result of :func:`weights_key` if already calculated
+    """
+
+    def __init__(self, lon_source, lat_source, lon, lat, cache_dir=None, key=None):
+        self.lon = np.asarray(lon)
+        self.lat = np.asarray(lat)
+        self.source_shape = np.shape(lon_source)
+
+        if key is None:
+            key = weights_key(lon_source, lat_source, lon, lat)
+        self.key = key
+
+        if cache_dir is None:
+            cache_dir = os.environ.get("TWINOTTER_CACHE_DIR")
+
+        if cache_dir is None:
+            path = None
+        else:
+            path = Path(cache_dir) / "goes_regrid_{}.npz".format(key)
+
+        if path is not None and path.exists():
+            self.weights = scipy.sparse.load_npz(path)
+        else:
+            with profiling.span("goes.regrid.weights"):
+                self.weights = _weights(lon_source, lat_source, self.lon, self.lat)
+            if path is not None:
+                _save(path, self.weights)
+
+        # Grid points outside the GOES data have no weights
+        self.outside = np.diff(self.weights.indptr) == 0
+
+    def __call__(self, goes_data, bands):
+        """Interpolate the bands of a GOES dataset to the grid
+
+        Args:
+            goes_data (xarray.Dataset): GOES data with the same coordinates as used to
+                create the regridder
+            bands (list): The variables to interpolate
+
+        Returns:
+            xarray.Dataset:
+        """
+        values = self.regrid(np.stack([goes_data[band].values for band in bands], -1))
+
+        goes_data_grid = xr.Dataset(coords=dict(latitude=self.lat, longitude=self.lon))
+        for n, band in enumerate(bands):
+            goes_data_grid[band] = (["latitude", "longitude"], values[..., n])
+
+        return goes_data_grid
+
+    def regrid(self, values):
+        """Interpolate values at the GOES pixels to the grid
+
+        Args:
+            values (numpy.ndarray): Array with the shape of the GOES coordinates. Any
+                extra trailing dimensions (e.g. bands or times) are kept
+
+        Returns:
+            numpy.ndarray: Array with the shape (latitude, longitude) plus the
+                trailing dimensions of values
+        """
+        values = np.asarray(values)
+        extra_shape = values.shape[len(self.source_shape) :]
+
+        result = self.weights @ values.reshape(self.weights.shape[1], -1)
+        result[self.outside] = np.nan
+
+        return result.reshape((len(self.lat), len(self.lon)) + extra_shape)
+
+
+def _weights(lon_source, lat_source, lon, lat):
+    # The sparse matrix of barycentric weights from the GOES pixels to the grid
+    # (flattened). Each grid point inside the triangulation has the weights of the
+    # three corners of the triangle it is in
+    lon_source = np.ravel(lon_source)
+    lat_source = np.ravel(lat_source)
+    valid = np.flatnonzero(np.isfinite(lon_source) & np.isfinite(lat_source))
+
+    triangulation = Delaunay(np.column_stack([lon_source[valid], lat_source[valid]]))
+
+    lon_grid, lat_grid = np.meshgrid(lon, lat)
+    points = np.column_stack([lon_grid.ravel(), lat_grid.ravel()])
+    simplex = triangulation.find_simplex(points)
+    inside = np.flatnonzero(simplex >= 0)
+
+    # Barycentric coordinates from the affine transforms of the triangles
+    transform = triangulation.transform[simplex[inside]]
+    weights = np.einsum(
+        "ijk,ik->ij", transform[:, :2], points[inside] - transform[:, 2]
+    )
+    weights = np.column_stack([weights, 1 - weights.sum(axis=1)])
+
+    rows = np.repeat(inside, 3)
+    columns = valid[triangulation.simplices[simplex[inside]]].ravel()
+
+    return scipy.sparse.csr_matrix(
+        (weights.ravel(), (rows, columns)), shape=(len(points), len(lon_source))
+    )
+
+
+def _save(path, weights):
+    # Write to a temporary file first so other processes never read a partial file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.stem + ".{}.tmp.npz".format(os.getpid()))
+    scipy.sparse.save_npz(tmp_path, weights)
+    os.replace(tmp_path, path)
@@ -46,7 +46,7 @@ def flight_path(
         ax.text(ds.LON_OXTS[0], ds.LAT_OXTS[0], "S", transform=ccrs.PlateCarree())
         ax.text(ds.LON_OXTS[-1], ds.LAT_OXTS[-1], "F", transform=ccrs.PlateCarree())
 
-    return
+    return lc
 
 
 def flight_path_3d(ds, ax=None):
@@ -10,6 +10,7 @@ from datetime import datetime
 from .. import load_flight
 from .. import plots
 from ..external import eurec4a
+from ..util import profiling
 
 
 def main():
@@ -19,7 +20,9 @@ def main():
     argparser.add_argument("flight_data_path", nargs="+")
     argparser.add_argument("--show-gui", default=False, action="store_true")
 
+    profiling.add_argument(argparser)
     args = argparser.parse_args()
+    profiling.start(args.profile)
 
     for flight_data_path in args.flight_data_path:
         generate(flight_data_path=flight_data_path, show_gui=args.show_gui)
@@ -37,7 +40,9 @@ def generate(flight_data_path, show_gui=False):
     ax.set_extent(bbox, crs=ccrs.PlateCarree())
     fig.tight_layout()
 
-    ds = load_flight(flight_data_path, debug=True)
+    ds = load_flight(
+        flight_data_path, debug=True, variables=["LON_OXTS", "LAT_OXTS", "ALT_OXTS"]
+    )
     plots.flight_path(ax=ax, ds=ds)
 
     fig = ax.figure
@@ -56,7 +61,8 @@ def generate(flight_data_path, show_gui=False):
     if show_gui:
         plt.show()
     else:
-        plt.savefig(str(path_fig), bbox_inches="tight")
+        with profiling.span("savefig"):
+            plt.savefig(str(path_fig), bbox_inches="tight")
         print("Saved flight track to `{}`".format(str(path_fig)))
 
 
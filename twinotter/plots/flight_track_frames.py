@@ -6,6 +6,12 @@
             [<lon_min> <lon_max> <lat_min> <lat_max> <resolution>]
             [--goes_path=<path>]
             [--output_path=<path>]
+            [--cache_dir=<path>]
+            [--jobs=<n>]
+            [--video=<file>]
+            [--fps=<fps>]
+            [--prefetch=<n>]
+            [--profile=<report>]
         flight_track_frames.py  (-h | --help)
 
     Arguments:
@@ -17,22 +23,68 @@
             Folder containing downloaded GOES images [default: .]
         --output_path=<path>
             Folder to put the output frames in [default: .]
-
+        --cache_dir=<path>
+            Folder to store the GOES interpolation weights in. Default is the
+            TWINOTTER_CACHE_DIR environment variable
+        --jobs=<n>
+            Number of processes used to render the frames [default: 1]
+        --video=<file>
+            Write the frames to a video (e.g. .mp4 using ffmpeg) or animated .gif
+            instead of separate .png files
+        --fps=<fps>
+            Frames per second of the video [default: 10]
+        --prefetch=<n>
+            Number of GOES images to load ahead of the frames being rendered
+            [default: 1]
+        --profile=<report>
+            Profile the run and write the report to this file (.json or .csv)
+
+The frames for each GOES image are rendered together, so with `--jobs` each process
+loads and regrids a GOES image and renders the frames for that image. Without
+`--jobs` the next GOES images are loaded and regridded in a background thread while
+the frames are rendered. With
+`--video` the frames are sent directly to ffmpeg (or Pillow for .gif) without
+writing .png files. The video is first written as a part for each GOES image in a
+`<file>.parts` folder, and these are joined when all parts are finished, so an
+interrupted run continues from the last finished part when rerun with the same
+arguments.
 """
 
+import collections
+import concurrent.futures
+import contextlib
 import datetime
+import json
+import os
+from pathlib import Path
+import queue
+import shutil
+import subprocess
+import threading
 
 import numpy as np
 import cartopy.crs as ccrs
+import matplotlib
 import matplotlib.pyplot as plt
-from scipy.interpolate import griddata
-import xarray as xr
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 from .. import load_flight, plots, util
-from ..util import scripting
+from ..util import profiling, scripting
 from ..external import eurec4a, goes
 
 
+#: The GOES bands used to make the geocolor images
+goes_bands = ["refl_0_65um_nom", "refl_0_86um_nom", "refl_0_47um_nom"]
+
+#: The extent of the frames [lon_min, lon_max, lat_min, lat_max]
+frame_bbox = [-60, -56.4, 12, 14.4]
+
+# The flight data used to render frames in this process and the FrameRenderer used
+# for that flight (see _render_frames)
+_dataset = None
+_frame_renderer = None
+
+
 def main():
     scripting.parse_docopt_arguments(generate, __doc__)
     return
@@ -47,17 +99,119 @@ def generate(
     resolution=0.01,
     goes_path=".",
     output_path=".",
+    cache_dir=None,
+    jobs=1,
+    video=None,
+    fps=10,
+    prefetch=1,
 ):
-    substep = datetime.timedelta(minutes=1)
+    """Render a frame each minute of the flight track over the GOES images
+
+    Args:
+        flight_data_path (str):
+        lon_min, lon_max, lat_min, lat_max, resolution (float): The grid the GOES
+            images are interpolated to
+        goes_path (str): Folder containing the GOES netCDF files
+        output_path (str): Folder to save the frames in (if not making a video)
+        cache_dir (str): Folder to store the GOES interpolation weights in
+        jobs (int): The number of processes used to render the frames. If 1 the
+            frames are rendered in this process
+        video (str): Write the frames to this video file instead of separate .png
+            files. An animated GIF if the extension is .gif, otherwise the video is
+            written by ffmpeg
+        fps (float): Frames per second of the video
+        prefetch (int): The number of GOES images loaded and regridded in a
+            background thread ahead of the frames being rendered (if jobs is 1). Use
+            0 to load each image when it is needed
+    """
+    global _dataset, _frame_renderer
 
     # Setup the grid to interpolate the satellite data on to
-    lon = np.arange(lon_min, lon_max, resolution)
-    lat = np.arange(lat_min, lat_max, resolution)
-    lon_grid, lat_grid = np.meshgrid(lon, lat)
+    lon = np.arange(float(lon_min), float(lon_max), float(resolution))
+    lat = np.arange(float(lat_min), float(lat_max), float(resolution))
 
     # Load flight data
     dataset = load_flight(flight_data_path)
 
+    settings = dict(
+        goes_path=str(goes_path),
+        lon=lon,
+        lat=lat,
+        cache_dir=cache_dir,
+        output_path=output_path,
+        flight_number=dataset.attrs["flight_number"],
+        fps=float(fps),
+    )
+
+    scenes = frame_times(dataset)
+    if video is not None:
+        parts_path = _prepare_parts(video, scenes, settings)
+        scenes = [
+            (scene_time, frames, _part_path(parts_path, scene_time, video))
+            for scene_time, frames in scenes
+            if not _part_path(parts_path, scene_time, video).exists()
+        ]
+    else:
+        scenes = [(scene_time, frames, None) for scene_time, frames in scenes]
+
+    if jobs is not None:
+        jobs = int(jobs)
+
+    if jobs == 1:
+        _dataset = dataset
+        try:
+            with contextlib.closing(
+                _prefetch(scenes, settings, int(prefetch))
+            ) as images:
+                for scene, goes_data_grid in images:
+                    _render_frames(*scene, settings, goes_data_grid=goes_data_grid)
+        finally:
+            # Don't keep the flight data and the figure after rendering
+            if _frame_renderer is not None:
+                plt.close(_frame_renderer.fig)
+            _dataset = None
+            _frame_renderer = None
+    else:
+        # Only submit a few more GOES images than there are processes so that
+        # finished parts are recorded as they complete
+        max_pending = 2 * (jobs or os.cpu_count())
+        flight_data_path = str(dataset.attrs["source_file"])
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            pending = collections.deque()
+            for scene in scenes:
+                pending.append(
+                    pool.submit(
+                        profiling.in_worker(_render_frames_in_worker),
+                        flight_data_path,
+                        *scene,
+                        settings,
+                    )
+                )
+                if len(pending) >= max_pending:
+                    profiling.collect(pending.popleft().result())
+
+            while pending:
+                profiling.collect(pending.popleft().result())
+
+    if video is not None:
+        _join_parts(parts_path, video, settings["fps"])
+        print("Saved flight track video to `{}`".format(video))
+
+
+def frame_times(dataset):
+    """The times of the frames for each GOES image
+
+    There is a frame each minute of the flight, using the nearest GOES image
+
+    Args:
+        dataset (xarray.Dataset): The flight data
+
+    Returns:
+        list: The time of each GOES image and a list of the number and time of each
+            frame using that image
+    """
+    substep = datetime.timedelta(minutes=1)
+
     # Get start and end time for satellite data from flight
     start = dataset.Time[0].data.astype("M8[ms]").astype("O")[()]
     end = dataset.Time[-1].data.astype("M8[ms]").astype("O")[()]
@@ -66,54 +220,426 @@ def generate(
     sat_image_time = util.round_datetime(start, goes.time_resolution)
 
     # Loop over satellite images
+    scenes = []
     n = 0
     # Start on the minute
     time = util.round_datetime(start, datetime.timedelta(minutes=1), mode="ceil")
     while time <= end:
-        # Load the current satellite image
-        goes_data = goes.load_nc(goes_path, sat_image_time)
-
-        # Interpolate the satellite data to a regular grid
-        goes_data_grid = xr.Dataset(coords=dict(latitude=lat, longitude=lon))
-        for band in ["refl_0_65um_nom", "refl_0_86um_nom", "refl_0_47um_nom"]:
-            band_grid = griddata(
-                (
-                    goes_data["longitude"].values.flatten(),
-                    goes_data["latitude"].values.flatten(),
-                ),
-                goes_data[band].values.flatten(),
-                (lon_grid, lat_grid),
-            )
-
-            goes_data_grid[band] = (["latitude", "longitude"], band_grid)
+        frames = []
+        while time < sat_image_time + goes.time_resolution / 2 and time <= end:
+            frames.append((n, time))
+            time += substep
+            n += 1
 
+        if frames:
+            scenes.append((sat_image_time, frames))
         sat_image_time += goes.time_resolution
-        while time < sat_image_time - goes.time_resolution / 2 and time <= end:
-            fig, ax = make_frame(goes_data_grid)
 
-            overlay_flight_path_segment(ax, dataset, time)
+    return scenes
+
+
+def _render_frames_in_worker(flight_data_path, *args):
+    # Load the flight the first time a worker process renders frames from it. This
+    # isn't done with the initializer of the process pool, which is Python 3.7+
+    global _dataset
+
+    if _dataset is None or str(_dataset.attrs["source_file"]) != flight_data_path:
+        matplotlib.use("Agg")
+        _dataset = load_flight(flight_data_path)
+
+    _render_frames(*args)
 
+
+def _render_frames(scene_time, frames, part_path, settings, goes_data_grid=None):
+    # Render the frames using a single GOES image, either as separate .png files or
+    # as a part of the video
+    global _frame_renderer
+
+    if goes_data_grid is None:
+        goes_data_grid = _load_goes(scene_time, settings)
+
+    # Reuse the figure for all frames of the same flight
+    if _frame_renderer is None or _frame_renderer.dataset is not _dataset:
+        if _frame_renderer is not None:
+            plt.close(_frame_renderer.fig)
+        _frame_renderer = FrameRenderer(_dataset)
+    _frame_renderer.set_goes_image(goes_data_grid)
+
+    if part_path is not None:
+        writer = _video_writer(part_path, settings["fps"])
+
+    for n, time in frames:
+        rgb = _frame_renderer.render(time)
+
+        if part_path is None:
             path_fig = (
-                output_path
+                settings["output_path"]
                 + "/"
-                + "flight{}_track_frame_{:03d}.png".format(
-                    dataset.attrs["flight_number"], n
-                )
+                + "flight{}_track_frame_{:03d}.png".format(settings["flight_number"], n)
             )
-            plt.text(
-                0, 0, str(time), transform=ax.transAxes, fontdict=dict(color="green")
-            )
-            plt.savefig(path_fig, bbox_inches="tight")
+            with profiling.span("savefig"):
+                plt.imsave(path_fig, rgb)
             print("Saved flight track to `{}`".format(str(path_fig)))
-            plt.close()
+        else:
+            with profiling.span("savefig"):
+                writer.write(rgb)
 
-            time += substep
-            n += 1
+    if part_path is not None:
+        writer.close()
+        print("Saved frames {}-{} to `{}`".format(frames[0][0], n, part_path))
+
+
+def _load_goes(scene_time, settings):
+    # Load the current satellite image
+    goes_data = goes.load_nc(settings["goes_path"], scene_time)
+
+    # Interpolate the satellite data to a regular grid
+    return regrid(
+        goes_data, settings["lon"], settings["lat"], cache_dir=settings["cache_dir"]
+    )
+
+
+def _prefetch(scenes, settings, size):
+    # Yield each scene with its regridded GOES image. The following images are
+    # loaded in a background thread while the frames are rendered, with at most
+    # `size` images waiting. Errors loading an image are raised here
+    if size == 0:
+        for scene in scenes:
+            yield scene, _load_goes(scene[0], settings)
+        return
+
+    loaded = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def load():
+        try:
+            for scene in scenes:
+                if stop.is_set():
+                    return
+                loaded.put((scene, _load_goes(scene[0], settings), None))
+        except BaseException as error:
+            loaded.put((None, None, error))
+        else:
+            loaded.put(None)
+
+    thread = threading.Thread(target=load, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = loaded.get()
+            if item is None:
+                return
+
+            scene, goes_data_grid, error = item
+            if error is not None:
+                raise error
+            yield scene, goes_data_grid
+    finally:
+        # Stop loading images if rendering stopped early, emptying the queue so the
+        # thread isn't left waiting to add an image
+        stop.set()
+        while thread.is_alive():
+            try:
+                loaded.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+class FrameRenderer:
+    """Draw the frames of a flight track over GOES images, redrawing only the parts
+    that change
+
+    The figure is the same as from :func:`make_frame` and
+    :func:`overlay_flight_path_segment`. The map, GOES image, HALO circle, full
+    flight path and colour bar are drawn once for each GOES image and the pixels are
+    copied. Each frame restores the copy and only draws the flight path within the
+    GOES time resolution, the aircraft marker and the time on top (blitting).
+
+    Args:
+        dataset (xarray.Dataset): The flight data
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.time = dataset.Time.values
+        self.lon = dataset.LON_OXTS.values
+        self.lat = dataset.LAT_OXTS.values
+        self.altitude = dataset.ALT_OXTS.values / 1000
+        self.heading = dataset.HDG_OXTS.values
+
+        self.fig, self.ax = make_frame(None)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.goes_image = None
+
+        # Plot the full flight path in a faded red
+        plots.flight_path(
+            ax=self.ax,
+            ds=dataset,
+            vmin=-10,
+            vmax=0,
+            cmap="Reds",
+            alpha=0.3,
+            linewidths=3,
+            add_cmap=False,
+        )
+
+        # The artists that change with each frame. These are left out when the
+        # figure is drawn and drawn separately on top
+        self.segment = plots.flight_path(
+            ax=self.ax,
+            ds=dataset.isel(Time=slice(0, 2)),
+            cmap="cool",
+            mark_end_points=False,
+        )
+        self.markers = [
+            self.ax.plot([], [], marker=(n, 0, 0), color="red")[0] for n in [2, 3]
+        ]
+        self.text = self.ax.text(
+            0, 0, "", transform=self.ax.transAxes, fontdict=dict(color="green")
+        )
+        self.animated = [self.segment] + self.markers + [self.text]
+        for artist in self.animated:
+            artist.set_animated(True)
+
+        self.background = None
+        self.crop = None
+
+    def set_goes_image(self, goes_data):
+        """Draw the figure with a new GOES image
+
+        Args:
+            goes_data (xarray.Dataset): GOES data interpolated to a regular grid
+        """
+        if self.goes_image is None:
+            self.goes_image = goes.plot.geocolor(self.ax, goes_data, ccrs.PlateCarree())
+            self.ax.set_extent(frame_bbox, crs=ccrs.PlateCarree())
+        else:
+            self.goes_image.set_data(goes.plot.geocolor_rgb(goes_data))
+
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+
+        # The pixels kept when saving with bbox_inches="tight". Found once so every
+        # frame is the same size
+        if self.crop is None:
+            renderer = self.canvas.get_renderer()
+            bbox = self.fig.get_tightbbox(renderer).padded(
+                matplotlib.rcParams["savefig.pad_inches"]
+            )
+            height = self.fig.bbox.height
+            x0, y0, x1, y1 = np.round(bbox.extents * self.fig.dpi).astype(int)
+            self.crop = (
+                slice(max(int(height) - y1, 0), int(height) - y0),
+                slice(max(x0, 0), x1),
+            )
+
+    def render(self, time):
+        """Draw the frame at the given time
+
+        Args:
+            time (datetime.datetime): The time of the frame. There must be flight data
+                at this time
+
+        Returns:
+            numpy.ndarray: The RGB pixels of the frame
+        """
+        # Plot the flight track +- the satellite resolution
+        start = np.searchsorted(
+            self.time, np.datetime64(time - goes.time_resolution), side="left"
+        )
+        end = np.searchsorted(
+            self.time, np.datetime64(time + goes.time_resolution), side="right"
+        )
+        points = np.column_stack([self.lon[start:end], self.lat[start:end]])
+        self.segment.set_segments(np.stack([points[:-1], points[1:]], axis=1))
+        self.segment.set_array(self.altitude[start:end])
+
+        # Add a marker with the current position and rotation
+        n = np.searchsorted(self.time, np.datetime64(time))
+        if n == len(self.time) or self.time[n] != np.datetime64(time):
+            raise KeyError("No flight data at {}".format(time))
+        for marker, points in zip(self.markers, [2, 3]):
+            marker.set_data([self.lon[n]], [self.lat[n]])
+            marker.set_marker((points, 0, -float(self.heading[n])))
+
+        self.text.set_text(str(time))
+
+        self.canvas.restore_region(self.background)
+        for artist in self.animated:
+            self.ax.draw_artist(artist)
+
+        return np.asarray(self.canvas.buffer_rgba())[self.crop + (slice(0, 3),)].copy()
+
+
+def _prepare_parts(video, scenes, settings):
+    # The folder for the parts of the video. The settings used for the parts are
+    # stored alongside them and parts made with different settings are removed
+    parts_path = Path(str(video) + ".parts")
+    state = dict(
+        frames=[[str(time) for n, time in frames] for scene_time, frames in scenes],
+        grid=[settings["lon"].tolist(), settings["lat"].tolist()],
+        goes_path=settings["goes_path"],
+        fps=settings["fps"],
+    )
+
+    state_path = parts_path / "state.json"
+    if state_path.exists():
+        with open(state_path) as state_file:
+            if json.load(state_file) != state:
+                print("Removing parts of `{}` with different settings".format(video))
+                shutil.rmtree(parts_path)
+
+    if not state_path.exists():
+        parts_path.mkdir(parents=True, exist_ok=True)
+        with open(state_path, "w") as state_file:
+            json.dump(state, state_file)
+
+    return parts_path
+
+
+def _part_path(parts_path, scene_time, video):
+    return parts_path / "part_{:%Y%m%d_%H%M}{}".format(scene_time, Path(video).suffix)
+
+
+def _join_parts(parts_path, video, fps):
+    # Join the finished parts to make the video and remove the parts
+    parts = sorted(parts_path.glob("part_*" + Path(video).suffix))
+
+    if Path(video).suffix.lower() == ".gif":
+        from PIL import Image, ImageSequence
+
+        frames = [
+            frame.copy()
+            for part in parts
+            for frame in ImageSequence.Iterator(Image.open(part))
+        ]
+        frames[0].save(
+            video,
+            save_all=True,
+            append_images=frames[1:],
+            duration=1000 / fps,
+            loop=0,
+        )
+    else:
+        list_path = parts_path / "parts.txt"
+        with open(list_path, "w") as list_file:
+            for part in parts:
+                list_file.write("file '{}'\n".format(part.absolute()))
+
+        subprocess.run(
+            [_ffmpeg(), "-y", "-loglevel", "error", "-f", "concat", "-safe", "0"]
+            + ["-i", str(list_path), "-c", "copy", str(video)],
+            check=True,
+        )
+
+    shutil.rmtree(parts_path)
+
+
+def _video_writer(path, fps):
+    if path.suffix.lower() == ".gif":
+        return _GIFWriter(path, fps)
+    else:
+        return _FFmpegWriter(path, fps)
+
+
+def _ffmpeg():
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise FileNotFoundError(
+            "ffmpeg is needed to write videos. Use a .gif file for an animated GIF"
+        )
+
+    return ffmpeg
+
+
+class _FFmpegWriter:
+    # Pipe raw RGB frames to ffmpeg. The video is written to a temporary file and
+    # moved to the path when finished so an existing part is always complete
+    def __init__(self, path, fps):
+        self.path = path
+        self.tmp_path = path.with_name("tmp_" + path.name)
+        self.fps = fps
+        self.process = None
+
+    def write(self, rgb):
+        if self.process is None:
+            height, width = rgb.shape[:2]
+            self.process = subprocess.Popen(
+                [_ffmpeg(), "-y", "-loglevel", "error"]
+                + ["-f", "rawvideo", "-pix_fmt", "rgb24"]
+                + ["-s", "{}x{}".format(width, height), "-r", str(self.fps)]
+                + ["-i", "-"]
+                # H.264 needs an even number of pixels in each direction
+                + ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p"]
+                + [str(self.tmp_path)],
+                stdin=subprocess.PIPE,
+            )
+
+        self.process.stdin.write(np.ascontiguousarray(rgb).tobytes())
+
+    def close(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError("ffmpeg failed writing {}".format(self.tmp_path))
+        os.replace(self.tmp_path, self.path)
+
+
+class _GIFWriter:
+    # Collect the frames and write an animated GIF when finished
+    def __init__(self, path, fps):
+        self.path = path
+        self.tmp_path = path.with_name("tmp_" + path.name)
+        self.fps = fps
+        self.frames = []
+
+    def write(self, rgb):
+        from PIL import Image
+
+        self.frames.append(Image.fromarray(rgb).quantize())
+
+    def close(self):
+        self.frames[0].save(
+            self.tmp_path,
+            save_all=True,
+            append_images=self.frames[1:],
+            duration=1000 / self.fps,
+            loop=0,
+        )
+        os.replace(self.tmp_path, self.path)
+
+
+@profiling.profiled("goes.regrid")
+def regrid(goes_data, lon, lat, bands=goes_bands, cache_dir=None):
+    """Interpolate GOES data to a regular longitude/latitude grid
+
+    The interpolation weights are calculated once for the GOES coordinates and grid
+    and reused for later images (see :mod:`twinotter.external.goes.regrid`)
+
+    Args:
+        goes_data (xarray.Dataset): GOES data from
+            :func:`twinotter.external.goes.load_nc`
+        lon (numpy.ndarray): The longitudes of the grid
+        lat (numpy.ndarray): The latitudes of the grid
+        bands (list): The variables to interpolate
+        cache_dir (str): Directory to store the interpolation weights in
+
+    Returns:
+        xarray.Dataset:
+    """
+    regridder = goes.regrid.regridder(
+        goes_data["longitude"].values,
+        goes_data["latitude"].values,
+        lon,
+        lat,
+        cache_dir=cache_dir,
+    )
+
+    return regridder(goes_data, bands)
 
 
 def make_frame(goes_data):
     # create figure
-    bbox = [-60, -56.4, 12, 14.4]
+    bbox = frame_bbox
     domain_aspect = (bbox[3] - bbox[2]) / (bbox[1] - bbox[0])
     fig = plt.figure(figsize=(11.0, domain_aspect * 10), dpi=96)
     projection = ccrs.PlateCarree()
@@ -122,7 +648,8 @@ def make_frame(goes_data):
     plots.add_land_and_sea(ax)
 
     # Plot the current satellite image
-    goes.plot.geocolor(ax, goes_data, projection)
+    if goes_data is not None:
+        goes.plot.geocolor(ax, goes_data, projection)
 
     eurec4a.add_halo_circle(ax, color="teal", linewidth=3)
 
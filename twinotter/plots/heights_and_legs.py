@@ -3,7 +3,8 @@ from pathlib import Path
 from tqdm import tqdm
 import matplotlib.pyplot as plt
 
-from .. import load_flight, load_segments
+from .. import load_flight, load_segments, SegmentIndex
+from ..util import profiling
 
 
 colors = {
@@ -20,7 +21,9 @@ def main():
     argparser.add_argument("flight_segments_file")
     argparser.add_argument("--show-gui", default=False, action="store_true")
     argparser.add_argument("--output_path", default=None)
+    profiling.add_argument(argparser)
     args = argparser.parse_args()
+    profiling.start(args.profile)
 
     generate(
         args.flight_data_path,
@@ -31,7 +34,7 @@ def main():
 
 
 def generate(flight_data_path, flight_segments_file, show_gui=False, output_path=None):
-    ds = load_flight(flight_data_path)
+    ds = load_flight(flight_data_path, variables=["ALT_OXTS", "ROLL_OXTS"])
     segments = load_segments(flight_segments_file)
 
     # Produce the basic time-height plot
@@ -44,8 +47,8 @@ def generate(flight_data_path, flight_segments_file, show_gui=False, output_path
     ax2.set_ylabel("Roll Angle")
 
     # For each segment overlay a coloured line onto the time-height plot
-    for segment in tqdm(segments["segments"]):
-        ds_section = ds.sel(Time=slice(segment["start"], segment["end"]))
+    index = SegmentIndex(ds, segments)
+    for segment, ds_section in tqdm(index.iter_segments(), total=len(index)):
         label = segment["kinds"][0]
 
         linestyle = "-"
@@ -91,7 +94,8 @@ def generate(flight_data_path, flight_segments_file, show_gui=False, output_path
             output_path = Path(output_path)
 
         output_path.parent.mkdir(exist_ok=True)
-        plt.savefig(str(output_path), bbox_inches="tight")
+        with profiling.span("savefig"):
+            plt.savefig(str(output_path), bbox_inches="tight")
 
 
 if __name__ == "__main__":
@@ -20,6 +20,7 @@ from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import pandas as pd
 
 from .. import load_flight
+from ..util import profiling
 from . import flight_path
 
 
@@ -39,9 +40,13 @@ def main():
     argparser = argparse.ArgumentParser()
     argparser.add_argument("flight_data_path")
 
+    profiling.add_argument(argparser)
     args = argparser.parse_args()
+    profiling.start(args.profile)
 
-    ds = load_flight(flight_data_path=args.flight_data_path)
+    ds = load_flight(
+        flight_data_path=args.flight_data_path, variables=["ROLL_OXTS", "ALT_OXTS"]
+    )
 
     root = tkinter.Tk()
     app = FlightPhaseGenerator(ds, root)
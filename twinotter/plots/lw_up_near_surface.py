@@ -17,10 +17,13 @@ from pathlib import Path
 
 import twinotter
 import twinotter.external.eurec4a
+from twinotter.util import profiling
 
 
 def main(flight_data_path, alt_max=100.0):
-    ds = twinotter.load_flight(flight_data_path)
+    ds = twinotter.load_flight(
+        flight_data_path, variables=["ALT_OXTS", "LAT_OXTS", "LON_OXTS", "LW_UP_C"]
+    )
 
     da_alt = ds.ALT_OXTS
     da_lat = ds.LAT_OXTS
@@ -63,9 +66,12 @@ if __name__ == "__main__":
     argparser = argparse.ArgumentParser()
     argparser.add_argument('flight_data_path', nargs="+")
 
+    profiling.add_argument(argparser)
     args = argparser.parse_args()
+    profiling.start(args.profile)
 
     for flight_data_path in tqdm(args.flight_data_path):
         fig, ds = main(flight_data_path=flight_data_path)
         fn = f"flight{ds.flight_number}__lw_up_surface.png"
-        plt.savefig(Path(flight_data_path)/"figures"/fn)
+        with profiling.span("savefig"):
+            plt.savefig(Path(flight_data_path)/"figures"/fn)
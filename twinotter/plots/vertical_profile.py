@@ -3,6 +3,7 @@ from metpy.plots import SkewT
 import dateutil.parser
 
 from .. import load_flight
+from ..util import profiling
 
 
 def main(
@@ -131,7 +132,9 @@ if __name__ == "__main__":
         "--type", choices=["skewt", "linear_altitude"], default="skewt"
     )
 
+    profiling.add_argument(argparser)
     args = argparser.parse_args()
+    profiling.start(args.profile)
 
     kws = dict(plot_type=args.type)
 
@@ -0,0 +1,133 @@
+"""Quality control of MASIN data using the `*_FLAG` variables
+
+Each MASIN variable has a companion flag variable with the values
+
+0. quality_good
+1. minor_data_quality_issue
+2. major_data_quality_issue
+3. data_not_quality_controlled
+
+A :class:`QCPolicy` decides which flag values are accepted for each variable and
+what happens to data that fails. Variables listed in `drop` remove the whole data
+point (e.g. there is no position without GPS) whereas variables listed in `mask` are
+only set to NaN, so the other measurements at that time are kept.
+"""
+import numpy as np
+
+
+class QCPolicy:
+    """A set of rules for filtering bad data
+
+    Args:
+        drop (list): Drop the data points where any of these variables are bad
+            (the flag is not accepted or the value is NaN)
+        mask (list | str): Set these variables to NaN where their flag is not
+            accepted. Use "all" to mask every variable that has a flag
+        accepted (tuple | dict): The accepted flag values. Either the values for all
+            variables or a dictionary mapping variable names to accepted values.
+            Variables missing from the dictionary accept 0 (quality_good)
+        flags (dict): Mapping of variable names to the name of their flag variable if
+            it isn't the variable name followed by "_FLAG"
+    """
+
+    def __init__(self, drop=("LON_OXTS",), mask=(), accepted=(0,), flags=None):
+        self.drop = list(drop)
+        self.mask = mask if mask == "all" else list(mask)
+        self.accepted = accepted
+        self.flags = dict() if flags is None else dict(flags)
+
+    def __repr__(self):
+        return "QCPolicy(drop={!r}, mask={!r}, accepted={!r}, flags={!r})".format(
+            self.drop, self.mask, self.accepted, self.flags
+        )
+
+    def flag(self, name):
+        """The name of the flag variable for the given variable"""
+        return self.flags.get(name, "{}_FLAG".format(name))
+
+    def accepted_values(self, name):
+        """The accepted flag values for the given variable"""
+        if isinstance(self.accepted, dict):
+            return list(self.accepted.get(name, (0,)))
+        else:
+            return list(self.accepted)
+
+    def required_variables(self, variables=None, available=None):
+        """The variables needed to apply this policy to the given variables
+
+        Args:
+            variables (list): The variables to be loaded. Default is all variables
+            available (collection): The variables in the file (e.g. the dataset).
+                If given, the flags of masked variables are only included if they
+                are available, because not every variable has a flag
+
+        Returns:
+            list:
+        """
+        required = []
+        for name in self.drop:
+            required += [name, self.flag(name)]
+
+        if variables is not None:
+            flags = [
+                self.flag(name)
+                for name in variables
+                if self.mask == "all" or name in self.mask
+            ]
+            required += [
+                flag for flag in flags if available is None or flag in available
+            ]
+
+        return required
+
+    def row_mask(self, ds):
+        """Find the good data points
+
+        Only the variables in `drop` (and their flags) are read.
+
+        Args:
+            ds (xarray.Dataset): MASIN dataset with the data_point dimension
+
+        Returns:
+            numpy.ndarray: Boolean array which is True for the data points to keep
+        """
+        good = np.ones(ds.sizes["data_point"], dtype=bool)
+        for name in self.drop:
+            good &= np.isin(ds[self.flag(name)].values, self.accepted_values(name))
+            good &= ds[name].notnull().values
+
+        return good
+
+    def apply(self, ds):
+        """Remove the bad data from the dataset
+
+        The bad data points are removed with a single indexing operation so variables
+        keep their data types. Masked variables are converted to float where they
+        contain bad data.
+
+        Args:
+            ds (xarray.Dataset): MASIN dataset with the data_point dimension
+
+        Returns:
+            xarray.Dataset:
+        """
+        ds = ds.isel(data_point=np.flatnonzero(self.row_mask(ds)))
+
+        # Variables without a flag can't be masked
+        if self.mask == "all":
+            masked = [name for name in ds.data_vars if self.flag(name) in ds]
+        else:
+            masked = [
+                name for name in self.mask if name in ds and self.flag(name) in ds
+            ]
+
+        for name in masked:
+            ds[name] = ds[name].where(
+                ds[self.flag(name)].isin(self.accepted_values(name))
+            )
+
+        return ds
+
+
+#: Used when no policy is given. Drop the data points without good position data
+default_policy = QCPolicy()
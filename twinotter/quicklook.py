@@ -8,165 +8,422 @@ Usage::
 
     $ python -m twinotter.quicklook <flight_data_path> <flight_segments_file>
 
+Several flights can be given as pairs of flight data path and segments file. Use
+`--jobs N` to render the plots in N processes::
+
+    $ python -m twinotter.quicklook flight330 segments330.yaml \
+        flight331 segments331.yaml --jobs 8
+
 """
 
+import collections
+import concurrent.futures
+import itertools
+import os
 from pathlib import Path
 
 import numpy as np
+import matplotlib
 import matplotlib.pyplot as plt
 import scipy.constants
 import metpy.calc
+from metpy.plots import SkewT
 from metpy.units import units
 
-from . import load_flight, load_segments, count_segments, extract_segments, derive
-from .plots import vertical_profile
+from . import load_flight, load_segments, SegmentIndex, derive
+from .util import profiling
 
 
 def main():
     import argparse
 
     argparser = argparse.ArgumentParser()
-    argparser.add_argument("flight_data_path")
-    argparser.add_argument("flight_segments_file")
+    argparser.add_argument(
+        "flights",
+        nargs="+",
+        metavar="flight_data_path flight_segments_file",
+        help="The flight data path and segments file of each flight",
+    )
+    argparser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes used to render the plots",
+    )
+    argparser.add_argument(
+        "--template",
+        action="store_true",
+        help="Create the figures once and reuse them for each segment",
+    )
 
+    profiling.add_argument(argparser)
     args = argparser.parse_args()
+    profiling.start(args.profile)
 
-    generate(
-        flight_data_path=args.flight_data_path,
-        flight_segments_file=args.flight_segments_file,
+    if len(args.flights) % 2 != 0:
+        argparser.error("Give a flight segments file for each flight data path")
+
+    generate_flights(
+        flights=list(zip(args.flights[::2], args.flights[1::2])),
+        jobs=args.jobs,
+        template=args.template,
     )
 
     return
 
 
-def generate(flight_data_path, flight_segments_file):
-    ds = load_flight(flight_data_path)
-    flight_segments = load_segments(flight_segments_file)
+def generate(flight_data_path, flight_segments_file, jobs=1, template=False):
+    """Save the quicklook plots for a flight in the current directory
 
-    # Quicklook plots for the full flight
-    figures = plot_level(ds)
-    savefigs(figures, ds.attrs["flight_number"], "", "")
+    Args:
+        flight_data_path (str):
+        flight_segments_file (str):
+        jobs (int): The number of processes used to render the plots. If 1 the
+            plots are rendered in this process
+        template (bool): Create the figures once (in each process) and only
+            update the data for each plot. See :class:`LevelTemplate`
+    """
+    generate_flights(
+        [(flight_data_path, flight_segments_file)], jobs=jobs, template=template
+    )
 
-    plot_individual_phases(ds, flight_segments, "level", plot_level)
-    plot_individual_phases(ds, flight_segments, "profile", plot_profile)
 
-    # Make a combined plot of all profiles
-    profiles = extract_segments(ds, flight_segments, "profile")
-    figures = plot_profile(profiles)
-    savefigs(figures, ds.attrs["flight_number"], "profile", "_combined")
+def generate_flights(flights, jobs=1, template=False):
+    """Save the quicklook plots for several flights in the current directory
 
+    Each flight is loaded in turn and the plots of the full flight and each segment
+    are rendered in a pool of processes with the Agg backend. Only the data for the
+    segment is sent to the process rendering it.
 
-def plot_individual_phases(ds, flight_segments, segment_type, plot_func):
-    for n in range(count_segments(flight_segments, segment_type)):
-        ds_section = extract_segments(ds, flight_segments, segment_type, n)
-        figures = plot_func(ds_section)
-        savefigs(figures, ds.attrs["flight_number"], segment_type, n)
+    Args:
+        flights (list): The flight data path and segments file of each flight
+        jobs (int): The number of processes used to render the plots. If 1 the
+            plots are rendered in this process. If None the number of CPUs is used
+        template (bool): Create the figures once (in each process) and only
+            update the data for each plot. See :class:`LevelTemplate`
+    """
+    plots = itertools.chain.from_iterable(
+        _plots(flight_data_path, flight_segments_file)
+        for flight_data_path, flight_segments_file in flights
+    )
 
+    if jobs == 1:
+        for plot in plots:
+            _render(*plot, template=template)
+        return
+
+    # Only submit a few more plots than there are processes so the flights aren't
+    # all loaded before the first plots are rendered
+    max_pending = 2 * (jobs or os.cpu_count())
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = collections.deque()
+        for plot in plots:
+            pending.append(
+                pool.submit(
+                    profiling.in_worker(_render_in_worker), *plot, template=template
+                )
+            )
+            if len(pending) >= max_pending:
+                profiling.collect(pending.popleft().result())
+
+        while pending:
+            profiling.collect(pending.popleft().result())
+
+
+def _plots(flight_data_path, flight_segments_file):
+    # The data, plot type, label and number for each quicklook plot of a flight
+    ds = load_flight(flight_data_path)
+    flight_segments = load_segments(flight_segments_file)
 
-def plot_level(ds):
-    figures = []
+    # Quicklook plots for the full flight
+    yield ds, "level", "", ""
 
-    fig, axes = plt.subplots(nrows=5, ncols=1, sharex="all", figsize=[16, 15])
+    index = SegmentIndex(ds, flight_segments)
+    for segment_type in ["level", "profile"]:
+        for n in range(index.count(segment_type)):
+            yield index.segment(segment_type, n), segment_type, segment_type, n
 
-    # Temperature and Dewpoint
-    axes[0].plot(ds.Time, ds.TAT_ND_R, label=r"True")
-    axes[0].plot(ds.Time, ds.TDEW_BUCK, label=r"Dewpoint")
-    axes[0].set_ylabel("Temperature (K)")
-    axes[0].legend()
+    # Make a combined plot of all profiles
+    yield index.select("profile"), "profile", "profile", "_combined"
 
-    # Velocities
-    axes[1].plot(ds.Time, ds.U_OXTS, label=r"Zonal")
-    axes[1].plot(ds.Time, ds.V_OXTS, label=r"Meridional")
-    axes[1].set_ylabel("Velocity (m s$^{-1}$)")
-    axes[1].legend()
 
-    axes[2].plot(ds.Time, ds.W_OXTS, label=r"Vertical")
-    axes[2].set_ylabel("Vertical Velocity (m s$^{-1}$)")
+def _render(ds, plot_type, label, n, template=False):
+    if template:
+        # Reuse the figures created for earlier plots of the same type
+        if plot_type not in _templates:
+            template_class = dict(level=LevelTemplate, profile=ProfileTemplate)
+            _templates[plot_type] = template_class[plot_type]()
+        figures = _templates[plot_type].update(ds)
+    else:
+        figures = dict(level=plot_level, profile=plot_profile)[plot_type](ds)
 
-    # Shortwave radiation
-    axes[3].plot(ds.Time, ds.SW_DN_C, label=r"SW Downwelling")
-    axes[3].plot(ds.Time, ds.SW_UP_C, label=r"SW Upwelling")
+    savefigs(figures, ds.attrs["flight_number"], label, n, close=not template)
 
-    # Longwave radiation
-    axes[3].plot(ds.Time, ds.LW_DN_C, label=r"LW Downwelling")
-    axes[3].plot(ds.Time, ds.LW_UP_C, label=r"LW Upwelling")
 
-    axes[3].set_ylabel("Irradiance (W m$^{-2}$)")
-    axes[3].legend()
+def _render_in_worker(*args, **kwargs):
+    # Worker processes don't need a GUI backend. This isn't set with the initializer
+    # of the process pool, which is Python 3.7+
+    matplotlib.use("Agg")
+    _render(*args, **kwargs)
 
-    # CPC Concentration
-    axes[4].plot(ds.Time, ds.CPC_CONC)
-    axes[4].set_ylabel("CPC Concentration (m$^{-3}$)")
 
-    figures.append([fig, "quicklook"])
+# The figure templates in this process for each plot type, created when first used
+_templates = dict()
 
-    # Not all flights have LICOR data
-    try:
-        fig, axes = plt.subplots(nrows=2, ncols=1, sharex="all", figsize=[16, 15])
-        # LICOR data
-        axes[0].plot(ds.Time, ds.CO2_LICOR, label=r"CO$_2$ LICOR")
-        axes[0].plot(ds.Time, ds.H2O_LICOR, label=r"H$_2$O LICOR")
-        axes[0].set_ylabel("Mole Fraction")
-        axes[0].legend()
 
-        axes[1].plot(ds.Time, derive.specific_humidity(ds))
-        axes[1].set_ylabel("Specific Humidity")
+def plot_individual_phases(ds, flight_segments, segment_type, plot_func):
+    # Find the segments once rather than searching the dataset for every segment
+    if isinstance(flight_segments, SegmentIndex):
+        index = flight_segments
+    else:
+        index = SegmentIndex(ds, flight_segments)
+
+    for n in range(index.count(segment_type)):
+        ds_section = index.segment(segment_type, n)
+        figures = plot_func(ds_section)
+        savefigs(figures, ds.attrs["flight_number"], segment_type, n)
 
-        figures.append([fig, "quicklook_LICOR"])
-    except AttributeError:
-        pass
 
-    fig, ax = plt.subplots(figsize=[8, 5])
+def plot_level(ds):
+    """The quicklook figures for a level leg (or the full flight)
 
-    ax.scatter(
-        derive.calculate("equivalent_potential_temperature", ds),
-        metpy.calc.specific_humidity_from_dewpoint(ds.PS_AIR, ds.TDEW_BUCK),
-        alpha=0.1,
-    )
-    ax.set_xlabel(r"$\theta_e$")
-    ax.set_ylabel("Specific Humidity")
-    figures.append([fig, "paluch"])
+    Args:
+        ds (xarray.Dataset):
 
-    return figures
+    Returns:
+        list: The figures and their names
+    """
+    return LevelTemplate().update(ds)
 
 
 def plot_profile(dataset):
-    p = dataset.PS_AIR
-    T = dataset.TAT_ND_R
-    Td = dataset.TDEW_BUCK
-    u = dataset.U_OXTS
-    v = dataset.V_OXTS
-    fig1 = vertical_profile.skewt(
-        p, T - scipy.constants.zero_Celsius, Td - scipy.constants.zero_Celsius, u, v
-    )
-
-    theta = metpy.calc.potential_temperature(p * units("hPa"), T * units("K"))
-    fig2 = plt.figure()
-    plt.plot(theta, dataset.ALT_OXTS, "k.")
-    plt.xlim(295, 320)
-    plt.ylim(0, 4000)
-    plt.xlabel("Potential Temperature (K)")
-    plt.ylabel("Altitude (m)")
-    plt.title("Flight {}".format(dataset.attrs["flight_number"]))
-
-    rh = metpy.calc.relative_humidity_from_dewpoint(T * units("K"), Td * units("K"))
-    fig3 = plt.figure()
-    plt.plot(rh, dataset.ALT_OXTS, "b.")
-    plt.xlim(0, 1)
-    plt.ylim(0, 4000)
-    plt.xlabel("Relative Humidity")
-    plt.ylabel("Altitude (m)")
-    plt.title("Flight {}".format(dataset.attrs["flight_number"]))
-
-    return [(fig1, "skewt"), (fig2, "theta_0-4km"), (fig3, "rh_0-4km")]
-
+    """The quicklook figures for a profile
+
+    Args:
+        dataset (xarray.Dataset):
+
+    Returns:
+        list: The figures and their names
+    """
+    return ProfileTemplate().update(dataset)
+
+
+class LevelTemplate:
+    """The figures of :func:`plot_level` that can be reused for each segment
+
+    Creating the figures, axes, legends and labels takes longer than plotting the
+    data, so the figures are created once and :meth:`update` only replaces the data
+    of the lines and rescales the axes. The figures returned by :meth:`update` are
+    the same each time so save them before the next update and don't close them.
+    """
+
+    # The axes, variable and label of each line in the quicklook figure
+    lines = [
+        # Temperature and Dewpoint
+        (0, "TAT_ND_R", r"True"),
+        (0, "TDEW_BUCK", r"Dewpoint"),
+        # Velocities
+        (1, "U_OXTS", r"Zonal"),
+        (1, "V_OXTS", r"Meridional"),
+        (2, "W_OXTS", r"Vertical"),
+        # Shortwave radiation
+        (3, "SW_DN_C", r"SW Downwelling"),
+        (3, "SW_UP_C", r"SW Upwelling"),
+        # Longwave radiation
+        (3, "LW_DN_C", r"LW Downwelling"),
+        (3, "LW_UP_C", r"LW Upwelling"),
+        # CPC Concentration
+        (4, "CPC_CONC", None),
+    ]
+
+    # The variables in the LICOR figure
+    licor_variables = ["CO2_LICOR", "H2O_LICOR"]
+
+    def __init__(self):
+        self.figure, axes = plt.subplots(
+            nrows=5, ncols=1, sharex="all", figsize=[16, 15]
+        )
+        self.quicklook_lines = {
+            name: axes[n].plot([], [], label=label)[0] for n, name, label in self.lines
+        }
+        axes[0].set_ylabel("Temperature (K)")
+        axes[1].set_ylabel("Velocity (m s$^{-1}$)")
+        axes[2].set_ylabel("Vertical Velocity (m s$^{-1}$)")
+        axes[3].set_ylabel("Irradiance (W m$^{-2}$)")
+        axes[4].set_ylabel("CPC Concentration (m$^{-3}$)")
+        for n in [0, 1, 3]:
+            axes[n].legend()
+
+        for ax in self.figure.axes:
+            ax.xaxis.update_units(np.array([0], dtype="datetime64[ns]"))
+
+        # The LICOR figure is created when first needed because not all flights
+        # have LICOR data
+        self.licor_figure = None
+
+        self.paluch_figure, ax = plt.subplots(figsize=[8, 5])
+        self.paluch = ax.scatter([], [], alpha=0.1)
+        ax.set_xlabel(r"$\theta_e$")
+        ax.set_ylabel("Specific Humidity")
+
+    def update(self, ds):
+        """Plot the data from a segment
+
+        Args:
+            ds (xarray.Dataset):
+
+        Returns:
+            list: The figures and their names
+        """
+        time = ds.Time.values
+        for name, line in self.quicklook_lines.items():
+            line.set_data(time, _values(ds[name]))
+        figures = [(self.figure, "quicklook")]
+
+        # Not all flights have LICOR data
+        if all(name in ds for name in self.licor_variables):
+            if self.licor_figure is None:
+                self._create_licor_figure()
+            for name, line in self.licor_lines.items():
+                line.set_data(time, _values(ds[name]))
+            self.specific_humidity_line.set_data(
+                time, _values(derive.specific_humidity(ds))
+            )
+            figures.append((self.licor_figure, "quicklook_LICOR"))
+
+        self.paluch.set_offsets(
+            np.column_stack(
+                [
+                    _values(derive.calculate("equivalent_potential_temperature", ds)),
+                    _values(
+                        metpy.calc.specific_humidity_from_dewpoint(
+                            ds.PS_AIR, ds.TDEW_BUCK
+                        )
+                    ),
+                ]
+            )
+        )
+        figures.append((self.paluch_figure, "paluch"))
+
+        for figure, name in figures:
+            for ax in figure.axes:
+                _rescale(ax)
+
+        return figures
+
+    def _create_licor_figure(self):
+        self.licor_figure, axes = plt.subplots(
+            nrows=2, ncols=1, sharex="all", figsize=[16, 15]
+        )
+        self.licor_lines = dict(
+            CO2_LICOR=axes[0].plot([], [], label=r"CO$_2$ LICOR")[0],
+            H2O_LICOR=axes[0].plot([], [], label=r"H$_2$O LICOR")[0],
+        )
+        axes[0].set_ylabel("Mole Fraction")
+        axes[0].legend()
+        (self.specific_humidity_line,) = axes[1].plot([], [])
+        axes[1].set_ylabel("Specific Humidity")
 
-def savefigs(figures, flight_number, label, n):
+        for ax in self.licor_figure.axes:
+            ax.xaxis.update_units(np.array([0], dtype="datetime64[ns]"))
+
+
+class ProfileTemplate:
+    """The figures of :func:`plot_profile` that can be reused for each segment
+
+    See :class:`LevelTemplate`
+    """
+
+    def __init__(self):
+        self.skewt_figure = plt.figure(figsize=(9, 9))
+        self.skew = SkewT(self.skewt_figure)
+        (self.temperature_line,) = self.skew.plot([], [], "r")
+        (self.dewpoint_line,) = self.skew.plot([], [], "g")
+        self.skew.plot_dry_adiabats()
+        self.skew.plot_moist_adiabats()
+        self.skew.plot_mixing_lines()
+        self.skew.ax.set_xlim(-10, 30)
+
+        self.theta_figure = plt.figure()
+        (self.theta_line,) = plt.plot([], [], "k.")
+        plt.xlim(295, 320)
+        plt.ylim(0, 4000)
+        plt.xlabel("Potential Temperature (K)")
+        plt.ylabel("Altitude (m)")
+
+        self.rh_figure = plt.figure()
+        (self.rh_line,) = plt.plot([], [], "b.")
+        plt.xlim(0, 1)
+        plt.ylim(0, 4000)
+        plt.xlabel("Relative Humidity")
+        plt.ylabel("Altitude (m)")
+
+    def update(self, dataset):
+        """Plot the data from a segment
+
+        Args:
+            dataset (xarray.Dataset):
+
+        Returns:
+            list: The figures and their names
+        """
+        p = dataset.PS_AIR
+        T = dataset.TAT_ND_R
+        Td = dataset.TDEW_BUCK
+
+        # Skew-T lines are plotted as temperature against pressure
+        self.temperature_line.set_data(
+            _values(T) - scipy.constants.zero_Celsius, _values(p)
+        )
+        self.dewpoint_line.set_data(
+            _values(Td) - scipy.constants.zero_Celsius, _values(p)
+        )
+        self.skew.ax.set_ylim(1050, float(p.min()))
+
+        title = "Flight {}".format(dataset.attrs["flight_number"])
+
+        theta = metpy.calc.potential_temperature(p * units("hPa"), T * units("K"))
+        self.theta_line.set_data(_values(theta), _values(dataset.ALT_OXTS))
+        self.theta_figure.axes[0].set_title(title)
+
+        rh = metpy.calc.relative_humidity_from_dewpoint(T * units("K"), Td * units("K"))
+        self.rh_line.set_data(_values(rh), _values(dataset.ALT_OXTS))
+        self.rh_figure.axes[0].set_title(title)
+
+        return [
+            (self.skewt_figure, "skewt"),
+            (self.theta_figure, "theta_0-4km"),
+            (self.rh_figure, "rh_0-4km"),
+        ]
+
+
+def _values(array):
+    # The values of a DataArray as a numpy array, without units if the data is a
+    # pint quantity
+    data = getattr(array, "data", array)
+    return np.asarray(getattr(data, "magnitude", data))
+
+
+def _rescale(ax):
+    # Update the axes limits after the data has changed. Scatter plots aren't
+    # included by relim so add their points explicitly
+    ax.relim()
+    for collection in ax.collections:
+        offsets = np.asarray(collection.get_offsets())
+        offsets = offsets[np.isfinite(offsets).all(axis=1)]
+        if len(offsets) > 0:
+            ax.update_datalim(offsets)
+    ax.autoscale_view()
+
+
+def savefigs(figures, flight_number, label, n, close=True):
     for fig, figname in figures:
         fn = "flight{}_{}{}_{}.png".format(flight_number, label, n, figname)
         print(fn)
-        fig.savefig(fn)
-        plt.close(fig)
+        with profiling.span("savefig"):
+            fig.savefig(fn)
+        if close:
+            plt.close(fig)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,180 @@
+"""Fast access to the flight segments of a dataset
+
+The flight segments (from :func:`twinotter.load_segments`) are matched to the times
+in the dataset once and stored as integer start/stop positions so each segment can
+be returned as a view of the dataset without searching or copying the data.
+"""
+import numpy as np
+import pandas as pd
+
+from .util import profiling
+
+
+class SegmentIndex:
+    """Start and stop positions of the flight segments in a dataset
+
+    Args:
+        ds (xarray.Dataset): Flight dataset indexed by Time
+        segments (dict): Flight segments description from
+            :func:`twinotter.load_segments`
+    """
+
+    @profiling.profiled("segments.index")
+    def __init__(self, ds, segments):
+        self.ds = ds
+        self.segments = segments["segments"]
+
+        times = ds.Time.values
+        # With a dtype so that flights without segments can be searched
+        starts = np.array(
+            [_to_datetime64(segment["start"]) for segment in self.segments],
+            dtype="datetime64[ns]",
+        )
+        ends = np.array(
+            [_to_datetime64(segment["end"]) for segment in self.segments],
+            dtype="datetime64[ns]",
+        )
+
+        # Matches the points selected with ds.sel(Time=slice(start, end))
+        self.starts = np.searchsorted(times, starts, side="left")
+        self.stops = np.searchsorted(times, ends, side="right")
+
+        # The segment numbers of each kind of segment
+        kinds = dict()
+        for n, segment in enumerate(self.segments):
+            for kind in segment["kinds"]:
+                kinds.setdefault(kind, []).append(n)
+        self.kinds = {kind: np.array(numbers) for kind, numbers in kinds.items()}
+
+    def __len__(self):
+        return len(self.segments)
+
+    def count(self, segment_type=None):
+        """The number of segments of the requested type
+
+        Args:
+            segment_type (str): The label of a segment type. Default is all segments
+
+        Returns:
+            int:
+        """
+        return len(self._numbers(segment_type))
+
+    def positions(self, segment_type=None):
+        """The start and stop positions of the segments along the Time dimension
+
+        Args:
+            segment_type (str): The label of a segment type. Default is all segments
+
+        Returns:
+            tuple: Arrays of the start and stop positions (stop is exclusive)
+        """
+        numbers = self._numbers(segment_type)
+        return self.starts[numbers], self.stops[numbers]
+
+    def segment(self, segment_type, segment_idx):
+        """A single segment of the dataset
+
+        Args:
+            segment_type (str): The label of a segment type. None for all segments
+            segment_idx (int): The index of the segment within the flight (starts at
+                zero)
+
+        Returns:
+            xarray.Dataset: A view of the dataset (the data isn't copied)
+        """
+        n = self._numbers(segment_type)[segment_idx]
+        return self.ds.isel(Time=slice(self.starts[n], self.stops[n]))
+
+    def iter_segments(self, segment_type=None):
+        """Iterate over the segments of the requested type
+
+        Args:
+            segment_type (str): The label of a segment type. Default is all segments
+
+        Yields:
+            tuple: The segment description (dict) and a view of the dataset
+        """
+        for n in self._numbers(segment_type):
+            yield self.segments[n], self.ds.isel(
+                Time=slice(self.starts[n], self.stops[n])
+            )
+
+    def batches(self, segment_type=None, batch_size=10):
+        """Iterate over the segments of the requested type in batches
+
+        Args:
+            segment_type (str): The label of a segment type. Default is all segments
+            batch_size (int): The maximum number of segments in each batch
+
+        Yields:
+            list: The views of the dataset for each segment in the batch
+        """
+        batch = []
+        for segment, ds_segment in self.iter_segments(segment_type):
+            batch.append(ds_segment)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+
+        if len(batch) > 0:
+            yield batch
+
+    @profiling.profiled("segments.select")
+    def select(self, segment_type=None):
+        """All segments of the requested type joined along the Time dimension
+
+        Equivalent to concatenating each segment but the data is only copied once.
+
+        Args:
+            segment_type (str): The label of a segment type. Default is all segments
+
+        Returns:
+            xarray.Dataset:
+        """
+        return self.ds.isel(Time=self._indices(segment_type))
+
+    def ragged(self, segment_type=None):
+        """All segments of the requested type as a contiguous ragged array
+
+        The segments are joined along the Time dimension (as in :meth:`select`) with
+        a `row_size` variable giving the number of points in each segment, following
+        the CF conventions for contiguous ragged arrays, and a `segment_index`
+        coordinate along Time giving the segment of each point.
+
+        Args:
+            segment_type (str): The label of a segment type. Default is all segments
+
+        Returns:
+            xarray.Dataset:
+        """
+        starts, stops = self.positions(segment_type)
+        row_size = stops - starts
+
+        segment_index = np.repeat(np.arange(len(row_size)), row_size)
+
+        ds = self.select(segment_type)
+        ds = ds.assign_coords(segment_index=("Time", segment_index))
+        ds["row_size"] = ("segment", row_size)
+        ds["row_size"].attrs["sample_dimension"] = "Time"
+
+        return ds
+
+    def _numbers(self, segment_type):
+        if segment_type is None:
+            return np.arange(len(self.segments))
+        else:
+            return self.kinds.get(segment_type, np.array([], dtype=int))
+
+    def _indices(self, segment_type):
+        starts, stops = self.positions(segment_type)
+        if len(starts) == 0:
+            return np.array([], dtype=int)
+
+        return np.concatenate(
+            [np.arange(start, stop) for start, stop in zip(starts, stops)]
+        )
+
+
+def _to_datetime64(time):
+    return pd.Timestamp(time).to_datetime64()
@@ -3,109 +3,540 @@ Check a directory for core_masin netCDF files and generate a summary .csv file
 of the flights in these files
 
 > python -m twinotter.summary /path/to/data /path/to/summary.csv
+
+Only the netCDF headers are read, in parallel processes. Use `--extra` to add the
+duration, number of samples and the ranges of altitude and position to the summary,
+which reads only the position variables in blocks.
+
+If the summary file ends in .sqlite or .db the summary is stored in an SQLite
+database instead, with typed columns, and only new or changed entries are written.
+Select flights from the database with :func:`query`, e.g.
+
+>>> flights = query("summary.sqlite", date_range=("2020-01-24", "2020-02-01"))
 """
+import concurrent.futures
+import contextlib
 import datetime
 from pathlib import Path
+import re
+import sqlite3
 
+import netCDF4
+import numpy as np
 import parse
 import pandas as pd
-import xarray as xr
 
-from . import generate_file_path, MASIN_CORE_FORMAT
+from . import MASIN_CORE_FORMAT, MASIN_CORE_RE
+from .catalog import read_header, scan
+from .qc import default_policy
+from .util import profiling
 
 time_format = "{hours:02d}:{minutes:02d}:{seconds:02d} UTC"
 
+#: The columns of the summary .csv file. The size and modification time of each
+#: file are used to find files that have changed since the summary was generated
+columns = [
+    "Flight Number",
+    "Date",
+    "Start",
+    "End",
+    "Revision",
+    "Frequency",
+    "Size",
+    "Modified",
+]
+
+#: The columns added with `extra=True`. The duration and number of samples are from
+#: the file header and the ranges are from the data passing its own quality control
+#: flag
+extra_columns = [
+    "Duration",
+    "Samples",
+    "Min Altitude",
+    "Max Altitude",
+    "Min Latitude",
+    "Max Latitude",
+    "Min Longitude",
+    "Max Longitude",
+]
+
+# The variables used for the ranges in the extra columns
+_range_variables = dict(
+    Altitude="ALT_OXTS",
+    Latitude="LAT_OXTS",
+    Longitude="LON_OXTS",
+)
+
+# The number of data points read at a time for the extra columns
+_block_size = 100000
+
+#: File extensions of summaries stored in an SQLite database
+store_suffixes = [".sqlite", ".db"]
+
+_schema = """
+CREATE TABLE IF NOT EXISTS flights (
+    flight_number INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    start_time TEXT NOT NULL,
+    end_time TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    frequency INTEGER NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    duration REAL,
+    samples INTEGER,
+    min_altitude REAL,
+    max_altitude REAL,
+    min_latitude REAL,
+    max_latitude REAL,
+    min_longitude REAL,
+    max_longitude REAL,
+    PRIMARY KEY (date, flight_number, revision, frequency)
+);
+CREATE INDEX IF NOT EXISTS flights_flight_number ON flights (flight_number);
+"""
+
+# The columns of the database for each column of the .csv file. The date is stored
+# as YYYY-MM-DD, the start and end as ISO 8601 date and time (so they can be
+# compared as text) and the duration in seconds
+_store_columns = {
+    "Flight Number": "flight_number",
+    "Date": "date",
+    "Start": "start_time",
+    "End": "end_time",
+    "Revision": "revision",
+    "Frequency": "frequency",
+    "Size": "size",
+    "Modified": "mtime_ns",
+    "Duration": "duration",
+    "Samples": "samples",
+    "Min Altitude": "min_altitude",
+    "Max Altitude": "max_altitude",
+    "Min Latitude": "min_latitude",
+    "Max Latitude": "max_latitude",
+    "Min Longitude": "min_longitude",
+    "Max Longitude": "max_longitude",
+}
+
 
 def main():
     import argparse
 
     argparser = argparse.ArgumentParser()
     argparser.add_argument("flight_data_path")
-    argparser.add_argument("flight_summary_path")
+    argparser.add_argument(
+        "flight_summary_path", help=".csv file or SQLite database (.sqlite or .db)"
+    )
+    argparser.add_argument(
+        "--catalog", default=None, help="SQLite file to store the file catalog in"
+    )
+    argparser.add_argument(
+        "--extra",
+        action="store_true",
+        help="Add the duration, number of samples and altitude and position ranges",
+    )
+    argparser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="Number of processes used to read the files",
+    )
 
+    profiling.add_argument(argparser)
     args = argparser.parse_args()
+    profiling.start(args.profile)
+
+    if args.catalog is not None:
+        from .catalog import Catalog
+
+        catalog = Catalog(args.flight_data_path, args.catalog)
+    else:
+        catalog = None
 
     generate(
         flight_data_path=args.flight_data_path,
         flight_summary_path=args.flight_summary_path,
+        catalog=catalog,
+        extra=args.extra,
+        processes=args.processes,
     )
 
     return
 
 
-def generate(flight_data_path, flight_summary_path):
-    # Get a list of netCDF files in the obs/ folder which match the expected
-    # file pattern
-    fn_pattern = MASIN_CORE_FORMAT.format(
-        date="*", revision="*", flight_num="*", freq="*"
-    )
+def generate(
+    flight_data_path, flight_summary_path, catalog=None, extra=False, processes=None
+):
+    """Create or update the summary of the flights in a directory
+
+    The directory is walked once and only the headers of files that are new, or
+    whose size or modification time has changed since the summary was last
+    generated, are read. Entries for files that are no longer in the directory are
+    kept.
+
+    Args:
+        flight_data_path (str): The directory containing the MASIN files.
+            Subdirectories are included
+        flight_summary_path (str): The .csv file or SQLite database (ending in one
+            of :data:`store_suffixes`) to create or update
+        catalog (twinotter.catalog.Catalog): Use the file information stored in
+            the catalog instead of walking the directory and reading the files
+        extra (bool): Add the :data:`extra_columns` to the summary. Existing entries
+            without them are updated. Entries that already have them keep them, and
+            files that have changed are read with the extra columns, even if this
+            is False
+        processes (int): The number of processes used to read the files. Default is
+            the number of CPUs
+    """
+    files = _find_files(flight_data_path, catalog)
+    files_by_name = {path.name: path for path in files}
+
+    store = Path(flight_summary_path).suffix.lower() in store_suffixes
+
+    # Keep the existing entries for files that haven't changed
+    rows = []
+    # The files to read with the extra columns
+    extra_files = set(files) if extra else set()
+    write_extra = extra
+    if Path(flight_summary_path).exists():
+        if store:
+            existing = _read_store(flight_summary_path)
+        else:
+            existing = pd.read_csv(flight_summary_path)
+            write_extra |= any(column in existing for column in extra_columns)
+            existing = existing.to_dict("records")
+
+        for entry in existing:
+            filename = _filename(entry)
+
+            if filename not in files_by_name:
+                print("{} not available".format(filename))
+                rows.append(entry)
+                continue
+
+            path = files_by_name[filename]
+            if _unchanged(entry, files[path]) and not (
+                extra and pd.isna(entry.get("Samples"))
+            ):
+                print("{} already in .csv".format(filename))
+                rows.append(entry)
+                del files[path]
+            elif not pd.isna(entry.get("Samples")):
+                # Don't lose the extra columns of changed files
+                extra_files.add(path)
+
+    # Remaining files are new or have changed so read their information
+    extras = [path in extra_files for path in files]
+    if processes == 1 or len(files) <= 1:
+        new_rows = list(map(_summarise, files, files.values(), extras))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            new_rows = [
+                profiling.collect(row)
+                for row in executor.map(
+                    profiling.in_worker(_summarise), files, files.values(), extras
+                )
+            ]
+
+    # Only the new entries are written to the database
+    if store:
+        _write_store(flight_summary_path, new_rows)
+        print("{} entries updated".format(len(new_rows)))
+        return
+
+    rows += new_rows
+    if write_extra:
+        flight_summary = pd.DataFrame(rows, columns=columns + extra_columns)
+    else:
+        flight_summary = pd.DataFrame(rows, columns=columns)
+    flight_summary.sort_values(["Flight Number", "Revision", "Frequency"], inplace=True)
+    print(flight_summary)
 
-    file_paths = list(Path(flight_data_path).rglob(fn_pattern))
+    # Overwrite the old csv
+    flight_summary.to_csv(flight_summary_path, index=False)
 
-    # Check if the flight summary file already exists
-    if Path(flight_summary_path).exists():
-        flight_summary = pd.read_csv(Path(flight_summary_path))
-
-        for index, entry in flight_summary.iterrows():
-            # Get the filename of existing entries in flight_information.csv
-            file_path = generate_file_path(
-                flight_number=entry["Flight Number"],
-                date=entry["Date"],
-                frequency=entry["Frequency"],
-                revision=entry["Revision"],
-                flight_data_path=flight_data_path,
+    return
+
+
+def query(
+    flight_summary_path,
+    date_range=None,
+    flight_number=None,
+    revision=None,
+    frequency=None,
+    min_duration=None,
+    columns=None,
+):
+    """Select flights from a summary database created by :func:`generate`
+
+    The selection is done by the database so only the matching entries are read.
+
+    Args:
+        flight_summary_path (str): The SQLite database
+        date_range (tuple): The first and last dates (inclusive) as
+            :class:`datetime.date`, :class:`datetime.datetime` or a string that
+            pandas can parse. The time of day is ignored. Either can be None
+        flight_number (int | list): A flight number or list of flight numbers
+        revision (int | str): The revision, or "most_recent" for only the most
+            recent revision of each flight
+        frequency (int): Frequency in Hz
+        min_duration (datetime.timedelta): The minimum duration of the flight
+        columns (list): The columns to return (names in the database). Default is all
+            columns
+
+    Returns:
+        pandas.DataFrame: The matching entries sorted by date, flight number and
+            revision. The dates are returned as datetimes and the duration as a
+            timedelta
+
+    Raises:
+        FileNotFoundError: If the database doesn't exist
+
+        ValueError: If any of the columns aren't in the database
+    """
+    if not Path(flight_summary_path).exists():
+        raise FileNotFoundError(flight_summary_path)
+
+    if columns is None:
+        columns = list(_store_columns.values())
+    else:
+        unknown = [
+            column for column in columns if column not in _store_columns.values()
+        ]
+        if unknown:
+            raise ValueError(
+                "Unknown columns {}. Choose from {}".format(
+                    unknown, list(_store_columns.values())
+                )
             )
 
-            # Check which files are already contained in the .csv
-            if file_path in file_paths:
-                print("{} already in .csv".format(file_path.name))
-                file_paths.remove(file_path)
+    conditions = []
+    values = []
+
+    if date_range is not None:
+        first, last = date_range
+        # Dates are stored as YYYY-MM-DD
+        if first is not None:
+            conditions.append("date >= ?")
+            values.append(pd.Timestamp(first).strftime("%Y-%m-%d"))
+        if last is not None:
+            conditions.append("date <= ?")
+            values.append(pd.Timestamp(last).strftime("%Y-%m-%d"))
+
+    if flight_number is not None:
+        flight_numbers = np.atleast_1d(flight_number).tolist()
+        conditions.append(
+            "flight_number IN ({})".format(", ".join("?" * len(flight_numbers)))
+        )
+        values += flight_numbers
+
+    if revision == "most_recent":
+        conditions.append(
+            "revision = (SELECT MAX(revision) FROM flights AS other "
+            "WHERE other.date = flights.date "
+            "AND other.flight_number = flights.flight_number "
+            "AND other.frequency = flights.frequency)"
+        )
+    elif revision is not None:
+        conditions.append("revision = ?")
+        values.append(int(revision))
+
+    if frequency is not None:
+        conditions.append("frequency = ?")
+        values.append(int(frequency))
+
+    if min_duration is not None:
+        conditions.append("duration >= ?")
+        values.append(min_duration.total_seconds())
+
+    sql = "SELECT {} FROM flights".format(", ".join(columns))
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY date, flight_number, revision, frequency"
+
+    with contextlib.closing(sqlite3.connect(str(flight_summary_path))) as connection:
+        flights = pd.read_sql_query(sql, connection, params=values)
+
+    for column in ["date", "start_time", "end_time"]:
+        if column in flights:
+            flights[column] = pd.to_datetime(flights[column])
+    if "duration" in flights:
+        flights["duration"] = pd.to_timedelta(flights["duration"], unit="s")
+
+    return flights
+
+
+def _read_store(flight_summary_path):
+    # The existing entries of a summary database with the names of the .csv columns
+    # used to find the files that have changed
+    names = [
+        "Flight Number",
+        "Date",
+        "Revision",
+        "Frequency",
+        "Size",
+        "Modified",
+        "Samples",
+    ]
+
+    with contextlib.closing(sqlite3.connect(str(flight_summary_path))) as connection:
+        connection.executescript(_schema)
+        rows = connection.execute(
+            "SELECT {} FROM flights".format(
+                ", ".join(_store_columns[name] for name in names)
+            )
+        ).fetchall()
+
+    return [dict(zip(names, row)) for row in rows]
+
+
+def _write_store(flight_summary_path, rows):
+    # Add or replace entries in a summary database
+    with contextlib.closing(sqlite3.connect(str(flight_summary_path))) as connection:
+        connection.executescript(_schema)
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO flights ({}) VALUES ({})".format(
+                    ", ".join(_store_columns.values()),
+                    ", ".join("?" * len(_store_columns)),
+                ),
+                [_to_store(row) for row in rows],
+            )
+
+
+def _to_store(row):
+    # The values of a summary row in the types stored in the database
+    date = datetime.datetime.strptime(row["Date"], "%Y-%m-%d")
+    start = date + pd.Timedelta(row["Start"]).to_pytimedelta()
+    end = date + pd.Timedelta(row["End"]).to_pytimedelta()
+
+    # Flights that finish after midnight
+    if end < start:
+        end += datetime.timedelta(days=1)
+
+    values = dict(row, Start=start.isoformat(), End=end.isoformat())
+    values["Duration"] = (end - start).total_seconds()
 
-            # Other files in the .csv but not in the folder
-            else:
-                print("{} not available".format(file_path.name))
+    return [values.get(name) for name in _store_columns]
 
+
+def _find_files(flight_data_path, catalog):
+    # The MASIN files in the directory with their size, modification time and (if
+    # already known from the catalog) time coverage
+    if catalog is not None:
+        root = Path(flight_data_path).absolute()
+        return {
+            entry["path"]: entry
+            for entry in catalog.find()
+            if root in entry["path"].parents
+        }
     else:
-        flight_summary = pd.DataFrame(
-            columns=["Flight Number", "Date", "Start", "End", "Revision", "Frequency"]
-        )
+        return {
+            path: dict(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            for path, stat in scan(flight_data_path)
+        }
+
+
+def _filename(entry):
+    # The MASIN filename for an entry in the summary
+    return MASIN_CORE_FORMAT.format(
+        date=str(entry["Date"]).replace("-", ""),
+        revision="{:03d}".format(int(entry["Revision"])),
+        flight_num="{:03d}".format(int(entry["Flight Number"])),
+        freq=int(entry["Frequency"]),
+    )
 
-    # Remaining files are present but not in the .csv
-    # Add these new files to the .csv
-    for path in file_paths:
-        # Get date, flight number, revision and frequency from the filename
-        flight_info = parse.parse(MASIN_CORE_FORMAT, path.name)
-
-        # Format the date so it is more readable in the csv
-        date = flight_info["date"]
-        YYYY, MM, DD = int(date[0:4]), int(date[4:6]), int(date[6:8])
-        date = datetime.datetime(YYYY, MM, DD)
-
-        # Extract flight start and end from the netCDF file
-        dataset = xr.open_dataset(path, decode_times=False)
-        start = extract_time(dataset, "time_coverage_start")
-        end = extract_time(dataset, "time_coverage_end")
-
-        # Add flight information to .csv
-        flight_summary = flight_summary.append(
-            {
-                "Flight Number": int(flight_info["flight_num"]),
-                "Date": date.strftime("%Y-%m-%d"),
-                "Start": str(start),
-                "End": str(end),
-                "Revision": int(flight_info["revision"]),
-                "Frequency": int(flight_info["freq"]),
-            },
-            ignore_index=True,
-        )
 
-    flight_summary.sort_values("Flight Number", inplace=True)
-    print(flight_summary)
+def _unchanged(entry, file_info):
+    # Summaries created before the size and modification time were stored are
+    # assumed to be up to date
+    if pd.isna(entry.get("Size")) or pd.isna(entry.get("Modified")):
+        return True
 
-    # Overwrite the old csv
-    flight_summary.to_csv(flight_summary_path, index=False)
+    return (int(entry["Size"]), int(entry["Modified"])) == (
+        file_info["size"],
+        file_info["mtime_ns"],
+    )
 
-    return
+
+def _summarise(path, file_info, extra=False):
+    # The row of the summary for a single file
+    flight_info = re.match(MASIN_CORE_RE, path.name).groupdict()
+    date = datetime.datetime.strptime(flight_info["date"], "%Y%m%d")
+
+    # Extract flight start and end from the netCDF header (unless already read by
+    # the catalog)
+    if "time_coverage_start" not in file_info or (extra and "sizes" not in file_info):
+        file_info = dict(file_info, **read_header(path))
+
+    start = _parse_time(file_info["time_coverage_start"])
+    end = _parse_time(file_info["time_coverage_end"])
+
+    row = {
+        "Flight Number": int(flight_info["flight_num"]),
+        "Date": date.strftime("%Y-%m-%d"),
+        "Start": str(start),
+        "End": str(end),
+        "Revision": int(flight_info["revision"]),
+        "Frequency": int(flight_info["freq"]),
+        "Size": file_info["size"],
+        "Modified": file_info["mtime_ns"],
+    }
+
+    if extra:
+        # Flights that finish after midnight
+        if end < start:
+            end += datetime.timedelta(days=1)
+
+        row["Duration"] = str(end - start)
+        row["Samples"] = file_info["sizes"]["data_point"]
+        row.update(_ranges(path))
+
+    return row
+
+
+def _ranges(path):
+    # The minimum and maximum of the altitude and position variables, reading one
+    # block of data points at a time. Data that is NaN or whose own flag isn't one
+    # of the values accepted by the default QC policy is excluded. The row mask of
+    # the policy isn't applied, so a bad LON_OXTS flag doesn't exclude the altitude
+    # or latitude
+    minimum = {name: np.inf for name in _range_variables}
+    maximum = {name: -np.inf for name in _range_variables}
+
+    with netCDF4.Dataset(str(path)) as dataset:
+        size = len(dataset.dimensions["data_point"])
+        for start in range(0, size, _block_size):
+            block = slice(start, start + _block_size)
+            for name, variable in _range_variables.items():
+                if variable not in dataset.variables:
+                    continue
+
+                flag = default_policy.flag(variable)
+                values = np.ma.filled(dataset[variable][block], np.nan)
+                if flag in dataset.variables:
+                    flags = np.ma.filled(dataset[flag][block], -1)
+                else:
+                    flags = None
+
+                good = np.isfinite(values)
+                if flags is not None:
+                    good &= np.isin(flags, default_policy.accepted_values(variable))
+
+                if good.any():
+                    minimum[name] = min(minimum[name], values[good].min())
+                    maximum[name] = max(maximum[name], values[good].max())
+
+    ranges = dict()
+    for name in _range_variables:
+        if minimum[name] <= maximum[name]:
+            ranges["Min " + name] = float(minimum[name])
+            ranges["Max " + name] = float(maximum[name])
+        else:
+            ranges["Min " + name] = np.nan
+            ranges["Max " + name] = np.nan
+
+    return ranges
 
 
 def extract_date(dataset):
@@ -118,8 +549,10 @@ def extract_date(dataset):
 
 
 def extract_time(dataset, name):
-    time = dataset.attrs[name]
+    return _parse_time(dataset.attrs[name])
+
 
+def _parse_time(time):
     # parse returns a dictionary when the format string has named entries.
     # use .named to get the dictionary and pass directly as keyword arguments
     # to datetime.timedelta
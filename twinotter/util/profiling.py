@@ -0,0 +1,329 @@
+"""
+Timing and peak memory of the stages of processing
+
+The loader, derived variables, segment extraction, GOES loading and figure saving
+are wrapped in named spans. Profiling is off by default, and then a span costs only
+a check of a flag. Turn it on with the `TWINOTTER_PROFILE` environment variable or
+the `--profile` argument of the command line scripts, giving the file to write the
+report to (.json or .csv). e.g.
+
+> TWINOTTER_PROFILE=profile.csv python -m twinotter.quicklook <flight_data_path> ...
+
+The report has a row for each stage with the number of calls, total and maximum
+time, and the peak memory allocated within the stage (measured with tracemalloc).
+Spans can be nested, e.g. the QC filtering is part of loading the flight.
+
+Spans recorded in worker processes (e.g. :func:`twinotter.load_campaign` or the
+`--jobs` option of the scripts) are sent back to the main process by running the
+function with :func:`in_worker` and passing the result through :func:`collect`. The
+peak memory is only measured from Python 3.9, which added
+:func:`tracemalloc.reset_peak`.
+"""
+import atexit
+import csv
+import functools
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import threading
+import time
+import tracemalloc
+
+
+#: Environment variable with the path to write the profiling report to
+env_var = "TWINOTTER_PROFILE"
+
+enabled = False
+
+# The results for each finished span (name, duration and peak memory) and the spans
+# currently running in each thread
+_records = []
+_threads = threading.local()
+_report_path = None
+
+# tracemalloc.reset_peak is needed to measure the peak memory of each span
+_measure_memory = hasattr(tracemalloc, "reset_peak")
+
+columns = [
+    "stage",
+    "calls",
+    "total_time",
+    "mean_time",
+    "max_time",
+    "peak_memory_mb",
+]
+
+
+def add_argument(argparser):
+    """Add the --profile argument to a command line script
+
+    Call :func:`start` with the parsed argument to turn on profiling
+    """
+    argparser.add_argument(
+        "--profile",
+        default=None,
+        metavar="REPORT",
+        help="Profile the run and write the report to this file (.json or .csv)",
+    )
+
+
+def start(report_path=None, memory=True):
+    """Turn on profiling and write the report when the program exits
+
+    Args:
+        report_path (str): The file to write the report to (.json or .csv). Does
+            nothing if this is None
+        memory (bool): Also measure the peak memory with tracemalloc (Python 3.9+).
+            This makes the program slower
+    """
+    global _report_path
+
+    if report_path is None:
+        return
+
+    if _report_path is None:
+        atexit.register(_write_at_exit)
+    _report_path = report_path
+
+    enable(memory=memory)
+
+
+def enable(memory=True):
+    """Start recording spans
+
+    Args:
+        memory (bool): Also measure the peak memory with tracemalloc (Python 3.9+)
+    """
+    global enabled
+
+    if memory and _measure_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    enabled = True
+
+
+def disable():
+    """Stop recording spans. The results recorded so far are kept"""
+    global enabled
+
+    enabled = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def reset():
+    """Remove all results"""
+    _records.clear()
+
+
+def span(name):
+    """Record the time and peak memory of a block of code
+
+    >>> with profiling.span("load_flight"):
+    ...     ds = load_flight(...)
+
+    Args:
+        name (str): The name of the stage
+
+    Returns:
+        A context manager
+    """
+    if enabled:
+        return _Span(name)
+    else:
+        return _null_span
+
+
+def profiled(name):
+    """Decorator to record the time and peak memory of each call to a function
+
+    Args:
+        name (str): The name of the stage
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+
+            with _Span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def in_worker(function):
+    """Wrap a function run in a worker process so that the spans it records are
+    returned along with its result
+
+    >>> future = executor.submit(profiling.in_worker(load_flight), path)
+    >>> ds = profiling.collect(future.result())
+
+    Args:
+        function: A picklable function
+
+    Returns:
+        A picklable function returning a tuple of the result and the records. Pass
+        this to :func:`collect`
+    """
+    return functools.partial(_run_in_worker, function)
+
+
+def collect(result):
+    """Add the spans recorded by a function wrapped with :func:`in_worker` to the
+    results of this process
+
+    Args:
+        result (tuple): The value returned by the wrapped function
+
+    Returns:
+        The result of the original function
+    """
+    result, records = result
+    _records.extend(records)
+
+    return result
+
+
+def report():
+    """Summarise the recorded spans by stage
+
+    Returns:
+        list: A dictionary for each stage (with the keys in :data:`columns`) in the
+            order the stages were first finished
+    """
+    stages = dict()
+    for name, duration, peak_memory in _records:
+        if name not in stages:
+            stages[name] = dict(
+                stage=name,
+                calls=0,
+                total_time=0.0,
+                max_time=0.0,
+                peak_memory_mb=None,
+            )
+        stage = stages[name]
+        stage["calls"] += 1
+        stage["total_time"] += duration
+        stage["max_time"] = max(stage["max_time"], duration)
+        if peak_memory is not None:
+            stage["peak_memory_mb"] = max(
+                stage["peak_memory_mb"] or 0, peak_memory / 1e6
+            )
+
+    for stage in stages.values():
+        stage["mean_time"] = stage["total_time"] / stage["calls"]
+
+    return [{key: stage[key] for key in columns} for stage in stages.values()]
+
+
+def write_report(path):
+    """Write the summary from :func:`report` to a JSON or CSV file
+
+    Args:
+        path (str): The output file. CSV if the extension is .csv, otherwise JSON
+    """
+    stages = report()
+
+    if Path(path).suffix.lower() == ".csv":
+        with open(path, "w", newline="") as report_file:
+            writer = csv.DictWriter(report_file, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(stages)
+    else:
+        with open(path, "w") as report_file:
+            json.dump(dict(pid=os.getpid(), stages=stages), report_file, indent=2)
+
+
+class _NullSpan:
+    # Does nothing, for when profiling is off (contextlib.nullcontext is Python 3.7+)
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+class _Span:
+    def __init__(self, name):
+        self.name = name
+        self.peak = 0
+
+    def __enter__(self):
+        running = _running_spans()
+
+        memory = _measure_memory and tracemalloc.is_tracing()
+        if memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # Keep the peak reached so far by the enclosing span before resetting
+            if running:
+                running[-1].peak = max(running[-1].peak, peak)
+            tracemalloc.reset_peak()
+            self.start_memory = current
+            self.peak = current
+        else:
+            self.start_memory = None
+
+        running.append(self)
+        self.start_time = time.perf_counter()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.start_time
+        running = _running_spans()
+        running.pop()
+
+        if self.start_memory is not None and tracemalloc.is_tracing():
+            peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            if running:
+                running[-1].peak = max(running[-1].peak, peak)
+            peak_memory = peak - self.start_memory
+        else:
+            peak_memory = None
+
+        _records.append((self.name, duration, peak_memory))
+
+        return False
+
+
+def _running_spans():
+    # The spans running in this thread, so spans in background threads (e.g. loading
+    # GOES images in twinotter.plots.flight_track_frames) don't nest in others
+    if not hasattr(_threads, "running"):
+        _threads.running = []
+
+    return _threads.running
+
+
+def _run_in_worker(function, *args, **kwargs):
+    # Call the function and take the spans it recorded from this process, so they
+    # can be returned to the main process (see in_worker)
+    start = len(_records)
+    result = function(*args, **kwargs)
+    records = _records[start:]
+    del _records[start:]
+
+    return result, records
+
+
+def _write_at_exit():
+    # Worker processes (e.g. from load_campaign) inherit the environment variable
+    # but only the main process writes the report. Workers return their spans with
+    # in_worker instead
+    if multiprocessing.current_process().name != "MainProcess":
+        return
+
+    if _report_path is not None and _records:
+        write_report(_report_path)
+
+
+# Turn on profiling for the whole program from the environment
+start(os.environ.get(env_var))
@@ -1,5 +1,7 @@
 import re
 
+from . import profiling
+
 
 def parse_docopt_arguments(function, __doc__):
     """
@@ -19,6 +21,9 @@ def parse_docopt_arguments(function, __doc__):
     # Remove the help argument
     del arguments["--help"]
 
+    # Turn on profiling if requested. This isn't an argument of the function
+    profiling.start(arguments.pop("--profile", None))
+
     # Parse the remaining arguments
     parsed_arguments = {}
     for arg in arguments.keys():
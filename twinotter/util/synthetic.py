@@ -0,0 +1,472 @@
+"""
+Synthetic MASIN and GOES files for benchmarks and offline tests
+
+The MASIN files mimic the layout of the real core_masin netCDF files: a data_point
+dimension with a Time variable, a `*_FLAG` variable for each measurement and
+integer `units` attributes (which :func:`twinotter.load_flight` has to fix). The
+aircraft flies around the EUREC4A circle with alternating profiles and level legs
+and a matching flight-segments description can be generated.
+
+> python -m twinotter.util.synthetic /path/to/output --frequency 1 10 50 --hours 4
+"""
+import datetime
+from pathlib import Path
+
+import numpy as np
+import netCDF4
+import yaml
+
+from .. import MASIN_CORE_FORMAT
+from ..external import eurec4a
+from . import profiling
+
+
+# The variables written to the MASIN files (name: (units, standard_name))
+variables = dict(
+    LAT_OXTS=("degree_north", "latitude"),
+    LON_OXTS=("degree_east", "longitude"),
+    ALT_OXTS=("m", "altitude"),
+    ROLL_OXTS=("degree", "platform_roll_angle"),
+    PTCH_OXTS=("degree", "platform_pitch_angle"),
+    HDG_OXTS=("degree", "platform_yaw_angle"),
+    VELN_OXTS=("m s-1", "platform_speed_wrt_ground_northward"),
+    VELE_OXTS=("m s-1", "platform_speed_wrt_ground_eastward"),
+    VELZ_OXTS=("m s-1", "platform_speed_wrt_ground_upward"),
+    U_OXTS=("m s-1", "eastward_wind"),
+    V_OXTS=("m s-1", "northward_wind"),
+    W_OXTS=("m s-1", "upward_air_velocity"),
+    TAT_ND_R=("K", "air_temperature"),
+    TAT_DI_R=("K", "air_temperature"),
+    TDEW_BUCK=("K", "dew_point_temperature"),
+    PS_AIR=("hPa", "air_pressure"),
+    H2O_LICOR=(1, "mole_fraction_of_water_vapor_in_air"),
+    CO2_LICOR=(1, "mole_fraction_of_carbon_dioxide_in_air"),
+    SW_DN_C=("W m-2", "downwelling_shortwave_flux_in_air"),
+    SW_UP_C=("W m-2", "upwelling_shortwave_flux_in_air"),
+    LW_DN_C=("W m-2", "downwelling_longwave_flux_in_air"),
+    LW_UP_C=("W m-2", "upwelling_longwave_flux_in_air"),
+    CPC_CONC=("m-3", None),
+    HGT_RADR1=("m", "height"),
+)
+
+flag_meanings = (
+    "quality_good minor_data_quality_issue major_data_quality_issue "
+    "data_not_quality_controlled"
+)
+
+#: The altitudes (m) of the level legs, flown in order and repeated
+leg_altitudes = [2000, 1000, 200, 1500, 600]
+profile_duration = datetime.timedelta(minutes=5)
+leg_duration = datetime.timedelta(minutes=10)
+surface_altitude = 30
+
+#: The time taken to fly around the EUREC4A circle
+circle_duration = datetime.timedelta(hours=3)
+
+#: The GOES reflectance bands used for the geocolor images
+goes_bands = ["refl_0_65um_nom", "refl_0_86um_nom", "refl_0_47um_nom"]
+
+
+def main():
+    import argparse
+
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("output_path")
+    argparser.add_argument("--frequency", nargs="+", type=int, default=[1])
+    argparser.add_argument("--hours", type=float, default=4)
+    argparser.add_argument("--flights", nargs="+", type=int, default=[330])
+    argparser.add_argument("--goes", action="store_true")
+
+    profiling.add_argument(argparser)
+    args = argparser.parse_args()
+    profiling.start(args.profile)
+
+    for flight_number in args.flights:
+        for frequency in args.frequency:
+            filename = generate_flight(
+                args.output_path,
+                flight_number=flight_number,
+                frequency=frequency,
+                duration=datetime.timedelta(hours=args.hours),
+            )
+            print("Generated {}".format(filename))
+
+    if args.goes:
+        for filename in generate_goes_flight(
+            Path(args.output_path) / "goes",
+            duration=datetime.timedelta(hours=args.hours),
+        ):
+            print("Generated {}".format(filename))
+
+    return
+
+
+def generate_flight(
+    root,
+    date=datetime.date(2020, 1, 24),
+    revision=4,
+    flight_number=330,
+    frequency=1,
+    duration=datetime.timedelta(hours=4),
+    start=datetime.timedelta(hours=11),
+    bad_fraction=0.02,
+    seed=0,
+):
+    """Write a synthetic MASIN file and its flight segments to a flight directory
+
+    The files are written to `root/flightNNN/` with the same layout as the test
+    data: the MASIN file in the "MASIN" subdirectory and the flight segments
+    (`flight_segments.yaml`) in the flight directory. See :func:`generate` for the
+    arguments.
+
+    Returns:
+        pathlib.Path: The path to the MASIN file
+    """
+    flight_data_path = Path(root) / "flight{}".format(flight_number)
+    filename = generate(
+        flight_data_path / "MASIN",
+        date=date,
+        revision=revision,
+        flight_number=flight_number,
+        frequency=frequency,
+        duration=duration,
+        start=start,
+        bad_fraction=bad_fraction,
+        seed=seed,
+    )
+
+    generate_segments(
+        flight_data_path / "flight_segments.yaml",
+        date=date,
+        flight_number=flight_number,
+        duration=duration,
+        start=start,
+    )
+
+    return filename
+
+
+def generate(
+    path,
+    date=datetime.date(2020, 1, 24),
+    revision=4,
+    flight_number=330,
+    frequency=1,
+    duration=datetime.timedelta(hours=4),
+    start=datetime.timedelta(hours=11),
+    bad_fraction=0.02,
+    seed=0,
+):
+    """Write a synthetic MASIN core file
+
+    Args:
+        path (str): The directory to write the file to
+        date (datetime.date): The date of the flight
+        revision (int): The revision number in the filename
+        flight_number (int): The flight number in the filename
+        frequency (int): The sample rate in Hz (1, 10 or 50 for real data)
+        duration (datetime.timedelta): The length of the flight
+        start (datetime.timedelta): The take-off time after midnight
+        bad_fraction (float): The fraction of points with bad position data. These
+            points have NaN positions and major issues flagged in the `*_OXTS_FLAG`
+            variables. Minor issues are also flagged in the other variables at
+            half this fraction of the points
+        seed (int): Seed for the random number generator
+
+    Returns:
+        pathlib.Path: The path to the generated file
+    """
+    rng = np.random.default_rng(seed)
+
+    n_points = int(duration.total_seconds() * frequency)
+    seconds = start.total_seconds() + np.arange(n_points) / frequency
+
+    data = _flight_data(seconds - seconds[0], duration, rng)
+
+    filename = Path(path) / MASIN_CORE_FORMAT.format(
+        date=date.strftime("%Y%m%d"),
+        revision="{:03d}".format(revision),
+        flight_num="{:03d}".format(flight_number),
+        freq=frequency,
+    )
+    filename.parent.mkdir(parents=True, exist_ok=True)
+
+    bad_position = rng.random(n_points) < bad_fraction
+    with netCDF4.Dataset(str(filename), "w") as dataset:
+        dataset.createDimension("data_point", n_points)
+
+        time = dataset.createVariable("Time", "f8", ("data_point",))
+        time.units = "seconds since {} 00:00:00 +0000".format(date.isoformat())
+        time.standard_name = "time"
+        time[:] = seconds
+
+        for name, (units, standard_name) in variables.items():
+            values = data[name].astype("f4")
+            flags = np.zeros(n_points, dtype="i1")
+            if name.endswith("_OXTS"):
+                flags[bad_position] = 2
+            else:
+                flags[rng.random(n_points) < bad_fraction / 2] = 1
+            if name in ["LAT_OXTS", "LON_OXTS"]:
+                values[bad_position] = np.nan
+
+            variable = dataset.createVariable(
+                name, "f4", ("data_point",), fill_value=np.float32(-9999.0)
+            )
+            variable.units = units
+            if standard_name is not None:
+                variable.standard_name = standard_name
+            variable.long_name = name
+            variable[:] = values
+
+            flag = dataset.createVariable(name + "_FLAG", "i1", ("data_point",))
+            # The MASIN files have integer units for the flags
+            flag.units = 1
+            flag.flag_values = np.array([0, 1, 2, 3], dtype="i1")
+            flag.flag_meanings = flag_meanings
+            flag[:] = flags
+
+        dataset.time_coverage_start = _format_time(seconds[0])
+        dataset.time_coverage_end = _format_time(seconds[-1])
+        dataset.data_date = date.strftime("%Y%m%d")
+        dataset.comment = "Synthetic data generated by twinotter.util.synthetic"
+
+    return filename
+
+
+def generate_segments(
+    filename=None,
+    date=datetime.date(2020, 1, 24),
+    flight_number=330,
+    duration=datetime.timedelta(hours=4),
+    start=datetime.timedelta(hours=11),
+):
+    """The flight segments of a synthetic flight
+
+    Args:
+        filename (str): Write the segments to this yaml file. Default is to only
+            return them
+        date (datetime.date): See :func:`generate`
+        flight_number (int): See :func:`generate`
+        duration (datetime.timedelta): See :func:`generate`
+        start (datetime.timedelta): See :func:`generate`
+
+    Returns:
+        dict: The flight segments in the same format as
+            :func:`twinotter.load_segments`
+    """
+    takeoff = datetime.datetime.combine(date, datetime.time()) + start
+    flight_id = "TO-{:04d}".format(flight_number)
+
+    segments = dict(
+        name="synthetic",
+        mission="EUREC4A",
+        platform="TO",
+        flight_id=flight_id,
+        contacts=[],
+        date=date,
+        flight_report="",
+        takeoff=takeoff,
+        landing=takeoff + duration,
+        events=[],
+        remarks=["Synthetic data generated by twinotter.util.synthetic"],
+        segments=[
+            dict(
+                kinds=[kind],
+                name="",
+                irregularities=[],
+                segment_id="{}_{:02d}".format(flight_id, n),
+                start=takeoff + segment_start,
+                end=takeoff + segment_end,
+            )
+            for n, (kind, segment_start, segment_end, *altitudes) in enumerate(
+                _flight_pattern(duration)
+            )
+        ],
+    )
+
+    if filename is not None:
+        with open(filename, "w") as yaml_file:
+            yaml.dump(segments, yaml_file, sort_keys=False)
+
+    return segments
+
+
+def generate_goes(
+    path,
+    time=datetime.datetime(2020, 1, 24, 14, 0),
+    shape=(300, 560),
+    seed=0,
+):
+    """Write a synthetic GOES (clavrx level2) file
+
+    The latitude and longitude are on a slightly skewed grid covering
+    :data:`twinotter.external.goes.default_bbox`, like the satellite projection.
+
+    Args:
+        path (str): The directory to write the file to
+        time (datetime.datetime): The time of the image
+        shape (tuple): The number of scan lines and pixels
+        seed (int): Seed for the random number generator
+
+    Returns:
+        pathlib.Path: The path to the generated file
+    """
+    from ..external import goes
+
+    rng = np.random.default_rng(seed)
+
+    filename = Path(path) / goes.nc_filename.format(
+        year=time.year,
+        day=time.timetuple().tm_yday,
+        hour=time.hour,
+        minute=time.minute,
+        something="165",
+    )
+    filename.parent.mkdir(parents=True, exist_ok=True)
+
+    lat_min, lon_min, lat_max, lon_max = goes.default_bbox
+    ny, nx = shape
+    lat = np.linspace(lat_min, lat_max, ny)[:, None] + np.linspace(0, 0.002, nx)
+    lon = (
+        np.linspace(lon_min, lon_max, nx)[None, :] + np.linspace(0, 0.002, ny)[:, None]
+    )
+
+    dims = ("scan_lines_along_track_direction", "pixel_elements_along_scan_direction")
+    with netCDF4.Dataset(str(filename), "w") as dataset:
+        for dim, size in zip(dims, shape):
+            dataset.createDimension(dim, size)
+
+        for name, values in [("latitude", lat), ("longitude", lon)]:
+            variable = dataset.createVariable(name, "f4", dims)
+            variable[:] = values
+
+        for band in goes_bands:
+            variable = dataset.createVariable(
+                band, "f4", dims, fill_value=np.float32(-999)
+            )
+            variable.coordinates = "longitude latitude"
+            variable[:] = 100 * rng.random(shape)
+
+    return filename
+
+
+def generate_goes_flight(
+    path,
+    date=datetime.date(2020, 1, 24),
+    duration=datetime.timedelta(hours=4),
+    start=datetime.timedelta(hours=11),
+    shape=(300, 560),
+):
+    """Write a synthetic GOES file every 10 minutes covering a synthetic flight
+
+    Args:
+        path (str): The directory to write the files to
+        date (datetime.date): See :func:`generate`
+        duration (datetime.timedelta): See :func:`generate`
+        start (datetime.timedelta): See :func:`generate`
+        shape (tuple): See :func:`generate_goes`
+
+    Returns:
+        list: The paths to the generated files
+    """
+    from ..external import goes
+
+    takeoff = datetime.datetime.combine(date, datetime.time()) + start
+    first = takeoff - takeoff.minute % 10 * datetime.timedelta(minutes=1)
+
+    filenames = []
+    time = first.replace(second=0, microsecond=0)
+    while time <= takeoff + duration + goes.time_resolution:
+        filenames.append(
+            generate_goes(path, time=time, shape=shape, seed=len(filenames))
+        )
+        time += goes.time_resolution
+
+    return filenames
+
+
+def _flight_pattern(duration):
+    # Alternating profiles and level legs filling the flight, starting and ending
+    # with a profile from/to the surface
+    # (kind, start, end, altitude at start, altitude at end)
+    pattern = []
+    altitude = surface_altitude
+    time = datetime.timedelta(0)
+    n = 0
+    while time + 2 * profile_duration + leg_duration <= duration:
+        leg_altitude = leg_altitudes[n % len(leg_altitudes)]
+        pattern.append(
+            ("profile", time, time + profile_duration, altitude, leg_altitude)
+        )
+        time += profile_duration
+        pattern.append(("level", time, time + leg_duration, leg_altitude, leg_altitude))
+        time += leg_duration
+
+        altitude = leg_altitude
+        n += 1
+
+    pattern.append(("profile", time, duration, altitude, surface_altitude))
+
+    return pattern
+
+
+def _flight_data(seconds, duration, rng):
+    # Idealised measurements along the flight
+    n_points = len(seconds)
+
+    altitude = np.zeros(n_points)
+    for kind, start, end, altitude_start, altitude_end in _flight_pattern(duration):
+        idx = (seconds >= start.total_seconds()) & (seconds <= end.total_seconds())
+        altitude[idx] = np.interp(
+            seconds[idx],
+            [start.total_seconds(), end.total_seconds()],
+            [altitude_start, altitude_end],
+        )
+
+    # Fly around the EUREC4A circle
+    phase = 2 * np.pi * seconds / circle_duration.total_seconds()
+    lat = eurec4a.lat + eurec4a.r * np.sin(phase)
+    lon = eurec4a.lon + eurec4a.r * np.cos(phase)
+    heading = np.rad2deg(-phase) % 360
+
+    speed = 2 * np.pi * eurec4a.r * 111e3 / circle_duration.total_seconds()
+    temperature = 300 - 0.0065 * altitude
+
+    return dict(
+        LAT_OXTS=lat,
+        LON_OXTS=lon,
+        ALT_OXTS=altitude,
+        ROLL_OXTS=rng.normal(0, 3, n_points),
+        PTCH_OXTS=rng.normal(0, 1, n_points),
+        HDG_OXTS=heading,
+        VELN_OXTS=speed * np.cos(phase),
+        VELE_OXTS=-speed * np.sin(phase),
+        VELZ_OXTS=np.gradient(altitude, seconds) if n_points > 1 else altitude * 0,
+        U_OXTS=-8 + rng.normal(0, 1, n_points),
+        V_OXTS=-2 + rng.normal(0, 1, n_points),
+        W_OXTS=rng.normal(0, 0.5, n_points),
+        TAT_ND_R=temperature + rng.normal(0, 0.1, n_points),
+        TAT_DI_R=temperature + 0.2 + rng.normal(0, 0.1, n_points),
+        TDEW_BUCK=293 - 0.006 * altitude,
+        PS_AIR=1013.25 * np.exp(-altitude / 8400),
+        H2O_LICOR=0.02 * np.exp(-altitude / 2500),
+        CO2_LICOR=np.full(n_points, 4.1e-4),
+        SW_DN_C=np.full(n_points, 800.0),
+        SW_UP_C=np.full(n_points, 60.0),
+        LW_DN_C=380 - 0.05 * altitude,
+        LW_UP_C=np.full(n_points, 460.0),
+        CPC_CONC=3e8 + rng.normal(0, 1e7, n_points),
+        HGT_RADR1=altitude,
+    )
+
+
+def _format_time(seconds):
+    seconds = int(seconds)
+    return "{:02d}:{:02d}:{:02d} UTC".format(
+        seconds // 3600, seconds % 3600 // 60, seconds % 60
+    )
+
+
+if __name__ == "__main__":
+    main()